@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Acquisition benchmark
+
+Runs the real CameraWorker, DAQWorker and KeysightWorker against simulated
+hardware (simulated_hardware.py) for a matrix of settings, and measures what
+the acquisition actually sustains:
+
+    frames_per_s / rows_per_s       - frames and CSV rows written per second
+    frames_dropped / samples_lost   - frames the camera had to throw away and DAQ samples overwritten
+    frames_missing                  - frames the camera should have produced but aren't in the file
+    cpu_percent                     - CPU time / wall time (100 = one core), camera process included
+    peak_memory_mb                  - peak resident memory during the run
+    write_mb_s                      - bytes written to disk per second (images + CSV)
+
+Each configuration's result is appended to a JSON lines file with the git
+commit it was run on. The last result for the same configuration from a
+different commit is used as the baseline, and slower throughput, more drops
+or more CPU than that are reported as regressions.
+
+Example:
+    python acquisition_benchmark.py --fps 10 30 --roi 1385x490 4096x3000 --codec none zstd --duration 20
+
+@author: edh1g18
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import simulated_hardware
+from PyQt6.QtCore import QCoreApplication
+from acquisition_workers import CameraWorker, DAQWorker, KeysightWorker
+from telemetry import TelemetryBus
+from frame_writers import memmap_stack, recording_path
+from experiment_reader import count_rows
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Simulated channel layout (same as config.ini)
+AI_MAP = {"Matsusada read in": 0, "Current collector (FEMTO)": 1, "Camera FVAL": 2}
+AO_MAP = {"Matsusada control": 0, "Camera control": 2}
+
+# Tolerances before a change against the baseline counts as a regression
+REGRESSION_LIMITS = {
+    "frames_per_s": 0.95,       # Throughput below 95% of the baseline
+    "rows_per_s": 0.95,
+    "cpu_percent": 1.25,        # CPU use up by more than 25%
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def memory_mb():
+    """Resident memory of this process now (psutil), or the peak so far if psutil isn't installed"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1e6
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3    # kB on Linux
+    except ImportError:
+        return None
+
+
+def cpu_seconds():
+    """CPU time used by this process and its finished children"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def parse_roi(text):
+    """ "WxH" -> a centred ROI of that size on the 4096x3000 sensor """
+    width, height = (int(v) for v in text.lower().split("x"))
+    left = (4096 - width) // 2 // 4 * 4
+    top = (3000 - height) // 2 // 4 * 4
+    return [left, top, left + width, top + height]
+
+
+def count_frames(filepath):
+    if not os.path.exists(filepath):
+        return 0
+    if filepath.endswith("_DELTA.h5"):
+        from delta_codec import DeltaReader
+        with DeltaReader(filepath) as stack:
+            return len(stack)
+    if filepath.endswith("_PACKED.h5"):
+        from bitpack import PackedReader
+        with PackedReader(filepath) as stack:
+            return len(stack)
+    stack = memmap_stack(filepath)
+    if stack is not None:
+        return stack.shape[0]
+    import tifffile
+    with tifffile.TiffFile(filepath) as tif:
+        return len(tif.pages)
+
+
+def run_config(config, duration_s, workdir, log=print):
+    """Run one configuration for duration_s seconds. Returns a dict of metrics."""
+    simulated_hardware.install(fps=config["fps"])
+    prefix = os.path.join(workdir, f"BENCH_{time.strftime('%H%M%S')}_{config['fps']}fps")
+
+    bus = TelemetryBus()
+    cam_worker = CameraWorker()
+    daq_worker = DAQWorker()
+    ks_worker = KeysightWorker()
+    for worker in (cam_worker, daq_worker, ks_worker):
+        worker.bus = bus
+    ks_worker.ks_reading.connect(daq_worker.update_ks_value)
+
+    cam_worker.filepath = f"{prefix}_IMAGES.tiff"
+    cam_worker.ROI = parse_roi(config["roi"])
+    cam_worker.trigger_mode = "Software"
+    cam_worker.compression = config["codec"]
+    cam_worker.use_process = config["process"]
+
+    daq_worker.use_camera = True
+    daq_worker.filepath = f"{prefix}_DATA.csv"
+    daq_worker.ai_channels_to_use = list(range(config["channels"]))
+    daq_worker.ao_channels_to_use = sorted(AO_MAP.values())
+    daq_worker.ai_map = AI_MAP
+    daq_worker.ao_map = AO_MAP
+    daq_worker.cam_timing_mode = "Continuous"
+    daq_worker.set_voltage(1000.0)
+    daq_worker.set_hightime(1.0)
+    daq_worker.set_polarity_mode("Bipolar switching")
+    daq_worker.set_fps(config["fps"])
+    daq_worker.sample_rate = 1.0 / config["ai_rate"]
+    daq_worker.last_cam_trigger_time = time.time()
+
+    frames_displayed = 0
+    peak_memory = memory_mb() or 0.0
+    cpu_start = cpu_seconds()
+    t_start = time.perf_counter()
+
+    cam_worker.start()
+    daq_worker.start()
+    ks_worker.start()
+
+    # Drain the telemetry as the GUI would, so that cost is included
+    while time.perf_counter() - t_start < duration_s:
+        QCoreApplication.processEvents()
+        snapshot = bus.drain()
+        if snapshot["frame"] is not None:
+            frames_displayed += 1
+        for line in snapshot["log"]:
+            if "Error" in line:
+                log(f"  {line}")
+        peak_memory = max(peak_memory, memory_mb() or 0.0)
+        time.sleep(1 / 30)
+
+    cam_worker.stop()
+    daq_worker.stop()
+    ks_worker.stop()
+    wall_s = time.perf_counter() - t_start
+    cpu_s = cpu_seconds() - cpu_start
+
+    counters = simulated_hardware.counters()
+    image_fp = recording_path(cam_worker.filepath, config["codec"])
+    frames = count_frames(image_fp)
+    rows = count_rows(daq_worker.filepath) if os.path.exists(daq_worker.filepath) else 0
+    bytes_written = sum(os.path.getsize(f) for f in (image_fp, daq_worker.filepath) if os.path.exists(f))
+    expected_frames = counters["frames_produced"] + counters["frames_dropped"]
+    if config["process"]:
+        expected_frames = frames    # The camera is in another process, its counters aren't visible here
+
+    metrics = {
+        "wall_s": wall_s,
+        "frames_written": frames,
+        "frames_per_s": frames / wall_s,
+        "frames_dropped": counters["frames_dropped"],
+        "frames_missing": max(0, expected_frames - frames),
+        "frames_displayed": frames_displayed,
+        "rows_written": rows,
+        "rows_per_s": rows / wall_s,
+        "samples_lost": counters["samples_lost"],
+        "cpu_percent": 100 * cpu_s / wall_s,
+        "peak_memory_mb": peak_memory,
+        "write_mb_s": bytes_written / wall_s / 1e6,
+        }
+
+    for path in (image_fp, daq_worker.filepath):
+        if os.path.exists(path):
+            os.remove(path)
+    return metrics
+
+
+def config_key(config):
+    return json.dumps(config, sort_keys=True)
+
+
+def load_history(results_fp):
+    if not os.path.exists(results_fp):
+        return []
+    with open(results_fp) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_regressions(metrics, baseline):
+    """Descriptions of every way `metrics` is worse than `baseline`"""
+    problems = []
+    for key in ("frames_per_s", "rows_per_s"):
+        if metrics[key] < baseline[key] * REGRESSION_LIMITS[key]:
+            problems.append(f"{key} {baseline[key]:.1f} -> {metrics[key]:.1f}")
+    if metrics["cpu_percent"] > baseline["cpu_percent"] * REGRESSION_LIMITS["cpu_percent"]:
+        problems.append(f"cpu_percent {baseline['cpu_percent']:.0f} -> {metrics['cpu_percent']:.0f}")
+    for key in ("frames_dropped", "frames_missing", "samples_lost"):
+        if metrics[key] > baseline[key] * 1.5 + 2:
+            problems.append(f"{key} {baseline[key]} -> {metrics[key]}")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the acquisition pipeline on simulated hardware.")
+    parser.add_argument("--fps", type=float, nargs="+", default=[10.0], help="Camera frame rates")
+    parser.add_argument("--roi", nargs="+", default=["1385x490"], help="ROI sizes as WIDTHxHEIGHT")
+    parser.add_argument("--ai-rate", type=float, nargs="+", default=[250.0], help="DAQ sample rates (Hz)")
+    parser.add_argument("--channels", type=int, nargs="+", default=[3], help="Number of AI channels")
+    parser.add_argument("--codec", nargs="+", default=["none"], help="Recording compression (frame_writers.RECORDING_FORMATS)")
+    parser.add_argument("--process", action="store_true", help="Also run each configuration with the camera in its own process")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per configuration")
+    parser.add_argument("--workdir", help="Where to write the recordings (use the real data disk)")
+    parser.add_argument("--results", default="acquisition_benchmark.jsonl", help="JSON lines file results are appended to")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if anything regressed")
+    args = parser.parse_args(argv)
+
+    app = QCoreApplication(sys.argv[:1])
+    commit = git_commit()
+    history = load_history(args.results)
+    machine = {"platform": platform.platform(), "cpu_count": os.cpu_count(), "python": sys.version.split()[0]}
+
+    modes = [False, True] if args.process else [False]
+    configs = [{"fps": fps, "roi": roi, "ai_rate": ai_rate, "channels": channels, "codec": codec, "process": process}
+               for fps, roi, ai_rate, channels, codec, process
+               in itertools.product(args.fps, args.roi, args.ai_rate, args.channels, args.codec, modes)]
+
+    regressions = 0
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        for config in configs:
+            print(f"Running {config_key(config)} for {args.duration:.0f} s...", flush=True)
+            metrics = run_config(config, args.duration, workdir)
+            print("  " + ", ".join(f"{key} {value:.1f}" if isinstance(value, float) else f"{key} {value}"
+                                   for key, value in metrics.items()), flush=True)
+
+            baseline = [entry for entry in history
+                        if config_key(entry["config"]) == config_key(config) and entry["commit"] != commit]
+            if baseline:
+                problems = find_regressions(metrics, baseline[-1]["metrics"])
+                for problem in problems:
+                    print(f"  REGRESSION vs {baseline[-1]['commit']}: {problem}")
+                regressions += len(problems)
+
+            entry = {"commit": commit, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "machine": machine,
+                     "config": config, "metrics": metrics}
+            with open(args.results, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+
+    simulated_hardware.uninstall()
+    del app
+    print(f"Results appended to {args.results}" + (f", {regressions} regressions" if regressions else ""))
+    return 1 if (regressions and args.fail_on_regression) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
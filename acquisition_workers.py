@@ -0,0 +1,954 @@
+# -*- coding: utf-8 -*-
+"""
+Acquisition workers
+
+The camera, NI DAQ and Keysight worker threads and the helpers that read
+their settings from the QSettings config file. Shared by the GUI
+(data_collection_threaded.py) and headless_acquisition.py, so they only need
+QtCore: importing this doesn't pull in QtWidgets or pyqtgraph.
+
+@author: edh1g18
+"""
+
+# Generic Python Libraries
+import lazy_imports
+import numpy as np
+import time
+import csv
+import datetime
+import multiprocessing
+import os
+from collections import deque
+
+with lazy_imports.timed("PyQt6"):
+    from PyQt6.QtCore import QThread, pyqtSignal
+from live_plot import rolling_mean, min_max_envelope
+from telemetry import TelemetryPublisher
+from camera_control import CameraSession, read_camera_metadata, frame_to_array, block_average
+from camera_process import SharedFrameRing, camera_process_main, drain_messages
+from frame_writers import open_frame_writer
+from metrics import metrics
+import resource_planner
+import storage_monitor
+from storage_monitor import StorageMonitor
+from triggered_recording import TriggeredRecorder
+from frame_reduction import FrameReducer, recording_compression, saved_fraction
+from frame_metrics import FrameMetricsLogger, metrics_path
+import multi_roi
+from multi_roi import MultiRoiWriter, parse_rois, enclosing_roi, rois_path, roi_compression
+
+# Hardware libraries are imported on first use (see lazy_imports.py) so the window opens quickly:
+#   National Instruments - nidaqmx (DAQWorker)
+#   ThorLabs and Camera/Image - thorlabs_tsi_sdk, tifffile (CameraWorker)
+#   Serial and VISA for talking to the Keysight - pyvisa, pyserial (KeysightWorker)
+
+# Per-stage timings, served with --metrics-port and saved in the metadata at stop (see metrics.py)
+cam_poll_time = metrics.histogram("camera_poll_seconds", "Waiting for the next frame from the camera")
+cam_copy_time = metrics.histogram("camera_copy_seconds", "Copying (and binning) a frame out of the SDK buffer")
+cam_emit_time = metrics.histogram("camera_emit_seconds", "Handing a frame to the display")
+cam_write_time = metrics.histogram("camera_write_seconds", "Writing a frame to disk")
+cam_frames = metrics.counter("camera_frames_total", "Frames received from the camera")
+daq_read_time = metrics.histogram("daq_read_seconds", "Reading the available samples from the DAQ")
+daq_process_time = metrics.histogram("daq_process_seconds", "Scaling, taring and FVAL edge detection of a chunk")
+daq_rows_time = metrics.histogram("daq_rows_seconds", "Building the CSV rows of a chunk")
+daq_write_time = metrics.histogram("daq_write_seconds", "Writing a chunk to the CSV")
+daq_emit_time = metrics.histogram("daq_emit_seconds", "Making and sending the plot envelope of a chunk")
+daq_samples = metrics.counter("daq_samples_total", "Samples read from the DAQ (per channel)")
+
+# --- WORKER THREAD 1: CAMERA CONTROL ---
+class CameraWorker(QThread, TelemetryPublisher):
+    image_ready = pyqtSignal(object)  # Sends numpy array
+    log_message = pyqtSignal(str)
+    camera_metadata = pyqtSignal(dict) # for logging camera settings to metadata
+    
+    def __init__(self):
+        super().__init__()
+        self.is_running = False
+        self.camera = None
+        self.sdk = None
+        
+        # Settings
+        self.exposure_time_us = 2000 # 2ms default timeout
+        self.trigger_mode = "Hardware"
+        self.ROI = [0, 0, 4096, 3000]    # Full sensor [TL_x, TL_y, BR_x, BR_y]
+        self.filepath = ""
+        self.use_process = False         # Acquire/save in a separate process (camera_process.py)
+        self.session = None              # Long-lived CameraSession, if None one is opened just for this run
+        self.binning = 1                 # NxN binning (on-sensor if supported, otherwise block averaged)
+        self.preview_fps = 0             # Cap on frames sent to the display (0 for no cap)
+        self.compression = "none"        # Recording compression (see frame_writers.RECORDING_FORMATS)
+        self.storage_policy = "alert"    # What to do if the disk can't keep up (see storage_monitor.py)
+        self.storage_summary = None      # Frames saved and any policy changes, once the run has finished
+        self.record_mode = "Continuous"  # "Triggered" only saves frames around events (see triggered_recording.py)
+        self.pre_trigger_frames = 10
+        self.post_trigger_frames = 30
+        self.recorder = None
+        self.trigger_queue = None        # Events for the camera process, when it's in one
+        self.reduction = "None"          # "Mean"/"Sum" of reduce_frames frames saved instead (see frame_reduction.py)
+        self.reduce_frames = 10
+        self.reduce_binning = 1
+        self.reduce_by_polarity = False
+        self.reducer = None
+        self.polarity = (1, 0)           # Latest DAQ output state and the Frame ID it switched at, for reduce_by_polarity
+        self.polarity_queue = None       # Switches for the camera process, when it's in one
+        self.frame_metrics = True        # Log per-frame intensity/plume metrics while recording (see frame_metrics.py)
+        self.metrics_stride = 4
+        self.sub_rois = {}               # {name: [TL_x, TL_y, BR_x, BR_y]} saved instead of the whole ROI (see multi_roi.py)
+
+    def run(self):
+        self.is_running = True
+        self.publish_log("Camera: Initializing SDK...")
+        
+        if self.use_process:
+            self.run_in_process()
+            return
+
+        session = self.session if self.session is not None else CameraSession()
+        writer = monitor = metrics_logger = self.recorder = self.reducer = None
+
+        try:
+            # 1. Initialize SDK & Camera (only slow the first time a session is opened)
+            self.camera = session.open()
+            self.sdk = session.sdk
+            
+            if self.camera is None:
+                self.publish_log("Camera: No cameras found!")
+                return
+            
+            # 2. Configure Camera (ROI, exposure, trigger mode) and arm it, if not already armed that way
+            software_binning = session.configure(self.ROI, self.exposure_time_us, self.trigger_mode, self.publish_log,
+                                                 binning=self.binning, frame_rate=self.preview_fps or None)
+            
+            # Metadata handling
+            self.camera_metadata.emit(read_camera_metadata(self.camera))
+            
+            # Kept open for the whole run (uncompressed recordings are one contiguous, memmappable block)
+            if self.filepath:
+                triggered = self.record_mode == "Triggered"
+                if triggered:
+                    self.recorder = TriggeredRecorder(self.pre_trigger_frames, self.post_trigger_frames)
+                elif self.reduction in ("Mean", "Sum"):
+                    self.reducer = FrameReducer(self.reduce_frames, self.reduction, self.reduce_binning, self.reduce_by_polarity)
+                    self.reducer.set_polarity(*self.polarity)
+                compression = recording_compression(self.compression, self.reducer, self.publish_log)
+                if self.sub_rois:
+                    compression = roi_compression(compression, self.publish_log)
+                    binning = self.binning * (self.reducer.binning if self.reducer is not None else 1)
+                    writer = MultiRoiWriter(rois_path(self.filepath), self.sub_rois, self.camera.roi, binning, compression)
+                else:
+                    writer = open_frame_writer(self.filepath, compression)
+                monitor = StorageMonitor(os.path.dirname(self.filepath) or ".", self.storage_policy, compression,
+                                         decimate=self.recorder is None and self.reducer is None)
+                if self.frame_metrics:
+                    metrics_logger = FrameMetricsLogger(metrics_path(self.filepath), self.metrics_stride,
+                                                        (1 << self.camera.bit_depth) - 1,
+                                                        on_row=self.bus.post_metrics if self.bus is not None else None)
+                    metrics_logger.start()
+
+            # 3. Continuous Loop
+            # Trigger first frame if in Software mode
+            if self.trigger_mode == "Software":
+                self.camera.issue_software_trigger()
+
+            while self.is_running:
+                t = time.perf_counter_ns()
+                frame = self.camera.get_pending_frame_or_null()
+                t = cam_poll_time.record_since(t)
+                
+                if frame:
+                    cam_frames.inc()
+                    # 1. Reshape into a 2D image and copy (safety for threading), binning if needed
+                    final_image = block_average(frame_to_array(frame, self.camera), software_binning)
+                    t = cam_copy_time.record_since(t)
+                    if metrics_logger is not None:
+                        metrics_logger.submit(final_image)
+                    
+                    # 2. Emit
+                    if self.display_due():
+                        self.publish_frame(final_image)
+                        t = cam_emit_time.record_since(t)
+                    
+                    # Saving logic (every frame, the ones around events or the reduced images, unless the storage policy is skipping some)
+                    if writer is not None and monitor.should_save():
+                        bytes_before = writer.bytes_written
+                        if self.recorder is not None:
+                            to_save = self.recorder.add(final_image)
+                        elif self.reducer is not None:
+                            to_save = self.reducer.add(final_image)
+                        else:
+                            to_save = [final_image]
+                        for image in to_save:
+                            writer.write(image)
+                        if to_save:
+                            monitor.record_write(writer.bytes_written - bytes_before,
+                                                 (cam_write_time.record_since(t) - t) / 1e9, len(to_save))
+                    if monitor is not None:
+                        messages = monitor.check()
+                        for message in messages:
+                            self.publish_log(message)
+                        if messages:
+                            writer.set_compression(monitor.compression)     # In case the policy switched it
+
+                    if self.trigger_mode == "Software":
+                        self.camera.issue_software_trigger()
+
+        except Exception as e:
+            self.publish_log(f"Camera Error: {e}")
+            
+        finally:
+            if metrics_logger is not None:
+                metrics_logger.stop()
+                self.publish_log(f"Frame metrics: {metrics_logger.frames_logged} frames logged, "
+                                 f"{metrics_logger.frames_skipped} skipped")
+            if writer is not None:
+                if self.reducer is not None:
+                    for image in self.reducer.flush():
+                        writer.write(image)
+                writer.close()
+            if monitor is not None:
+                self.storage_summary = monitor.summary()
+                if self.recorder is not None:
+                    self.storage_summary["triggered"] = self.recorder.summary()
+                if self.reducer is not None:
+                    self.storage_summary["reduction"] = self.reducer.summary()
+            
+            # Keep a shared session open for next time, close one made just for this run
+            try:
+                if self.session is not None:
+                    session.end_run()
+                else:
+                    session.close()
+            except Exception as e:
+                self.publish_log(f"Camera Error: {e}")
+            self.camera = None
+            self.sdk = None
+            self.publish_log("Camera: Stopped." if self.session is not None else "Camera: Closed.")
+
+    def trigger_recording(self, reason, frame_id=0):
+        """Save the frames around an event (triggered mode). Can be called from any thread."""
+        if self.trigger_queue is not None:
+            self.trigger_queue.put((reason, frame_id or None))
+        elif self.recorder is not None:
+            self.recorder.trigger(reason, frame_id or None)
+
+    def set_polarity(self, state, frame_id=0):
+        """The DAQ output went high (1), low (-1) or off (0) after frame frame_id. Can be called from any thread."""
+        self.polarity = (state, frame_id)
+        if self.polarity_queue is not None:
+            self.polarity_queue.put((state, frame_id))
+        elif self.reducer is not None:
+            self.reducer.set_polarity(state, frame_id)
+
+    def display_due(self):
+        """True if a frame should go to the display now (limits it to preview_fps)"""
+        if not self.preview_fps:
+            return True
+        now = time.monotonic()
+        if now - getattr(self, "last_display_time", 0.0) >= 1.0 / self.preview_fps:
+            self.last_display_time = now
+            return True
+        return False
+
+    def run_in_process(self):
+        """
+        Acquire and save in a separate process (see camera_process.py). This
+        thread just passes on the newest frames from the shared memory ring,
+        and the log messages/metadata from the process.
+        """
+        # The process opens the camera itself, so this process has to let go of it
+        if self.session is not None:
+            self.session.close()
+        
+        # Slots big enough for a full sensor frame, whatever ROI the camera ends up with
+        ring = SharedFrameRing(n_slots=4, slot_bytes=4096 * 3000 * 2, create=True)
+        
+        context = multiprocessing.get_context("spawn")
+        stop_event = context.Event()
+        messages = context.Queue()
+        self.trigger_queue = context.Queue()
+        self.polarity_queue = context.Queue()
+        self.polarity_queue.put(self.polarity)
+        settings = {
+            "roi": list(self.ROI),
+            "exposure_time_us": self.exposure_time_us,
+            "trigger_mode": self.trigger_mode,
+            "binning": self.binning,
+            "frame_rate": self.preview_fps or None,
+            "filepath": self.filepath,
+            "compression": self.compression,
+            "storage_policy": self.storage_policy,
+            "record_mode": self.record_mode,
+            "pre_trigger_frames": self.pre_trigger_frames,
+            "post_trigger_frames": self.post_trigger_frames,
+            "reduction": self.reduction,
+            "reduce_frames": self.reduce_frames,
+            "reduce_binning": self.reduce_binning,
+            "reduce_by_polarity": self.reduce_by_polarity,
+            "frame_metrics": self.frame_metrics,
+            "metrics_stride": self.metrics_stride,
+            "sub_rois": self.sub_rois,
+            }
+        process = context.Process(target=camera_process_main,
+                                  args=(settings, ring.name, stop_event, messages, self.trigger_queue, self.polarity_queue),
+                                  daemon=True)
+        process.start()
+        self.publish_log(f"Camera: running in process {process.pid}, frames shared as '{ring.name}'")
+
+        last_seq = 0
+        try:
+            while self.is_running and process.is_alive():
+                for kind, payload in drain_messages(messages):
+                    if kind == "log":
+                        self.publish_log(payload)
+                    elif kind == "metadata":
+                        self.camera_metadata.emit(payload)
+                    elif kind == "storage":
+                        self.storage_summary = payload
+                    elif kind == "metrics" and self.bus is not None:
+                        self.bus.post_metrics(payload)
+                
+                seq = ring.latest_sequence
+                if seq > last_seq and self.display_due():
+                    seq, image = ring.read(seq)
+                    if image is not None:
+                        self.publish_frame(image)
+                    last_seq = seq
+                else:
+                    time.sleep(0.005)
+        finally:
+            stop_event.set()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+            for kind, payload in drain_messages(messages):
+                if kind == "log":
+                    self.publish_log(payload)
+                elif kind == "storage":
+                    self.storage_summary = payload
+            ring.close()
+            self.trigger_queue = self.polarity_queue = None
+
+    def stop(self):
+        self.is_running = False
+        self.wait()
+
+# --- WORKER THREAD 2: NI DAQ CONTROL ---
+class DAQWorker(QThread, TelemetryPublisher):
+    data_ready = pyqtSignal(dict) # Sends the plot envelope of a chunk (see DAQWorker.run)
+    log_message = pyqtSignal(str)
+    photo_triggered = pyqtSignal(float, float)   # Plot time (s since the AI start) and voltage of a camera trigger
+    recording_event = pyqtSignal(str, int)  # Reason and Frame ID of an event to record around (triggered recording)
+    polarity_changed = pyqtSignal(int, int) # Output state (1 high, -1 low (bipolar) or 0 off (unipolar)) and the Frame ID it switched after
+    
+    def __init__(self):
+        super().__init__()
+        self.is_running = False
+        
+        # Initialise set-up variables
+        self.filepath = "data.csv"
+        self.sample_rate = 4e-3 
+        self.latest_ks_value = 0.0
+        
+        # Initialise control variables
+        self.target_voltage = 0.0
+        self.polarity_mode = 0
+        self.high_time = 1 
+        self.cam_timing_mode = "Continuous"
+        self.cam_fps = 0    
+        self.use_camera = True
+        self.smooth_display = True
+        self.gain = 1E+6
+
+        # Averaging/taring variables
+        self.voltage_zero_offset = 0.0
+        self.request_tare = False
+        
+        # Camera sync variables
+        self.current_frame_id = 0
+        self.last_fval_state = False
+        self.last_cam_trigger_time = 0
+        
+        # Events for triggered recording (0 / False for off)
+        self.trigger_current_a = 0.0    # Collector current magnitude that counts as a spike
+        self.trigger_on_polarity = False
+        self.last_current_above = False
+        
+        # Initialise modules
+        self.ai_channel_name = "cDAQ9185-2023AF4Mod1"
+        self.ao_channel_name = "cDAQ9185-2023AF4Mod2"
+        self.ai_channels_to_use = [0, 1]
+        self.ao_channels_to_use = [0]
+        self.ai_lims = [-10, 10]
+        self.ao_lims = [-10, 10]
+        
+        # Define channels for purposes
+        self.ao_map = {}
+        self.ai_map = {}
+
+    def set_voltage(self, val):
+        self.target_voltage = val
+        
+    def set_polarity_mode(self, val):
+        self.polarity_mode = val
+
+    def set_hightime(self, val):
+        self.high_time = val
+        self.cam_half_way = val / 2.0  # Pre-calculate half-way point
+        
+    def set_gain(self, val):
+        self.gain = val
+        
+    def set_fps(self, val):
+        self.cam_fps = val
+        if val > 0:
+            self.cam_trigger_period = 1.0 / val  # Pre-calculate period
+        else:
+            self.cam_trigger_period = 0.1
+
+    def update_ks_value(self, val):
+        self.latest_ks_value = val
+
+    def trigger_point(self, now):
+        """Where a camera trigger sent at time.time() `now` goes on the plot: (s since the AI start, latest voltage)"""
+        start = getattr(self, "experiment_start_time", None)
+        t = now - start.timestamp() if start is not None else 0.0
+        return t, getattr(self, "last_display_volts", 0.0)
+
+    def run(self):
+        self.is_running = True
+        
+        # 1. Create Tasks
+        nidaqmx = lazy_imports.load("nidaqmx")
+        constants = lazy_imports.load("nidaqmx.constants")
+        AcquisitionType, READ_ALL_AVAILABLE = constants.AcquisitionType, constants.READ_ALL_AVAILABLE
+        self.ai_task = nidaqmx.Task()
+        self.ao_task = nidaqmx.Task()
+
+        try:
+            # --- SETUP PHASE: Build the Channel Maps ---
+            
+            # Lists to ensure we write/read in the exact order NI expects
+            self.ai_ordered_functions = [] 
+            self.ao_ordered_functions = []
+            
+            # CSV Headers start with Timestamp
+            csv_headers = ["Timestamp"]
+
+            # --- A. Setup AI Channels (Sorted Order) ---
+            sorted_ai = sorted(self.ai_channels_to_use)
+            for chan_idx in sorted_ai:
+                # Add physical channel
+                self.ai_task.ai_channels.add_ai_voltage_chan(
+                    f"{self.ai_channel_name}/ai{chan_idx}", 
+                    min_val=self.ai_lims[0], max_val=self.ai_lims[1],
+                    terminal_config = constants.TerminalConfiguration.RSE
+                )
+                
+                # Identify function (e.g. "Matsusada read in")
+                func_name = "Unknown"
+                # Look for this index in the map values
+                for name, mapped_idx in self.ai_map.items():
+                    if int(mapped_idx) == chan_idx:
+                        func_name = name
+                        break
+                
+                self.ai_ordered_functions.append(func_name)
+                csv_headers.append(f"{func_name} (AI{chan_idx})")
+                
+            self.publish_log(f"AI Configured: {self.ai_ordered_functions}")
+
+            # --- B. Setup AO Channels (Sorted Order) ---
+            sorted_ao = sorted(self.ao_channels_to_use)
+            for chan_idx in sorted_ao:
+                # Add physical channel
+                self.ao_task.ao_channels.add_ao_voltage_chan(
+                    f"{self.ao_channel_name}/ao{chan_idx}", 
+                    min_val=self.ao_lims[0], max_val=self.ao_lims[1]
+                )
+                
+                # Identify function (e.g. "Matsusada control")
+                func_name = "Unknown"
+                for name, mapped_idx in self.ao_map.items():
+                    if int(mapped_idx) == chan_idx:
+                        func_name = name
+                        break
+                        
+                self.ao_ordered_functions.append(func_name)
+                csv_headers.append(f"{func_name} (AO{chan_idx})")
+                
+            self.publish_log(f"AO Configured: {self.ao_ordered_functions}")
+
+            # --- C. Initialize CSV ---
+            csv_headers.append("Active Tare Offset (V)")
+            csv_headers.append("Gain (V/A)")
+            csv_headers.append("Emitter current (Keysight)")
+            csv_headers.append("Frame ID")
+            
+            # Hardware clock
+            self.hardware_rate_hz = 1.0 /self.sample_rate
+            
+            self.ai_task.timing.cfg_samp_clk_timing(rate = self.hardware_rate_hz,
+                                                    sample_mode = AcquisitionType.CONTINUOUS)
+            
+            # Slow down multiplexer to allow it to saturate even at high sample rates
+            try:
+                num_chans = len(self.ai_channels_to_use)
+                if num_chans > 1:
+                    # Space out the measurements evenly to give the Matsusada time to settle
+                    self.ai_task.timing.ai_conv_rate = self.hardware_rate_hz * num_chans * 1.2
+            except Exception:
+                pass
+            
+            # Create file with the dynamic headers
+            with open(self.filepath, mode='w', newline='') as f:
+                csv.writer(f).writerow(csv_headers)
+            
+            self.publish_log("DAQ Started. Logging data...")
+
+            # --- D. Initialize Timing Variables ---
+            last_switch_time = time.time()
+            is_high_state = True
+            self.polarity_changed.emit(1, self.current_frame_id)
+            self.last_current_above = False
+            self.set_fps(self.cam_fps)
+            self.set_hightime(self.high_time)
+            self.cam_pulse_width = 0.02 # pulse width
+            self.mid_cycle_flag = False
+            self.cam_pulse_counter = 0
+            
+            # Aveaging window for taring
+            tare_window_size = max(1, int(10 / self.sample_rate))   # 10s taring window
+            self.tare_buffer = deque(maxlen=tare_window_size)
+            
+            # Averaging window for plot smoothing (carried between chunks)
+            self.plot_window_size = max(1, int(0.2 / self.sample_rate))
+            self.volts_history = np.zeros(0)
+            self.amps_history = np.zeros(0)
+
+            # --- E. MAIN LOOP ---
+            with open(self.filepath, mode='a', newline='') as f:
+                writer = csv.writer(f)
+                
+                if self.ai_channels_to_use:
+                    self.ai_task.start()
+                    self.experiment_start_time = datetime.datetime.now()
+                    self.total_samples_read = 0
+                self.last_display_volts = 0.0   # Latest voltage sample, where camera triggers are marked
+                
+                while self.is_running:
+                    now = time.time()
+                    
+                    # --------------------------------------
+                    # 1. CALCULATE OUTPUTS (Logic Block)
+                    # --------------------------------------
+                    
+                    # Check if in a switching mode
+                    if self.polarity_mode != "Unipolar constant":
+                        # Check if it's time to switch
+                        if (now - last_switch_time) >= self.high_time:
+                            is_high_state = not is_high_state # toggle state
+                            last_switch_time = now
+                            self.mid_cycle_flag = False
+                            self.polarity_changed.emit(1 if is_high_state else -1 if self.polarity_mode == "Bipolar switching" else 0,
+                                                       self.current_frame_id)
+                            if self.trigger_on_polarity:
+                                self.recording_event.emit("polarity reversal", self.current_frame_id)
+                    else:
+                        is_high_state = True # Always "high" if constant
+                        self.mid_cycle_flag = True
+                        
+                    ao_data_out = []
+                    
+                    
+                    for func in self.ao_ordered_functions:
+                        val_to_write = 0.0
+                        
+                        if func == "Matsusada control":
+                            # Apply positive voltage if in high state
+                            if is_high_state:
+                                val_to_write = self.target_voltage/500 # Convert to scaled control voltage
+                            else:
+                                # Apply the negative voltage if in low state in bipolar
+                                if self.polarity_mode == "Bipolar switching":
+                                    val_to_write = -1 * self.target_voltage/500
+                                # Apply zero if in unipolar switching
+                                elif self.polarity_mode == "Unipolar switching":
+                                    val_to_write = 0.0
+                                else:
+                                    val_to_write = 0.0
+                                    self.publish_log(f"NO MATCHING POLARITY MODE: {self.polarity_mode}")                        
+                        
+                        elif func == "Camera control":
+                            val_to_write = 0.0
+                            
+                            if self.use_camera:
+                                if self.cam_timing_mode == "Continuous":
+                                    if (now - self.last_cam_trigger_time) >= self.cam_trigger_period:
+                                        val_to_write = 5.0
+                                        self.last_cam_trigger_time = now
+                                        self.publish_trigger(*self.trigger_point(now))
+                                        
+                                elif self.cam_timing_mode == "Mid-cycle":
+                                    time_in_state = now - last_switch_time
+                                    
+                                    if time_in_state >= self.cam_half_way and not self.mid_cycle_flag:
+                                        self.mid_cycle_flag = True
+                                        self.cam_pulse_counter = 3  # Hold high for 3 loop iterations (~480ms)
+                                        self.publish_trigger(*self.trigger_point(now))
+                                    
+                                    if self.cam_pulse_counter > 0:
+                                        val_to_write = 5.0
+                                        self.cam_pulse_counter -= 1
+                                    else:
+                                        val_to_write = 0.0
+                            
+                        ao_data_out.append(val_to_write)
+
+                    # WRITE AO (if channels exist)
+                    if ao_data_out:
+                        # Only push to the DAQ if there's actually an update
+                        if getattr(self, "last_ao_written", None) != ao_data_out:
+                            self.ao_task.write(ao_data_out, auto_start=True)
+                            self.last_ao_written = ao_data_out.copy()
+
+                   # --------------------------------------
+                    # 2. READ INPUTS 
+                    # --------------------------------------
+                    if self.ai_channels_to_use:
+                        try:
+                            # Get all data points the DAQ recorded since the last loop
+                            t = time.perf_counter_ns()
+                            raw_ai_chunk = self.ai_task.read(number_of_samples_per_channel=READ_ALL_AVAILABLE)
+                            t = daq_read_time.record_since(t)
+                        except Exception as e:
+                            self.publish_log(f"Buffer read error: {e}")
+                            time.sleep(0.01)
+                            continue
+                            
+                        # Format check to ensure it's a 2D list even if using 1 channel
+                        if not raw_ai_chunk:
+                            num_samples = 0
+                        elif not isinstance(raw_ai_chunk[0], list):
+                            raw_ai_chunk = [raw_ai_chunk]
+                            num_samples = len(raw_ai_chunk[0])
+                        else:
+                            num_samples = len(raw_ai_chunk[0])
+                    else:
+                        num_samples = 0
+
+                    if num_samples == 0:
+                        # If the buffer is empty, wait and skip to the next loop
+                        time.sleep(0.005)
+                        continue
+
+                    # --------------------------------------
+                    # 3. PROCESS CHUNK & LOGGING
+                    # --------------------------------------
+                    daq_samples.inc(num_samples)
+                    
+                    # Whole chunk as a (channels, samples) array so it can be processed vectorised
+                    ai_chunk = np.asarray(raw_ai_chunk, dtype=np.float64)
+                    
+                    # Time of each sample since the start of the acquisition
+                    sample_numbers = self.total_samples_read + np.arange(num_samples)
+                    chunk_time = sample_numbers / self.hardware_rate_hz
+                    
+                    # Arrays to hold the display values of the chunk for the GUI
+                    display_volts = np.zeros(num_samples)
+                    display_current = np.zeros(num_samples)
+                    frame_ids = np.full(num_samples, self.current_frame_id)
+                    fval_edges = chunk_time[:0]
+                    
+                    for i, func in enumerate(self.ai_ordered_functions):
+                        if func == "Matsusada read in":
+                            self.tare_buffer.extend(ai_chunk[i])
+                            
+                            if self.request_tare:
+                                self.voltage_zero_offset = sum(self.tare_buffer) / len(self.tare_buffer)
+                                self.request_tare = False
+                                
+                            display_volts = (ai_chunk[i] - self.voltage_zero_offset) * 500.0
+                            
+                        elif func == "Current collector (FEMTO)":
+                            display_current = ai_chunk[i]/self.gain
+                        elif func == "Extractor current" or "Keysight" in func:
+                            display_current = ai_chunk[i]
+                            
+                        # FVAL Receipt Logic - every rising edge is a new frame
+                        elif "Camera FVAL" in func or "Camera strobe" in func:
+                            is_high = ai_chunk[i] > 0.5
+                            was_high = np.concatenate(([self.last_fval_state], is_high[:-1]))
+                            rising = is_high & ~was_high
+                            
+                            frame_ids = self.current_frame_id + np.cumsum(rising)
+                            fval_edges = chunk_time[rising]
+                            
+                            self.current_frame_id = int(frame_ids[-1])
+                            self.last_fval_state = bool(is_high[-1])
+
+                    # Current spike: the first sample of the chunk over the threshold, if the last chunk ended under it
+                    if self.trigger_current_a > 0:
+                        above = np.abs(display_current) >= self.trigger_current_a
+                        rising = above & ~np.concatenate(([self.last_current_above], above[:-1]))
+                        if rising.any():
+                            self.recording_event.emit("current spike", int(frame_ids[np.argmax(rising)]))
+                        self.last_current_above = bool(above[-1])
+
+                    t = daq_process_time.record_since(t)
+                    
+                    # Build the CSV rows for the chunk (anchored timestamps)
+                    time_step = datetime.timedelta(seconds=(1.0 / self.hardware_rate_hz))
+                    row_end = ao_data_out + [self.voltage_zero_offset] + [self.gain] + [self.latest_ks_value]
+                    rows_to_write = [[self.experiment_start_time + (n * time_step)] + ai_data_in + row_end + [frame_id]
+                                     for n, ai_data_in, frame_id in zip(sample_numbers.tolist(), ai_chunk.T.tolist(), frame_ids.tolist())]
+
+                    t = daq_rows_time.record_since(t)
+
+                    # Update the global counter for the next chunk ---
+                    self.total_samples_read += num_samples
+                    self.last_display_volts = float(display_volts[-1])
+
+                    # Write the entire high-speed chunk to the file at once
+                    writer.writerows(rows_to_write)
+                    t = daq_write_time.record_since(t)
+
+                    # Send the GUI a compact envelope of the chunk rather than every sample
+                    v_order, v_min, v_max, v_mean = min_max_envelope(display_volts)
+                    i_order, i_min, i_max, i_mean = min_max_envelope(display_current)
+                    
+                    # The samples holding each channel's min and max, at their own times in the order they
+                    # happened, so spikes and their direction show up where they were (smoothed or not)
+                    samples = np.union1d(v_order, i_order)
+                    if self.smooth_display:
+                        # Plus one point per chunk of the 0.2 s rolling mean, drawn over them
+                        smoothed_v, self.volts_history = rolling_mean(self.volts_history, display_volts, self.plot_window_size)
+                        smoothed_i, self.amps_history = rolling_mean(self.amps_history, display_current, self.plot_window_size)
+                        smooth_t, smooth_v, smooth_i = chunk_time[-1:], smoothed_v[-1:], smoothed_i[-1:]
+                    else:
+                        smooth_t = smooth_v = smooth_i = chunk_time[:0]
+                        self.volts_history = self.amps_history = np.zeros(0)   # Smoothing starts afresh if turned back on
+                        
+                    self.publish_envelope({
+                        "t": chunk_time[samples],
+                        "volts": display_volts[samples],
+                        "current": display_current[samples],
+                        "smooth_t": smooth_t,
+                        "smooth_volts": smooth_v,
+                        "smooth_current": smooth_i,
+                        "volts_min": v_min, "volts_max": v_max, "volts_mean": v_mean,
+                        "current_min": i_min, "current_max": i_max, "current_mean": i_mean,
+                        "n": num_samples,
+                        "fval_edges": fval_edges,
+                        })
+                    daq_emit_time.record_since(t)
+                    
+                    # Pace the Python software loop
+                    time.sleep(self.sample_rate)
+
+        except Exception as e:
+            self.publish_log(f"DAQ Runtime Error: {e}")
+            print(e) # Print to console for debugging
+
+        finally:
+            # CLEANUP
+            self.publish_log("Stopping DAQ tasks...")
+            
+            try:
+                # Zero the outputs for safety
+                if self.ao_channels_to_use:
+                    zero_list = [0.0] * len(self.ao_channels_to_use)
+                    self.ao_task.write(zero_list)
+                
+                self.ao_task.stop()
+                self.ao_task.close()
+                self.ai_task.stop()
+                self.ai_task.close()
+            except Exception as e:
+                print(f"Cleanup error: {e}")
+                
+            self.publish_log("DAQ resources released.")
+
+    def stop(self):
+        self.is_running = False
+        self.wait()
+
+class KeysightWorker(QThread, TelemetryPublisher):
+    ks_reading = pyqtSignal(float)
+    log_message = pyqtSignal(str)
+    
+    def __init__(self):
+        super().__init__()
+        self.is_running = False
+        self.port = "ASRL11::INSTR"
+        
+    def run(self):
+        self.is_running = True
+        
+        # FIND THE MULTIMETER
+        
+        # Try and look through descriptions
+        list_ports = lazy_imports.load("serial.tools.list_ports")
+        pyvisa = lazy_imports.load("pyvisa")
+        self.all_ports = list_ports.comports()
+        self.possible_ports = []
+        
+        for port in self.all_ports:
+            if "Prolific" in port.description:
+                self.possible_ports.append(port)        
+            
+        # Double check against reported identity using VISA.
+        self.rm = pyvisa.ResourceManager('@py')
+        for port in self.possible_ports:
+            try:
+                self.ks = self.rm.open_resource(port)
+                
+                # Keysight settings
+                self.ks.baud_rate = 9600           # Standard for Keysight IR-to-USB
+                self.ks.read_termination = '\n'  
+                self.ks.write_termination = '\n'   
+                self.ks.timeout = 500            
+                time.sleep(0.5) 
+            
+                ident = self.ks.query("*IDN?")
+                print(ident)
+            
+                if "Keysight" in ident:
+                    self.ks.close()
+                    self.port = port
+        
+                self.ks.close()
+                
+            except:
+                pass
+            
+            finally:
+                if hasattr(self, 'ks'):
+                    self.ks.close()
+
+        # CONNECT TO DESIRED DEVICE
+        self.ks = self.rm.open_resource(self.port)
+        self.ks.baud_rate = 9600           # Standard for Keysight IR-to-USB
+        self.ks.read_termination = '\n'  
+        self.ks.write_termination = '\n'   
+        self.ks.timeout = 500            
+        time.sleep(0.5)
+
+        # READ FROM THE MULTIMETER
+        while self.is_running:
+            try:    
+                self.ks_reading.emit(float(self.ks.query("FETC?")))
+            except:
+                pass
+            time.sleep(0.5)     # I need to add this as a setting later!
+            
+        # CLOSE CONNECTION AFTER LOOP
+        self.ks.close()
+        
+    def stop(self):
+        self.is_running = False
+        self.wait()
+
+# --- WORKER THREAD 4: RESOURCE PLANNER CHECKS ---
+class ResourceCheckWorker(QThread):
+    """
+    Loads the resource planner's calibration (a few seconds of benchmark if
+    there's no current one) and measures the save folder's write speed, so
+    the GUI thread doesn't stall on them when Start is pressed. Run at
+    startup and whenever the save folder changes (check()).
+    """
+    log_message = pyqtSignal(str)
+
+    def __init__(self):
+        super().__init__()
+        self.calibration = None
+        self.directory = None
+        self.bandwidths = {}    # Folder -> bytes/s (None if it couldn't be measured)
+
+    def check(self, directory):
+        self.directory = directory
+        if not self.isRunning():
+            self.start()
+
+    def ready(self, directory):
+        """Whether plan() can run for this folder without benchmarking anything"""
+        return self.calibration is not None and (directory in self.bandwidths or not os.path.isdir(directory))
+
+    def run(self):
+        if self.calibration is None:
+            self.calibration = resource_planner.load_calibration(log=self.log_message.emit)
+
+        # The folder can change again while it's being measured
+        while self.directory and os.path.isdir(self.directory) and self.directory not in self.bandwidths:
+            directory = self.directory
+            try:
+                self.bandwidths[directory] = storage_monitor.measure_write_bandwidth(directory)
+            except OSError as e:
+                self.log_message.emit(f"Storage: could not measure the write speed of '{directory}' ({e})")
+                self.bandwidths[directory] = None
+
+# --- SETTINGS HELPERS (shared by the GUI and headless_acquisition.py) ---
+def read_hw_config(settings):
+    """NI DAQ configuration dictionary from the QSettings config file"""
+    return {
+        "ai_device": settings.value("ai_device", "cDAQ9185-2023AF4Mod1"),
+        "ai_channels": settings.value("ai_channels", "0, 1"),
+        "ao_device": settings.value("ao_device", "cDAQ9185-2023AF4Mod2"),
+        "ao_channels": settings.value("ao_channels", "0, 1"),
+        "ai_map": settings.value("ai_map", {}),
+        "ao_map": settings.value("ao_map", {})
+    }
+
+def read_cam_config(settings):
+    """Camera configuration dictionary from the QSettings config file"""
+    return {
+        "fps": float(settings.value("cam_fps", 10.0)),
+        "timing_mode": settings.value("cam_timing", "Continuous"),
+        "trigger_mode": settings.value("cam_trigger", "Software"),
+        "roi_TL_x" : int(settings.value("cam_roi_TL_x", 0)),
+        "roi_TL_y" : int(settings.value("cam_roi_TL_y", 0)),
+        "roi_BR_x" : int(settings.value("cam_roi_BR_x", 4096)),
+        "roi_BR_y" : int(settings.value("cam_roi_BR_y", 3000)),
+        "separate_process" : settings.value("cam_separate_process", "false") in (True, "true"),
+        "preview_binning" : int(settings.value("cam_preview_binning", 4)),
+        "preview_fps" : float(settings.value("cam_preview_fps", 5.0)),
+        "compression" : settings.value("cam_compression", "none"),
+        "storage_policy" : settings.value("cam_storage_policy", "alert"),
+        "record_mode" : settings.value("cam_record_mode", "Continuous"),
+        "pre_trigger_frames" : int(settings.value("cam_pre_trigger_frames", 10)),
+        "post_trigger_frames" : int(settings.value("cam_post_trigger_frames", 30)),
+        "trigger_current_na" : float(settings.value("cam_trigger_current_na", 0.0)),
+        "trigger_on_polarity" : settings.value("cam_trigger_on_polarity", "false") in (True, "true"),
+        "reduction" : settings.value("cam_reduction", "None"),
+        "reduce_frames" : int(settings.value("cam_reduce_frames", 10)),
+        "reduce_binning" : int(settings.value("cam_reduce_binning", 1)),
+        "reduce_by_polarity" : settings.value("cam_reduce_by_polarity", "false") in (True, "true"),
+        "frame_metrics" : settings.value("cam_frame_metrics", "true") in (True, "true"),
+        "metrics_stride" : int(settings.value("cam_metrics_stride", 4)),
+        "sub_rois" : settings.value("cam_sub_rois", "")
+    }
+
+def camera_roi(cam_config):
+    """
+    The hardware ROI [TL_x, TL_y, BR_x, BR_y]: the box around the sub-ROIs if
+    there are any (see multi_roi.py), otherwise the one set. Raises
+    ValueError if the sub-ROIs can't be read.
+    """
+    rois = parse_rois(cam_config["sub_rois"])
+    if rois:
+        return enclosing_roi(rois)
+    return [cam_config["roi_TL_x"], cam_config["roi_TL_y"], cam_config["roi_BR_x"], cam_config["roi_BR_y"]]
+
+def reduction_fraction(cam_config):
+    """Fraction of the frame bytes saved with the configured reduction and sub-ROIs (see frame_reduction.py, multi_roi.py)"""
+    roi_fraction = multi_roi.saved_fraction(parse_rois(cam_config["sub_rois"]))
+    if cam_config["record_mode"] == "Triggered":
+        return roi_fraction
+    return roi_fraction * saved_fraction(cam_config["reduction"], cam_config["reduce_frames"], cam_config["reduce_binning"])
+
+def parse_channel_list(text):
+    """
+    Turn a saved channel string into a list of ints, e.g. "0, 1" -> [0, 1].
+    Splits by comma, strips whitespace and ignores empty entries, so "" gives [].
+    Raises ValueError if an entry isn't a number.
+    """
+    return [int(x.strip()) for x in text.split(',') if x.strip()]
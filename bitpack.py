@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+12-bit packing
+
+The camera's pixels are 12 bit (camera.bit_depth, tag 32768 in the old
+data_collection.py TIFFs) but every frame is stored as 16 bit, so a quarter
+of the disk space and write bandwidth holds nothing but zeros. pack12()
+stores two pixels in three bytes instead:
+
+    byte 0 = a[7:0]    byte 1 = b[3:0] a[11:8]    byte 2 = b[11:4]
+
+(the same layout as the common "12-bit packed" camera formats), and
+unpack12() reverses it. Both are a few whole-array numpy operations.
+
+shift drops that many low bits first, for data whose bottom bits are always
+zero (e.g. 10-bit data scaled up to 12 bit, see unused_low_bits), and
+unpacking shifts them back. Packing checks every value fits, so it's always
+lossless: a frame that doesn't raises ValueError instead of being cut down.
+
+PackedWriter records to an HDF5 file (_IMAGES_PACKED.h5, the "packed12"
+recording formats of frame_writers.py), one packed frame per chunk, either
+as it is or compressed as well by one of the tiff_compressor.py codecs
+("packed12-zstd"). Packing first also makes zstd faster, there's less data
+to go through. PackedReader (and experiment_reader.py) unpack transparently.
+
+File layout (HDF5):
+    espray_packed   (n_frames, packed bytes) uint8, with the frame shape,
+                    bits and shift as attributes
+
+Converting an existing recording:
+    python bitpack.py ESPRAY_2026-03-10_1546_IMAGES.tiff --codec zstd --verify
+
+@author: edh1g18
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import tifffile
+import h5py
+
+from tiff_compressor import dataset_filters
+
+DATASET = "espray_packed"
+ENCODING = "packed12-v1"
+BITS = 12
+
+
+def packed_size(n_pixels):
+    """Bytes of n_pixels packed (an odd last pixel takes two bytes)"""
+    return (n_pixels * 3 + 1) // 2
+
+
+def unused_low_bits(image):
+    """How many of the low bits are zero in every pixel (0 to 16)"""
+    combined = int(np.bitwise_or.reduce(image, axis=None))
+    if combined == 0:
+        return 16
+    return (combined & -combined).bit_length() - 1
+
+
+def pack12(image, shift=0):
+    """uint16 image -> 1D uint8 array of its pixels, 12 bits each (see the module docstring)"""
+    flat = image.ravel()
+    combined = int(np.bitwise_or.reduce(flat)) if flat.size else 0
+    if combined >> shift >= 1 << BITS or combined & ((1 << shift) - 1):
+        raise ValueError(f"Values don't fit in {BITS} bits after dropping {shift} low bits, can't pack losslessly")
+    if shift:
+        flat = flat >> shift
+    if flat.size % 2:
+        flat = np.append(flat, np.uint16(0))
+
+    a = flat[0::2]
+    b = flat[1::2]
+    packed = np.empty((a.size, 3), dtype=np.uint8)
+    packed[:, 0] = a                            # uint16 -> uint8 keeps the low byte
+    packed[:, 1] = (a >> 8) | (b << 4)
+    packed[:, 2] = b >> 4
+    return packed.reshape(-1)[:packed_size(image.size)]
+
+
+def unpack12(packed, shape, shift=0):
+    """Inverse of pack12: the uint16 image of `shape`"""
+    n_pixels = int(np.prod(shape))
+    triples = np.zeros(((n_pixels + 1) // 2, 3), dtype=np.uint8)
+    triples.reshape(-1)[:packed.size] = packed.reshape(-1)
+    triples = triples.astype(np.uint16)
+
+    image = np.empty((triples.shape[0], 2), dtype=np.uint16)
+    image[:, 0] = triples[:, 0] | ((triples[:, 1] & 0xF) << 8)
+    image[:, 1] = (triples[:, 1] >> 4) | (triples[:, 2] << 4)
+    image = image.reshape(-1)[:n_pixels].reshape(shape)
+    if shift:
+        image <<= shift
+    return image
+
+
+class PackedWriter:
+    """
+    Writes frames one at a time (the same interface as the frame_writers.py
+    writers). codec "none" stores the packed bytes as they are.
+    """
+    def __init__(self, filepath, codec="none", level=None, shift=0):
+        self.filepath = filepath
+        self.codec = codec
+        self.level = level
+        self.shift = shift
+        self.compression = "packed12" if codec == "none" else f"packed12-{codec}"
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.h5 = h5py.File(filepath, 'w')
+        self.dataset = None
+        self.frame_shape = None
+
+    def write(self, image):
+        if image.dtype != np.uint16:
+            raise ValueError(f"12-bit packing stores uint16 frames, not {image.dtype}")
+        if self.dataset is None:
+            self.frame_shape = image.shape
+            n = packed_size(image.size)
+            self.dataset = self.h5.create_dataset(DATASET, shape=(0, n), maxshape=(None, n), dtype=np.uint8,
+                                                  chunks=(1, n), **dataset_filters(self.codec, self.level))
+            self.dataset.attrs.update({"encoding": ENCODING, "shape": image.shape, "bits": BITS, "shift": self.shift,
+                                       "codec": self.codec})
+        elif image.shape != self.frame_shape:
+            raise ValueError(f"Frame shape changed from {self.frame_shape} to {image.shape}")
+
+        n = self.dataset.shape[0]
+        self.dataset.resize(n + 1, axis=0)
+        self.dataset[n] = pack12(image, self.shift)
+        self.frames_written += 1
+        self.bytes_written += image.nbytes
+
+    def set_compression(self, compression):
+        pass    # Fixed when the file is created, the storage policy can only decimate this
+
+    def close(self):
+        if self.h5 is not None:
+            self.h5.close()
+            self.h5 = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PackedReader:
+    """stack[i], stack[a:b] or stack[[i, j, ...]] give unpacked uint16 frames"""
+    def __init__(self, filepath):
+        self.h5 = h5py.File(filepath, 'r')
+        self.dataset = self.h5[DATASET]
+        if self.dataset.attrs.get("encoding") != ENCODING:
+            raise ValueError(f"{filepath} is not a 12-bit packed recording")
+        self.frame_shape = tuple(int(v) for v in self.dataset.attrs["shape"])
+        self.shift = int(self.dataset.attrs["shift"])
+
+    @property
+    def shape(self):
+        return (self.dataset.shape[0], *self.frame_shape)
+
+    @property
+    def dtype(self):
+        return np.dtype(np.uint16)
+
+    def __len__(self):
+        return self.dataset.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return unpack12(self.dataset[index], self.frame_shape, self.shift)
+        if not isinstance(index, slice):
+            return np.stack([self[int(i)] for i in index])
+        packed = self.dataset[index]
+        if len(packed) == 0:
+            return np.zeros((0, *self.frame_shape), dtype=np.uint16)
+        if int(np.prod(self.frame_shape)) % 2:
+            # Each frame is padded to whole bytes, so they can't be unpacked as one block
+            return np.stack([unpack12(frame, self.frame_shape, self.shift) for frame in packed])
+        return unpack12(packed, (len(packed), *self.frame_shape), self.shift)
+
+    def close(self):
+        self.h5.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def convert(input_fp, output_fp, codec="none", level=None, shift=0):
+    """Pack an existing TIFF recording. Returns a stats dict."""
+    t0 = time.perf_counter()
+    with tifffile.TiffFile(input_fp) as tif, PackedWriter(output_fp, codec, level, shift) as writer:
+        for page in tif.pages:
+            writer.write(page.asarray())
+    stored = os.path.getsize(output_fp)
+    return {"frames": writer.frames_written, "raw_bytes": writer.bytes_written, "stored_bytes": stored,
+            "ratio": writer.bytes_written / stored, "seconds": time.perf_counter() - t0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Losslessly pack a 12-bit TIFF recording into HDF5.")
+    parser.add_argument("input", help="_IMAGES.tiff recording")
+    parser.add_argument("--output", help="Output file (default: <input>_PACKED.h5)")
+    parser.add_argument("--codec", default="none", help="Compress the packed frames too (e.g. zstd, gzip)")
+    parser.add_argument("--level", type=int, default=None)
+    parser.add_argument("--shift", default="0", help="Low bits to drop (must be zero in every pixel), or 'auto'")
+    parser.add_argument("--verify", action="store_true", help="Unpack everything and check it matches")
+    args = parser.parse_args(argv)
+
+    shift = args.shift
+    if shift == "auto":
+        with tifffile.TiffFile(args.input) as tif:
+            shift = min(unused_low_bits(page.asarray()) for page in tif.pages)
+        shift = min(shift, 15)
+        print(f"Dropping {shift} unused low bits")
+    level = args.level if args.level is not None or args.codec == "none" else {"gzip": 4}.get(args.codec, 3)
+    output_fp = args.output or os.path.splitext(args.input)[0] + "_PACKED.h5"
+    stats = convert(args.input, output_fp, args.codec, level, int(shift))
+    print(f"{stats['frames']} frames, {stats['raw_bytes'] / 1e6:.1f} MB -> {stats['stored_bytes'] / 1e6:.1f} MB "
+          f"(ratio {stats['ratio']:.2f}) in {stats['seconds']:.1f} s")
+
+    if args.verify:
+        with tifffile.TiffFile(args.input) as tif, PackedReader(output_fp) as stack:
+            for i, page in enumerate(tif.pages):
+                if not np.array_equal(page.asarray(), stack[i]):
+                    print(f"Frame {i} does not match!")
+                    return 1
+        print("Verified: every frame unpacks exactly")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
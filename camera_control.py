@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Camera control
+
+Thorlabs camera set-up steps shared by CameraWorker (in a thread of the GUI)
+and camera_process.py (in its own process). Nothing in here imports Qt.
+
+@author: edh1g18
+"""
+
+import numpy as np
+import lazy_imports
+
+
+def open_first_camera(sdk):
+    """Open the first camera the SDK can see, or return None if there isn't one."""
+    available_cameras = sdk.discover_available_cameras()
+    if not available_cameras:
+        return None
+    return sdk.open_camera(available_cameras[0])
+
+
+def configure_camera(camera, roi, exposure_time_us, trigger_mode, log, binning=1, frame_rate=None):
+    """
+    Set the ROI, binning, exposure and trigger mode, then arm the camera.
+    `log` is called with any messages for the user. `frame_rate` (if given)
+    caps the free-running frame rate, e.g. for the ROI preview.
+
+    Returns the binning factor still to be applied in software (1 if the
+    sensor could do it, or no binning was asked for).
+    """
+    _, tl_enums = lazy_imports.thorlabs_sdk()
+
+        # Set ROI variables
+    TL_x, TL_y, BR_x, BR_y = roi
+            # Double check they're valid!
+    if 260 <= (BR_x - TL_x) <= 4096 and 4 <= (BR_y - TL_y) <= 3000:     # check for min and max ROI sizes (ThorLabs camera specification)
+        camera.roi = (TL_x, TL_y, BR_x, BR_y)
+    else:
+        log("Error in setting up ROI (defaulting back to full frame).")
+        camera.roi = (0, 0, camera.sensor_width_pixels, camera.sensor_height_pixels)
+
+    software_binning = set_binning(camera, binning)
+    if binning > 1:
+        log(f"Camera binning {binning}x{binning} ({'software' if software_binning > 1 else 'on-sensor'})")
+
+    # Exposure and trigger settings
+    camera.exposure_time_us = exposure_time_us
+    camera.image_poll_timeout_ms = 1000 # Wait 1s for a frame
+
+    if trigger_mode == "Hardware":
+        camera.operation_mode = tl_enums.OPERATION_MODE.HARDWARE_TRIGGERED
+        camera.frames_per_trigger_zero_for_unlimited = 1
+        camera.trigger_polarity = tl_enums.TRIGGER_POLARITY.ACTIVE_HIGH
+    else:
+        camera.operation_mode = 0
+        camera.frames_per_trigger_zero_for_unlimited = 0
+        camera.trigger_polarity = tl_enums.TRIGGER_POLARITY.ACTIVE_HIGH
+
+    try:
+        if frame_rate:
+            camera.is_frame_rate_control_enabled = True
+            camera.frame_rate_control_value = frame_rate
+        else:
+            camera.is_frame_rate_control_enabled = False   # A kept-open camera may still be capped from the preview
+    except Exception:
+        pass    # Not supported on every camera, frames are also dropped in software
+
+    camera.arm(2) # 2 frames buffer
+
+    log(f"Camera arming in {trigger_mode} mode, frames_per_trigger={camera.frames_per_trigger_zero_for_unlimited}")
+    return software_binning
+
+
+def set_binning(camera, factor):
+    """
+    Use on-sensor binning if the camera supports the factor. Returns the factor
+    that still has to be applied in software (see block_average).
+    """
+    try:
+        if factor <= 1:
+            camera.binx = 1
+            camera.biny = 1
+            return 1
+        if camera.binx_range.max >= factor and camera.biny_range.max >= factor:
+            camera.binx = factor
+            camera.biny = factor
+            return 1
+    except Exception:
+        pass    # No binning support, do it in software
+    return max(1, factor)
+
+
+def block_average(image, factor):
+    """Software binning: mean of each factor x factor block (edges that don't fit are cropped)."""
+    if factor <= 1:
+        return image
+    h = image.shape[0] // factor * factor
+    w = image.shape[1] // factor * factor
+    blocks = image[:h, :w].reshape(h // factor, factor, w // factor, factor)
+    return blocks.mean(axis=(1, 3)).astype(image.dtype)
+
+
+def read_camera_metadata(camera):
+    """Camera settings to record in the _METADATA.json file"""
+    frame_time = camera.frame_time_us
+    exposure_time = camera.exposure_time_us
+    return {
+        "exposure_time_us": exposure_time,
+        "frame_time_us": frame_time,
+        "readout_time_us": frame_time - exposure_time,
+        "sensor_readout_time_ns" : camera.sensor_readout_time_ns,
+        "bit_depth": camera.bit_depth,
+        }
+
+
+def frame_to_array(frame, camera):
+    """
+    The SDK gives a flat buffer that it will reuse, so reshape it into a 2D
+    image and take a copy we can keep.
+    """
+    image_data = frame.image_buffer.reshape(camera.image_height_pixels, camera.image_width_pixels)
+    return np.copy(image_data)
+
+
+class CameraSession:
+    """
+    Keeps the Thorlabs SDK and camera open across acquisitions and previews,
+    so starting a run doesn't pay for SDK start-up, discovery and opening the
+    camera every time. configure() only disarms/re-arms when the ROI,
+    exposure or trigger mode actually change. Call close() on exit.
+    """
+    def __init__(self):
+        self.sdk = None
+        self.camera = None
+        self.armed_config = None    # (roi, exposure, trigger mode, binning, frame rate) the camera is armed with
+        self.software_binning = 1
+
+    def open(self):
+        """Start the SDK and open the camera if not already done. Returns the camera (or None)."""
+        if self.camera is None:
+            if self.sdk is None:
+                tl_camera, _ = lazy_imports.thorlabs_sdk()
+                self.sdk = tl_camera.TLCameraSDK()
+            self.camera = open_first_camera(self.sdk)
+        return self.camera
+
+    def configure(self, roi, exposure_time_us, trigger_mode, log, binning=1, frame_rate=None):
+        """
+        Arm the camera with these settings, re-using the current arming if it
+        matches. Returns the binning still to do in software (see configure_camera).
+        """
+        config = (tuple(roi), exposure_time_us, trigger_mode, binning, frame_rate)
+        if config == self.armed_config:
+            self.flush()
+            log(f"Camera already armed in {trigger_mode} mode (session re-used)")
+            return self.software_binning
+
+        self.disarm()
+        self.software_binning = configure_camera(self.camera, roi, exposure_time_us, trigger_mode, log,
+                                                 binning=binning, frame_rate=frame_rate)
+        self.armed_config = config
+        return self.software_binning
+
+    def flush(self):
+        """Throw away any frames left in the (2 frame) buffer since the last run."""
+        timeout = self.camera.image_poll_timeout_ms
+        self.camera.image_poll_timeout_ms = 0
+        try:
+            for _ in range(4):
+                if not self.camera.get_pending_frame_or_null():
+                    break
+        finally:
+            self.camera.image_poll_timeout_ms = timeout
+
+    def end_run(self):
+        """
+        Called when a run or preview stops. Hardware triggered arming is kept
+        (no triggers arrive without the DAQ), software mode free-runs so it is
+        disarmed.
+        """
+        if self.armed_config is not None and self.armed_config[2] == "Software":
+            self.disarm()
+
+    def disarm(self):
+        if self.camera is not None and self.armed_config is not None:
+            self.camera.disarm()
+        self.armed_config = None
+
+    def close(self):
+        self.disarm()
+        if self.camera is not None:
+            self.camera.dispose()
+            self.camera = None
+        if self.sdk is not None:
+            self.sdk.dispose()
+            self.sdk = None
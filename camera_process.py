@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Out-of-process camera pipeline
+
+Runs the camera acquisition and recording in its own process, so copying and
+saving frames can't hold the GIL while DAQWorker is trying to keep its AO
+timing. Frames are handed back through a SharedFrameRing: a
+multiprocessing.shared_memory block with a fixed number of frame slots, each
+stamped with a sequence number. The GUI (or an analysis script attaching by
+name) reads the newest frame without any pickling or extra copies in the
+camera process.
+
+@author: edh1g18
+"""
+
+import os
+import queue
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import lazy_imports
+from storage_monitor import StorageMonitor
+from triggered_recording import TriggeredRecorder
+from frame_reduction import FrameReducer, recording_compression
+from frame_metrics import FrameMetricsLogger, metrics_path
+from camera_control import open_first_camera, configure_camera, read_camera_metadata, frame_to_array, block_average
+from frame_writers import open_frame_writer
+from multi_roi import MultiRoiWriter, rois_path, roi_compression
+
+
+class SharedFrameRing:
+    """
+    Ring of frame slots in shared memory.
+
+    Layout: a header of int64 [latest sequence number, n_slots, slot_bytes],
+    then per slot int64 [sequence, height, width], then the slot data. The
+    writer marks a slot -1 while filling it, so a reader that sees the same
+    sequence number before and after copying knows the frame is intact.
+    Sequence numbers start at 1 (0 means nothing written yet).
+    """
+    HEADER = 3
+    SLOT_META = 3
+
+    def __init__(self, name=None, n_slots=8, slot_bytes=4096 * 3000 * 2, create=False):
+        if create:
+            size = 8 * (self.HEADER + self.SLOT_META * n_slots) + n_slots * slot_bytes
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self._header = np.ndarray((self.HEADER,), dtype=np.int64, buffer=self.shm.buf)
+            self._header[:] = (0, n_slots, slot_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self._header = np.ndarray((self.HEADER,), dtype=np.int64, buffer=self.shm.buf)
+
+        self.name = self.shm.name
+        self.n_slots = int(self._header[1])
+        self.slot_bytes = int(self._header[2])
+        self._meta = np.ndarray((self.n_slots, self.SLOT_META), dtype=np.int64, buffer=self.shm.buf,
+                                offset=8 * self.HEADER)
+        self._data = np.ndarray((self.n_slots, self.slot_bytes), dtype=np.uint8, buffer=self.shm.buf,
+                                offset=8 * (self.HEADER + self.SLOT_META * self.n_slots))
+        self.owner = create
+
+    @property
+    def latest_sequence(self):
+        return int(self._header[0])
+
+    def write(self, image):
+        """Copy a uint16 frame into the next slot (writer side)."""
+        seq = self.latest_sequence + 1
+        slot = seq % self.n_slots
+        nbytes = image.nbytes
+        if nbytes > self.slot_bytes:
+            raise ValueError(f"Frame of {nbytes} bytes does not fit in a {self.slot_bytes} byte slot")
+
+        self._meta[slot, 0] = -1
+        self._data[slot, :nbytes] = np.frombuffer(np.ascontiguousarray(image), dtype=np.uint8)
+        self._meta[slot, 1:] = image.shape
+        self._meta[slot, 0] = seq
+        self._header[0] = seq
+        return seq
+
+    def read(self, seq=None):
+        """
+        Copy out frame `seq` (default: the newest). Returns (seq, image), or
+        (seq, None) if that frame has already been overwritten or is being written.
+        """
+        if seq is None:
+            seq = self.latest_sequence
+        if seq <= 0:
+            return seq, None
+
+        slot = seq % self.n_slots
+        if self._meta[slot, 0] != seq:
+            return seq, None
+        height, width = self._meta[slot, 1:]
+        image = self._data[slot, :height * width * 2].view(np.uint16).reshape(height, width).copy()
+        if self._meta[slot, 0] != seq:
+            return seq, None    # Overwritten while we were copying
+        return seq, image
+
+    def close(self):
+        # Drop our numpy views first, shared memory can't close while they exist
+        self._header = self._meta = self._data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def camera_process_main(settings, ring_name, stop_event, messages, triggers=None, polarity=None):
+    """
+    Entry point of the camera process.
+
+    settings: dict with "roi", "exposure_time_us", "trigger_mode", "binning", "frame_rate", "filepath",
+              "compression", "storage_policy", "record_mode", "pre_trigger_frames", "post_trigger_frames",
+              "reduction", "reduce_frames", "reduce_binning", "reduce_by_polarity", "frame_metrics", "metrics_stride"
+              and "sub_rois"
+    messages: multiprocessing queue of ("log", text) / ("metadata", dict) / ("storage", dict) / ("metrics", row)
+              back to the worker
+    triggers: multiprocessing queue of (reason, frame ID) events to record around, in triggered mode
+    polarity: multiprocessing queue of (state, frame ID) DAQ output switches, for per-polarity reduction
+    """
+    def log(text):
+        messages.put(("log", text))
+
+    ring = SharedFrameRing(ring_name)
+    sdk = camera = writer = monitor = recorder = reducer = metrics_logger = None
+    try:
+        tl_camera, _ = lazy_imports.thorlabs_sdk()
+
+        sdk = tl_camera.TLCameraSDK()
+        camera = open_first_camera(sdk)
+        if camera is None:
+            log("Camera: No cameras found!")
+            return
+
+        software_binning = configure_camera(camera, settings["roi"], settings["exposure_time_us"], settings["trigger_mode"], log,
+                                            binning=settings["binning"], frame_rate=settings["frame_rate"])
+        messages.put(("metadata", read_camera_metadata(camera)))
+        
+        if settings["filepath"]:
+            if settings.get("record_mode") == "Triggered":
+                recorder = TriggeredRecorder(settings["pre_trigger_frames"], settings["post_trigger_frames"])
+            elif settings.get("reduction") in ("Mean", "Sum"):
+                reducer = FrameReducer(settings["reduce_frames"], settings["reduction"], settings["reduce_binning"],
+                                       settings["reduce_by_polarity"])
+            compression = recording_compression(settings.get("compression"), reducer, log)
+            if settings.get("sub_rois"):
+                compression = roi_compression(compression, log)
+                binning = settings["binning"] * (reducer.binning if reducer is not None else 1)
+                writer = MultiRoiWriter(rois_path(settings["filepath"]), settings["sub_rois"], camera.roi, binning, compression)
+            else:
+                writer = open_frame_writer(settings["filepath"], compression)
+            monitor = StorageMonitor(os.path.dirname(settings["filepath"]) or ".", settings.get("storage_policy", "alert"),
+                                     compression, decimate=recorder is None and reducer is None)
+            if settings.get("frame_metrics"):
+                metrics_logger = FrameMetricsLogger(metrics_path(settings["filepath"]), settings.get("metrics_stride", 4),
+                                                    (1 << camera.bit_depth) - 1, on_row=lambda row: messages.put(("metrics", row)))
+                metrics_logger.start()
+
+        if settings["trigger_mode"] == "Software":
+            camera.issue_software_trigger()
+
+        while not stop_event.is_set():
+            frame = camera.get_pending_frame_or_null()
+            if frame:
+                final_image = block_average(frame_to_array(frame, camera), software_binning)
+                ring.write(final_image)
+                if metrics_logger is not None:
+                    metrics_logger.submit(final_image)
+
+                if recorder is not None and triggers is not None:
+                    for reason, frame_id in drain_messages(triggers):
+                        recorder.trigger(reason, frame_id)
+
+                if polarity is not None:
+                    for state, frame_id in drain_messages(polarity):
+                        if reducer is not None:
+                            reducer.set_polarity(state, frame_id)
+
+                if writer is not None and monitor.should_save():
+                    t = time.perf_counter()
+                    bytes_before = writer.bytes_written
+                    if recorder is not None:
+                        to_save = recorder.add(final_image)
+                    elif reducer is not None:
+                        to_save = reducer.add(final_image)
+                    else:
+                        to_save = [final_image]
+                    for image in to_save:
+                        writer.write(image)
+                    if to_save:
+                        monitor.record_write(writer.bytes_written - bytes_before, time.perf_counter() - t, len(to_save))
+                if monitor is not None:
+                    warnings = monitor.check()
+                    for message in warnings:
+                        log(message)
+                    if warnings:
+                        writer.set_compression(monitor.compression)
+
+                if settings["trigger_mode"] == "Software":
+                    camera.issue_software_trigger()
+
+    except Exception as e:
+        log(f"Camera Error: {e}")
+
+    finally:
+        if metrics_logger is not None:
+            metrics_logger.stop()
+            log(f"Frame metrics: {metrics_logger.frames_logged} frames logged, {metrics_logger.frames_skipped} skipped")
+        if writer is not None:
+            if reducer is not None:
+                for image in reducer.flush():
+                    writer.write(image)
+            writer.close()
+        if monitor is not None:
+            summary = monitor.summary()
+            if recorder is not None:
+                summary["triggered"] = recorder.summary()
+            if reducer is not None:
+                summary["reduction"] = reducer.summary()
+            messages.put(("storage", summary))
+        if camera:
+            camera.disarm()
+            camera.dispose()
+        if sdk:
+            sdk.dispose()
+        ring.close()
+        log("Camera: Closed.")
+
+
+def drain_messages(messages, limit=100):
+    """Up to `limit` pending (kind, payload) messages from the camera process."""
+    pending = []
+    for _ in range(limit):
+        try:
+            pending.append(messages.get_nowait())
+        except queue.Empty:
+            break
+    return pending
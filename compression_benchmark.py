@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Compression benchmark
+
+Measures how the frame codecs and HDF5 chunk shapes behave on this machine,
+so the settings in tiff_compressor.py (and the recorders) can be picked from
+numbers rather than guesses. For each codec/level/chunk shape it records:
+
+    encode_mb_s         - single thread compression speed (MB of raw frames per second)
+    ratio               - raw size / compressed size
+    read_all_mb_s       - reading the whole sample back through HDF5 (decompression included)
+    random_frame_ms     - median time to read one random frame
+    random_crop_ms      - median time to read a random 256x256 crop of one frame
+
+TIFF recording with per-page compression (LZW, as data_collection.py uses,
+zlib and zstd) is measured the same way for comparison. Frames are a sample
+from a real _IMAGES.tiff, or synthetic ones (noisy background plus a plume)
+if no file is given. Results are printed as a table and saved as JSON.
+
+Example:
+    python compression_benchmark.py --tiff ESPRAY_2026-03-10_1546_IMAGES.tiff --output bench.json
+
+@author: edh1g18
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import tifffile
+import h5py
+
+import tiff_compressor
+from tiff_compressor import CODEC_LEVELS, dataset_filters, encode_chunk
+
+# Levels tried for each codec (fast, default, strong)
+BENCHMARK_LEVELS = {
+    "none": [None],
+    "gzip": [1, 4, 9],
+    "zstd": [1, 3, 9],
+    "blosc-lz4": [1, 5, 9],
+    "blosc-zstd": [1, 3, 6],
+    }
+
+# Page compression for TIFF recording, as tifffile names it
+TIFF_COMPRESSIONS = [None, "lzw", "zlib", "zstd"]
+
+CROP = 256  # Size of the random crop reads
+
+
+def synthetic_frames(n_frames=32, shape=(600, 2048), bit_depth=12, seed=0):
+    """
+    Frames that look roughly like ours: a dark background with shot noise and
+    a bright plume coming off an emitter tip, flickering frame to frame.
+    """
+    rng = np.random.default_rng(seed)
+    h, w = shape
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    tip_y, tip_x = h * 0.2, w * 0.5
+    # Cone spreading out below the tip
+    spread = 5 + 0.15 * np.clip(y - tip_y, 0, None)
+    plume = np.exp(-((x - tip_x) / spread) ** 2) * (y > tip_y) * np.exp(-(y - tip_y) / (h * 0.6))
+
+    frames = np.empty((n_frames, h, w), dtype=np.uint16)
+    max_value = 2 ** bit_depth - 1
+    for i in range(n_frames):
+        brightness = 1500 * (0.5 + rng.random())
+        expected = 40 + brightness * plume
+        frames[i] = np.clip(rng.poisson(expected), 0, max_value)
+    return frames
+
+
+def sample_frames(tiff_fp, n_frames=32):
+    """n_frames pages spread evenly through an existing recording"""
+    with tifffile.TiffFile(tiff_fp) as tif:
+        num_pages = len(tif.pages)
+        indices = np.linspace(0, num_pages - 1, min(n_frames, num_pages)).astype(int)
+        return np.stack([tif.pages[int(i)].asarray() for i in indices])
+
+
+def median_ms(times):
+    return float(np.median(times) * 1000) if times else None
+
+
+def chunk_shapes_for(frame_shape, itemsize):
+    """Chunk shapes worth comparing: one frame, ~4 MB of whole frames, and square tiles"""
+    h, w = frame_shape
+    return [
+        (1, h, w),
+        tiff_compressor.default_chunk_shape(h, w, itemsize),
+        (1, min(CROP, h), min(CROP, w)),
+        (16, min(CROP, h), min(CROP, w)),
+        ]
+
+
+def random_reads(dataset, n_reads, rng):
+    """Median ms for random whole-frame reads and random crop reads"""
+    n, h, w = dataset.shape
+    frame_times = []
+    crop_times = []
+    for _ in range(n_reads):
+        i = int(rng.integers(n))
+        t0 = time.perf_counter()
+        dataset[i]
+        frame_times.append(time.perf_counter() - t0)
+
+        y = int(rng.integers(max(1, h - CROP)))
+        x = int(rng.integers(max(1, w - CROP)))
+        t0 = time.perf_counter()
+        dataset[i, y:y + CROP, x:x + CROP]
+        crop_times.append(time.perf_counter() - t0)
+    return median_ms(frame_times), median_ms(crop_times)
+
+
+def benchmark_hdf5(frames, codec, level, chunk_shape, path, n_reads=20, seed=0):
+    """Encode frames into an HDF5 file at `path` with these settings and time it all"""
+    n, h, w = frames.shape
+    chunk_shape = tuple(min(c, size) for c, size in zip(chunk_shape, frames.shape))
+    cf, ch, cw = chunk_shape
+
+    # Encoding on its own (single thread), using the converter's chunk encoder
+    encode_s = 0.0
+    chunks = []
+    for start in range(0, n, cf):
+        block = frames[start:start + cf]
+        padded = np.zeros((cf, -(-h // ch) * ch, -(-w // cw) * cw), dtype=frames.dtype)
+        padded[:block.shape[0], :h, :w] = block
+        for y in range(0, h, ch):
+            for x in range(0, w, cw):
+                piece = padded[:, y:y + ch, x:x + cw]
+                t0 = time.perf_counter()
+                data = encode_chunk(piece, codec, level)
+                encode_s += time.perf_counter() - t0
+                chunks.append(((start, y, x), data))
+
+    with h5py.File(path, 'w') as h5_out:
+        dataset = h5_out.create_dataset('espray', shape=frames.shape, dtype=frames.dtype, chunks=chunk_shape,
+                                        **dataset_filters(codec, level))
+        for offset, data in chunks:
+            dataset.id.write_direct_chunk(offset, data)
+    file_bytes = os.path.getsize(path)
+
+    with h5py.File(path, 'r', rdcc_nbytes=0) as h5_in:     # No chunk cache, every read decodes
+        dataset = h5_in['espray']
+        t0 = time.perf_counter()
+        read_back = dataset[:]
+        read_s = time.perf_counter() - t0
+        random_frame_ms, random_crop_ms = random_reads(dataset, n_reads, np.random.default_rng(seed))
+
+    return {
+        "format": "hdf5",
+        "codec": codec,
+        "level": level,
+        "chunk_shape": list(chunk_shape),
+        "encode_mb_s": frames.nbytes / max(encode_s, 1e-9) / 1e6,
+        "ratio": frames.nbytes / file_bytes,
+        "read_all_mb_s": frames.nbytes / max(read_s, 1e-9) / 1e6,
+        "random_frame_ms": random_frame_ms,
+        "random_crop_ms": random_crop_ms,
+        "lossless": bool(np.array_equal(read_back, frames)),
+        }
+
+
+def benchmark_tiff(frames, compression, path, n_reads=20, seed=0):
+    """Write frames as a page-per-frame BigTIFF, the way the recorders do"""
+    t0 = time.perf_counter()
+    with tifffile.TiffWriter(path, bigtiff=True) as tif:
+        for frame in frames:
+            tif.write(frame, compression=compression)
+    write_s = time.perf_counter() - t0
+    file_bytes = os.path.getsize(path)
+
+    rng = np.random.default_rng(seed)
+    with tifffile.TiffFile(path) as tif:
+        t0 = time.perf_counter()
+        read_back = np.stack([page.asarray() for page in tif.pages])
+        read_s = time.perf_counter() - t0
+
+        frame_times = []
+        for _ in range(n_reads):
+            i = int(rng.integers(len(frames)))
+            t0 = time.perf_counter()
+            tif.pages[i].asarray()
+            frame_times.append(time.perf_counter() - t0)
+
+    return {
+        "format": "tiff",
+        "codec": compression or "none",
+        "level": None,
+        "chunk_shape": [1, *frames.shape[1:]],
+        "encode_mb_s": frames.nbytes / max(write_s, 1e-9) / 1e6,     # Includes the file writes
+        "ratio": frames.nbytes / file_bytes,
+        "read_all_mb_s": frames.nbytes / max(read_s, 1e-9) / 1e6,
+        "random_frame_ms": median_ms(frame_times),
+        "random_crop_ms": None,     # Pages are strips, a crop reads the whole frame anyway
+        "lossless": bool(np.array_equal(read_back, frames)),
+        }
+
+
+def machine_info():
+    info = {
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "h5py": h5py.__version__,
+        "tifffile": tifffile.__version__,
+        }
+    if tiff_compressor.imagecodecs is not None:
+        info["imagecodecs"] = tiff_compressor.imagecodecs.__version__
+    return info
+
+
+def run_benchmark(frames, codecs=None, chunk_shapes=None, include_tiff=True, n_reads=20, workdir=None, log=print):
+    """
+    Run the whole matrix on `frames` (n, h, w). Returns a list of result dicts.
+    Codecs that need missing packages are skipped with a message.
+    """
+    codecs = codecs or list(BENCHMARK_LEVELS)
+    chunk_shapes = chunk_shapes or chunk_shapes_for(frames.shape[1:], frames.dtype.itemsize)
+    results = []
+
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        h5_path = os.path.join(tmp, "bench.h5")
+        for codec in codecs:
+            try:
+                dataset_filters(codec, CODEC_LEVELS[codec])
+            except ImportError as e:
+                log(f"Skipping {codec}: {e}")
+                continue
+            for level in BENCHMARK_LEVELS[codec]:
+                for chunk_shape in chunk_shapes:
+                    result = benchmark_hdf5(frames, codec, level, tuple(chunk_shape), h5_path, n_reads)
+                    results.append(result)
+                    log(format_result(result))
+
+        if include_tiff:
+            tiff_path = os.path.join(tmp, "bench.tiff")
+            for compression in TIFF_COMPRESSIONS:
+                try:
+                    result = benchmark_tiff(frames, compression, tiff_path, n_reads)
+                except (ImportError, ValueError) as e:
+                    log(f"Skipping TIFF {compression}: {e}")
+                    continue
+                results.append(result)
+                log(format_result(result))
+    return results
+
+
+def format_result(result):
+    def ms(value):
+        return f"{value:8.2f}" if value is not None else "       -"
+    level = result["level"] if result["level"] is not None else "-"
+    chunks = "x".join(str(c) for c in result["chunk_shape"])
+    return (f"{result['format']:5} {result['codec']:11} {level!s:>2} {chunks:>15} "
+            f"enc {result['encode_mb_s']:8.1f} MB/s  ratio {result['ratio']:5.2f}  "
+            f"read {result['read_all_mb_s']:8.1f} MB/s  frame {ms(result['random_frame_ms'])} ms  "
+            f"crop {ms(result['random_crop_ms'])} ms{'' if result['lossless'] else '  NOT LOSSLESS'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark frame codecs and HDF5 chunk shapes.")
+    parser.add_argument("--tiff", help="Take sample frames from this _IMAGES.tiff (default: synthetic frames)")
+    parser.add_argument("--frames", type=int, default=32, help="Number of sample frames")
+    parser.add_argument("--shape", type=int, nargs=2, default=(600, 2048), metavar=("ROWS", "COLS"),
+                        help="Synthetic frame size")
+    parser.add_argument("--codecs", nargs="+", choices=list(BENCHMARK_LEVELS), help="Codecs to try (default all)")
+    parser.add_argument("--chunk", type=int, nargs=3, action="append", metavar=("FRAMES", "ROWS", "COLS"),
+                        help="Chunk shape to try (repeatable, default a standard set)")
+    parser.add_argument("--no-tiff", action="store_true", help="Skip the TIFF recording comparison")
+    parser.add_argument("--reads", type=int, default=20, help="Random reads per configuration")
+    parser.add_argument("--workdir", help="Where to write the temporary files (use the target disk)")
+    parser.add_argument("--output", default="compression_benchmark.json", help="JSON report path")
+    args = parser.parse_args(argv)
+
+    if args.tiff:
+        frames = sample_frames(args.tiff, args.frames)
+        source = {"tiff": os.path.abspath(args.tiff)}
+    else:
+        frames = synthetic_frames(args.frames, tuple(args.shape))
+        source = {"synthetic": True}
+    source.update({"frames": frames.shape[0], "height": frames.shape[1], "width": frames.shape[2],
+                   "dtype": str(frames.dtype), "megabytes": frames.nbytes / 1e6})
+    print(f"Benchmarking on {frames.shape[0]} frames of {frames.shape[2]}x{frames.shape[1]} px "
+          f"({frames.nbytes / 1e6:.1f} MB)")
+
+    results = run_benchmark(frames, args.codecs, args.chunk, not args.no_tiff, args.reads, args.workdir)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": machine_info(),
+        "sample": source,
+        "results": results,
+        }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Report saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
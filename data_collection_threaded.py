@@ -30,633 +30,44 @@ Created on Thu Feb 12 14:53:11 2026
 """
 
 # Generic Python Libraries
+import lazy_imports
 import numpy as np
 import time
 import sys
-import csv
-import datetime
 import json
 
 # GUI Libaries
-from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
-                             QHBoxLayout, QPushButton, QLabel, QComboBox, QLineEdit,
-                             QDoubleSpinBox, QSpinBox, QTextEdit, QFileDialog,
-                             QGroupBox, QGridLayout, QDialog, QFormLayout,
-                             QDialogButtonBox, QCheckBox)
-from PyQt6.QtCore import QThread, pyqtSignal, pyqtSlot, Qt, QSettings, QRectF
-from PyQt6.QtGui import QIcon
-import pyqtgraph as pg
-from collections import deque
-
-# National Instruments Libraries
-import nidaqmx
-from nidaqmx.constants import AcquisitionType, READ_ALL_AVAILABLE
-from nidaqmx import stream_readers
-from nidaqmx import stream_writers
-from nidaqmx import constants
-
-# ThorLabs and Camera/Image Libraries
-import windows_setup   # This is Thorlabs windows set-up code    
-import tifffile
-from thorlabs_tsi_sdk.tl_camera import TLCameraSDK
-from thorlabs_tsi_sdk.tl_mono_to_color_processor import MonoToColorProcessorSDK
-from thorlabs_tsi_sdk.tl_camera_enums import SENSOR_TYPE, OPERATION_MODE, TRIGGER_POLARITY
-import imagecodecs
-
-# Serial and VISA libraries for talking to the Keysight
-import pyvisa
-import serial.tools.list_ports
-
-# --- WORKER THREAD 1: CAMERA CONTROL ---
-class CameraWorker(QThread):
-    image_ready = pyqtSignal(object)  # Sends numpy array
-    log_message = pyqtSignal(str)
-    camera_metadata = pyqtSignal(dict) # for logging camera settings to metadata
-    
-    def __init__(self):
-        super().__init__()
-        self.is_running = False
-        self.camera = None
-        self.sdk = None
-        
-        # Settings
-        self.exposure_time_us = 2000 # 2ms default timeout
-        self.trigger_mode = "Hardware"
-        self.ROI = [0, 0, 4096, 3000]    # Full sensor [TL_x, TL_y, BR_x, BR_y]
-        self.filepath = ""
-
-    def run(self):
-        self.is_running = True
-        self.log_message.emit("Camera: Initializing SDK...")
-
-        try:
-            # 1. Initialize SDK & Camera
-            self.DLL_dr = "C:\Program Files\Thorlabs\Scientific Imaging\ThorCam"
-
-            try:
-                windows_setup.configure_path(self.DLL_dr)
-            except ImportError:
-                configure_path = None
-            
-            self.sdk = TLCameraSDK()
-            available_cameras = self.sdk.discover_available_cameras()
-            
-            if not available_cameras:
-                self.log_message.emit("Camera: No cameras found!")
-                return
-            
-            self.camera = self.sdk.open_camera(available_cameras[0])
-            
-                # Set ROI variables
-            TL_x, TL_y, BR_x, BR_y = self.ROI
-                    # Double check they're valid!
-            if 260 <= (BR_x - TL_x) <= 4096 and 4 <= (BR_y - TL_y) <= 3000:     # check for min and max ROI sizes (ThorLabs camera specification) 
-                if (BR_x - TL_x) <= 4096 or (BR_y - TL_y) <= 3000:              
-                    self.camera.roi = (TL_x, TL_y, BR_x, BR_y)
-            else:
-                self.log_message.emit("Error in setting up ROI (defaulting back to full frame).")
-                self.camera.roi = (0, 0, self.camera.sensor_width_pixels, self.camera.sensor_height_pixels)
-            
-            # 2. Configure Camera
-            self.camera.exposure_time_us = self.exposure_time_us
-            self.camera.image_poll_timeout_ms = 1000 # Wait 1s for a frame
-            
-            if self.trigger_mode == "Hardware":
-                self.camera.operation_mode = OPERATION_MODE.HARDWARE_TRIGGERED
-                self.camera.frames_per_trigger_zero_for_unlimited = 1
-                self.camera.trigger_polarity = TRIGGER_POLARITY.ACTIVE_HIGH
-            else:
-                self.camera.operation_mode = 0
-                self.camera.frames_per_trigger_zero_for_unlimited = 0
-                self.camera.trigger_polarity = TRIGGER_POLARITY.ACTIVE_HIGH
-            
-            self.camera.arm(2) # 2 frames buffer
-                        
-            self.log_message.emit(f"Camera arming in {self.trigger_mode} mode, frames_per_trigger={self.camera.frames_per_trigger_zero_for_unlimited}")
-            
-            # Metadata handling
-            frame_time = self.camera.frame_time_us
-            exposure_time = self.camera.exposure_time_us
-            readout_time = self.camera.sensor_readout_time_ns
-            
-            self.camera_metadata.emit({
-                "exposure_time_us": exposure_time,
-                "frame_time_us": frame_time,
-                "readout_time_us": frame_time - exposure_time,
-                "sensor_readout_time_ns" : readout_time,
-                })
-
-
-            # 3. Continuous Loop
-            # Trigger first frame if in Software mode
-            if self.trigger_mode == "Software":
-                self.camera.issue_software_trigger()
-
-            while self.is_running:
-                frame = self.camera.get_pending_frame_or_null()
-                
-                if frame:
-                    # 1. RESHAPE (CRITICAL STEP)
-                    # The SDK gives a flat list. We must force it into a 2D rectangle.
-                    image_data = frame.image_buffer.reshape(
-                        self.camera.image_height_pixels, 
-                        self.camera.image_width_pixels
-                    )
-                    
-                    # 2. Make a copy (Safety for threading)
-                    final_image = np.copy(image_data)
-                    
-                    # 3. Emit
-                    self.image_ready.emit(final_image)
-                    
-                    # Saving logic...
-                    if self.filepath:
-                        # tifffile handles the shape automatically
-                        tifffile.imwrite(self.filepath, final_image, append=True, bigtiff = True)
-
-                    if self.trigger_mode == "Software":
-                        self.camera.issue_software_trigger()
-
-        except Exception as e:
-            self.log_message.emit(f"Camera Error: {e}")
-            
-        finally:
-            if self.camera:
-                self.camera.disarm()
-                self.camera.dispose()
-            if self.sdk:
-                self.sdk.dispose()
-            self.log_message.emit("Camera: Closed.")
-
-    def stop(self):
-        self.is_running = False
-        self.wait()
-
-# --- WORKER THREAD 2: NI DAQ CONTROL ---
-class DAQWorker(QThread):
-    data_ready = pyqtSignal(float, float) # Sends (Voltage, Current)
-    log_message = pyqtSignal(str)
-    photo_triggered = pyqtSignal()
-    
-    def __init__(self):
-        super().__init__()
-        self.is_running = False
-        
-        # Initialise set-up variables
-        self.filepath = "data.csv"
-        self.sample_rate = 4e-3 
-        self.latest_ks_value = 0.0
-        
-        # Initialise control variables
-        self.target_voltage = 0.0
-        self.polarity_mode = 0
-        self.high_time = 1 
-        self.cam_timing_mode = "Continuous"
-        self.cam_fps = 0    
-        self.use_camera = True
-        self.smooth_display = True
-        self.gain = 1E+6
-
-        # Averaging/taring variables
-        self.voltage_zero_offset = 0.0
-        self.request_tare = False
-        
-        # Camera sync variables
-        self.current_frame_id = 0
-        self.last_fval_state = False
-        self.last_cam_trigger_time = 0
-        
-        # Initialise modules
-        self.ai_channel_name = "cDAQ9185-2023AF4Mod1"
-        self.ao_channel_name = "cDAQ9185-2023AF4Mod2"
-        self.ai_channels_to_use = [0, 1]
-        self.ao_channels_to_use = [0]
-        self.ai_lims = [-10, 10]
-        self.ao_lims = [-10, 10]
-        
-        # Define channels for purposes
-        self.ao_map = {}
-        self.ai_map = {}
-
-    def set_voltage(self, val):
-        self.target_voltage = val
-        
-    def set_polarity_mode(self, val):
-        self.polarity_mode = val
-
-    def set_hightime(self, val):
-        self.high_time = val
-        self.cam_half_way = val / 2.0  # Pre-calculate half-way point
-        
-    def set_gain(self, val):
-        self.gain = val
-        
-    def set_fps(self, val):
-        self.cam_fps = val
-        if val > 0:
-            self.cam_trigger_period = 1.0 / val  # Pre-calculate period
-        else:
-            self.cam_trigger_period = 0.1
-
-    def update_ks_value(self, val):
-        self.latest_ks_value = val
-
-    def run(self):
-        self.is_running = True
-        
-        # 1. Create Tasks
-        self.ai_task = nidaqmx.Task()
-        self.ao_task = nidaqmx.Task()
-
-        try:
-            # --- SETUP PHASE: Build the Channel Maps ---
-            
-            # Lists to ensure we write/read in the exact order NI expects
-            self.ai_ordered_functions = [] 
-            self.ao_ordered_functions = []
-            
-            # CSV Headers start with Timestamp
-            csv_headers = ["Timestamp"]
-
-            # --- A. Setup AI Channels (Sorted Order) ---
-            sorted_ai = sorted(self.ai_channels_to_use)
-            for chan_idx in sorted_ai:
-                # Add physical channel
-                self.ai_task.ai_channels.add_ai_voltage_chan(
-                    f"{self.ai_channel_name}/ai{chan_idx}", 
-                    min_val=self.ai_lims[0], max_val=self.ai_lims[1],
-                    terminal_config = constants.TerminalConfiguration.RSE
-                )
-                
-                # Identify function (e.g. "Matsusada read in")
-                func_name = "Unknown"
-                # Look for this index in the map values
-                for name, mapped_idx in self.ai_map.items():
-                    if int(mapped_idx) == chan_idx:
-                        func_name = name
-                        break
-                
-                self.ai_ordered_functions.append(func_name)
-                csv_headers.append(f"{func_name} (AI{chan_idx})")
-                
-            self.log_message.emit(f"AI Configured: {self.ai_ordered_functions}")
-
-            # --- B. Setup AO Channels (Sorted Order) ---
-            sorted_ao = sorted(self.ao_channels_to_use)
-            for chan_idx in sorted_ao:
-                # Add physical channel
-                self.ao_task.ao_channels.add_ao_voltage_chan(
-                    f"{self.ao_channel_name}/ao{chan_idx}", 
-                    min_val=self.ao_lims[0], max_val=self.ao_lims[1]
-                )
-                
-                # Identify function (e.g. "Matsusada control")
-                func_name = "Unknown"
-                for name, mapped_idx in self.ao_map.items():
-                    if int(mapped_idx) == chan_idx:
-                        func_name = name
-                        break
-                        
-                self.ao_ordered_functions.append(func_name)
-                csv_headers.append(f"{func_name} (AO{chan_idx})")
-                
-            self.log_message.emit(f"AO Configured: {self.ao_ordered_functions}")
-
-            # --- C. Initialize CSV ---
-            csv_headers.append("Active Tare Offset (V)")
-            csv_headers.append("Gain (V/A)")
-            csv_headers.append("Emitter current (Keysight)")
-            csv_headers.append("Frame ID")
-            
-            # Hardware clock
-            self.hardware_rate_hz = 1.0 /self.sample_rate
-            
-            self.ai_task.timing.cfg_samp_clk_timing(rate = self.hardware_rate_hz,
-                                                    sample_mode = AcquisitionType.CONTINUOUS)
-            
-            # Slow down multiplexer to allow it to saturate even at high sample rates
-            try:
-                num_chans = len(self.ai_channels_to_use)
-                if num_chans > 1:
-                    # Space out the measurements evenly to give the Matsusada time to settle
-                    self.ai_task.timing.ai_conv_rate = self.hardware_rate_hz * num_chans * 1.2
-            except Exception:
-                pass
-            
-            # Create file with the dynamic headers
-            with open(self.filepath, mode='w', newline='') as f:
-                csv.writer(f).writerow(csv_headers)
-            
-            self.log_message.emit("DAQ Started. Logging data...")
-
-            # --- D. Initialize Timing Variables ---
-            last_switch_time = time.time()
-            is_high_state = True
-            self.set_fps(self.cam_fps)
-            self.set_hightime(self.high_time)
-            self.cam_pulse_width = 0.02 # pulse width
-            self.mid_cycle_flag = False
-            self.cam_pulse_counter = 0
-            
-            # Aveaging window for taring
-            tare_window_size = max(1, int(10 / self.sample_rate))   # 10s taring window
-            self.tare_buffer = deque(maxlen=tare_window_size)
-            
-            # Averaging window for plot smoothing
-            plot_window_size = max(1, int(0.2 / self.sample_rate))
-            self.volts_history = deque(maxlen = plot_window_size)
-            self.amps_history = deque(maxlen = plot_window_size)
-
-            # --- E. MAIN LOOP ---
-            with open(self.filepath, mode='a', newline='') as f:
-                writer = csv.writer(f)
-                
-                if self.ai_channels_to_use:
-                    self.ai_task.start()
-                    self.experiment_start_time = datetime.datetime.now()
-                    self.total_samples_read = 0
-                
-                while self.is_running:
-                    now = time.time()
-                    
-                    # --------------------------------------
-                    # 1. CALCULATE OUTPUTS (Logic Block)
-                    # --------------------------------------
-                    
-                    # Check if in a switching mode
-                    if self.polarity_mode != "Unipolar constant":
-                        # Check if it's time to switch
-                        if (now - last_switch_time) >= self.high_time:
-                            is_high_state = not is_high_state # toggle state
-                            last_switch_time = now
-                            self.mid_cycle_flag = False
-                    else:
-                        is_high_state = True # Always "high" if constant
-                        self.mid_cycle_flag = True
-                        
-                    ao_data_out = []
-                    
-                    
-                    for func in self.ao_ordered_functions:
-                        val_to_write = 0.0
-                        
-                        if func == "Matsusada control":
-                            # Apply positive voltage if in high state
-                            if is_high_state:
-                                val_to_write = self.target_voltage/500 # Convert to scaled control voltage
-                            else:
-                                # Apply the negative voltage if in low state in bipolar
-                                if self.polarity_mode == "Bipolar switching":
-                                    val_to_write = -1 * self.target_voltage/500
-                                # Apply zero if in unipolar switching
-                                elif self.polarity_mode == "Unipolar switching":
-                                    val_to_write = 0.0
-                                else:
-                                    val_to_write = 0.0
-                                    self.log_message.emit(f"NO MATCHING POLARITY MODE: {self.polarity_mode}")                        
-                        
-                        elif func == "Camera control":
-                            val_to_write = 0.0
-                            
-                            if self.use_camera:
-                                if self.cam_timing_mode == "Continuous":
-                                    if (now - self.last_cam_trigger_time) >= self.cam_trigger_period:
-                                        val_to_write = 5.0
-                                        self.last_cam_trigger_time = now
-                                        self.photo_triggered.emit()
-                                        
-                                elif self.cam_timing_mode == "Mid-cycle":
-                                    time_in_state = now - last_switch_time
-                                    
-                                    if time_in_state >= self.cam_half_way and not self.mid_cycle_flag:
-                                        self.mid_cycle_flag = True
-                                        self.cam_pulse_counter = 3  # Hold high for 3 loop iterations (~480ms)
-                                        self.photo_triggered.emit()
-                                    
-                                    if self.cam_pulse_counter > 0:
-                                        val_to_write = 5.0
-                                        self.cam_pulse_counter -= 1
-                                    else:
-                                        val_to_write = 0.0
-                            
-                        ao_data_out.append(val_to_write)
-
-                    # WRITE AO (if channels exist)
-                    if ao_data_out:
-                        # Only push to the DAQ if there's actually an update
-                        if getattr(self, "last_ao_written", None) != ao_data_out:
-                            self.ao_task.write(ao_data_out, auto_start=True)
-                            self.last_ao_written = ao_data_out.copy()
-
-                   # --------------------------------------
-                    # 2. READ INPUTS 
-                    # --------------------------------------
-                    if self.ai_channels_to_use:
-                        try:
-                            # Get all data points the DAQ recorded since the last loop
-                            raw_ai_chunk = self.ai_task.read(number_of_samples_per_channel=READ_ALL_AVAILABLE)
-                        except Exception as e:
-                            self.log_message.emit(f"Buffer read error: {e}")
-                            time.sleep(0.01)
-                            continue
-                            
-                        # Format check to ensure it's a 2D list even if using 1 channel
-                        if not raw_ai_chunk:
-                            num_samples = 0
-                        elif not isinstance(raw_ai_chunk[0], list):
-                            raw_ai_chunk = [raw_ai_chunk]
-                            num_samples = len(raw_ai_chunk[0])
-                        else:
-                            num_samples = len(raw_ai_chunk[0])
-                    else:
-                        num_samples = 0
-
-                    if num_samples == 0:
-                        # If the buffer is empty, wait and skip to the next loop
-                        time.sleep(0.005)
-                        continue
-
-                    # --------------------------------------
-                    # 3. PROCESS CHUNK & LOGGING
-                    # --------------------------------------
-                    rows_to_write = []
-                    photo_just_taken = False
-                    
-                    # Calculate the physical time between each sample
-                    time_step = datetime.timedelta(seconds=(1.0 / self.hardware_rate_hz))
-                    
-                    # Variables to hold the final value of the chunk for the GUI
-                    display_volts = 0.0
-                    display_current = 0.0
-
-                    # Process every single reading the DAQ took
-                    for sample_idx in range(num_samples):
-                        # Extract the row for this specific point in time
-                        ai_data_in = [chan[sample_idx] for chan in raw_ai_chunk]
-                        
-                        # Anchored timestep
-                        current_sample_number = self.total_samples_read + sample_idx
-                        sample_timestamp = self.experiment_start_time + (current_sample_number * time_step)
-                        
-                        for i, func in enumerate(self.ai_ordered_functions):
-                            if func == "Matsusada read in":
-                                raw_v = ai_data_in[i]
-                                self.tare_buffer.append(raw_v)
-                                
-                                if self.request_tare:
-                                    if len(self.tare_buffer) > 0:
-                                        self.voltage_zero_offset = sum(self.tare_buffer) / len(self.tare_buffer)
-                                    else:
-                                        self.voltage_zero_offset = raw_v
-                                    self.request_tare = False
-                                    
-                                display_volts = (raw_v - self.voltage_zero_offset) * 500.0
-                                
-                            elif func == "Current collector (FEMTO)":
-                                display_current = ai_data_in[i]/self.gain
-                            elif func == "Extractor current" or "Keysight" in func:
-                                display_current = ai_data_in[i]
-                                
-                            # FVAL Receipt Logic
-                            elif "Camera FVAL" in func or "Camera strobe" in func:
-                                fval_voltage = ai_data_in[i]
-                                is_high = fval_voltage > 0.5
-                                
-                                if is_high and not self.last_fval_state:
-                                    self.current_frame_id += 1
-                                    photo_just_taken = True
-                                
-                                self.last_fval_state = is_high
-
-                        # Build the CSV row and add it to our chunk
-                        row_data = [sample_timestamp] + ai_data_in + ao_data_out + [self.voltage_zero_offset] + [self.gain] + [self.latest_ks_value] + [self.current_frame_id]
-                        rows_to_write.append(row_data)
-
-                    # Update the global counter for the next chunk ---
-                    self.total_samples_read += num_samples
-
-                    # Write the entire high-speed chunk to the file at once
-                    writer.writerows(rows_to_write)
-
-                    # Update the GUI with just the latest values from the chunk to save CPU
-                    self.volts_history.append(display_volts)
-                    self.amps_history.append(display_current)
-                    
-                    if self.smooth_display:
-                        emit_v = np.average(self.volts_history)
-                        emit_i = np.average(self.amps_history)
-                    else:
-                        emit_v = display_volts
-                        emit_i = display_current
-                        
-                    self.data_ready.emit(emit_v, emit_i)
-                    
-                    if photo_just_taken:
-                        self.photo_triggered.emit()
-                    
-                    # Pace the Python software loop
-                    time.sleep(self.sample_rate)
-
-        except Exception as e:
-            self.log_message.emit(f"DAQ Runtime Error: {e}")
-            print(e) # Print to console for debugging
-
-        finally:
-            # CLEANUP
-            self.log_message.emit("Stopping DAQ tasks...")
-            
-            try:
-                # Zero the outputs for safety
-                if self.ao_channels_to_use:
-                    zero_list = [0.0] * len(self.ao_channels_to_use)
-                    self.ao_task.write(zero_list)
-                
-                self.ao_task.stop()
-                self.ao_task.close()
-                self.ai_task.stop()
-                self.ai_task.close()
-            except Exception as e:
-                print(f"Cleanup error: {e}")
-                
-            self.log_message.emit("DAQ resources released.")
-
-    def stop(self):
-        self.is_running = False
-        self.wait()
-
-class KeysightWorker(QThread):
-    ks_reading = pyqtSignal(float)
-    log_message = pyqtSignal(str)
-    
-    def __init__(self):
-        super().__init__()
-        self.is_running = False
-        self.port = "ASRL11::INSTR"
-        
-    def run(self):
-        self.is_running = True
-        
-        # FIND THE MULTIMETER
-        
-        # Try and look through descriptions
-        self.all_ports = serial.tools.list_ports.comports()
-        self.possible_ports = []
-        
-        for port in self.all_ports:
-            if "Prolific" in port.description:
-                self.possible_ports.append(port)        
-            
-        # Double check against reported identity using VISA.
-        self.rm = pyvisa.ResourceManager('@py')
-        for port in self.possible_ports:
-            try:
-                self.ks = self.rm.open_resource(port)
-                
-                # Keysight settings
-                self.ks.baud_rate = 9600           # Standard for Keysight IR-to-USB
-                self.ks.read_termination = '\n'  
-                self.ks.write_termination = '\n'   
-                self.ks.timeout = 500            
-                time.sleep(0.5) 
-            
-                ident = self.ks.query("*IDN?")
-                print(ident)
-            
-                if "Keysight" in ident:
-                    self.ks.close()
-                    self.port = port
-        
-                self.ks.close()
-                
-            except:
-                pass
-            
-            finally:
-                if hasattr(self, 'ks'):
-                    self.ks.close()
-
-        # CONNECT TO DESIRED DEVICE
-        self.ks = self.rm.open_resource(self.port)
-        self.ks.baud_rate = 9600           # Standard for Keysight IR-to-USB
-        self.ks.read_termination = '\n'  
-        self.ks.write_termination = '\n'   
-        self.ks.timeout = 500            
-        time.sleep(0.5)
-
-        # READ FROM THE MULTIMETER
-        while self.is_running:
-            try:    
-                self.ks_reading.emit(float(self.ks.query("FETC?")))
-            except:
-                pass
-            time.sleep(0.5)     # I need to add this as a setting later!
-            
-        # CLOSE CONNECTION AFTER LOOP
-        self.ks.close()
-        
-    def stop(self):
-        self.is_running = False
-        self.wait()
+with lazy_imports.timed("PyQt6"):
+    from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
+                                 QHBoxLayout, QPushButton, QLabel, QComboBox, QLineEdit,
+                                 QDoubleSpinBox, QSpinBox, QTextEdit, QFileDialog,
+                                 QGroupBox, QGridLayout, QDialog, QFormLayout,
+                                 QDialogButtonBox, QCheckBox, QMessageBox)
+    from PyQt6.QtCore import pyqtSlot, Qt, QSettings, QRectF, QTimer
+    from PyQt6.QtGui import QIcon, QColor
+with lazy_imports.timed("pyqtgraph"):
+    import pyqtgraph as pg
+from live_plot import RingBuffer, LODHistory
+from image_display import FastImageDisplay
+from telemetry import TelemetryBus
+from camera_control import CameraSession
+from frame_writers import RECORDING_FORMATS
+from metrics import metrics, start_http_server, save_to_metadata
+import storage_monitor
+import resource_planner
+from triggered_recording import RECORD_MODES
+from frame_reduction import REDUCTIONS, BINNING_FACTORS
+from frame_metrics import METRICS, CSV_HEADERS as METRIC_HEADERS
+import multi_roi
+from multi_roi import parse_rois
+# The worker threads and settings helpers (QtCore only, shared with headless_acquisition.py)
+from acquisition_workers import (CameraWorker, DAQWorker, KeysightWorker, ResourceCheckWorker, read_hw_config,
+                                 read_cam_config, camera_roi, reduction_fraction, parse_channel_list)
+
+# Per-stage timings of the GUI (the workers' are in acquisition_workers.py)
+gui_tick_time = metrics.histogram("gui_tick_seconds", "A whole GUI update tick")
+gui_plot_time = metrics.histogram("gui_plot_seconds", "Redrawing the voltage/current plot")
+gui_image_time = metrics.histogram("gui_image_seconds", "Drawing a camera frame")
 
 # --- HARDWARE CONFIGURATION DIALOGUE ---
 class HardwareConfigDialog(QDialog):
@@ -795,7 +206,7 @@ class menu_camera_settings(QDialog):
     """
     Configuration window for setting up camera settings with Visual ROI.
     """
-    def __init__(self, current_config, camera_worker, parent=None):
+    def __init__(self, current_config, camera_worker, parent=None, bit_depth=12):
         super().__init__(parent)
         self.setWindowTitle("Camera Settings & ROI Selection")
         self.resize(1000, 600)
@@ -844,7 +255,130 @@ class menu_camera_settings(QDialog):
         self.layout_gen.addWidget(QLabel("Trigger Mode:"), this_row, 0)
         self.layout_gen.addWidget(self.input_trigger, this_row, 1)
         
+        this_row += 1
+        self.input_separate_process = QCheckBox("Run camera in a separate process")
+        self.input_separate_process.setChecked(self.config.get("separate_process", False))
+        self.layout_gen.addWidget(self.input_separate_process, this_row, 0, 1, 2)
+        
+        this_row += 1
+        self.input_compression = QComboBox()
+        self.input_compression.addItems(RECORDING_FORMATS)
+        self.input_compression.setCurrentText(self.config.get("compression", "none"))
+        self.input_compression.setToolTip("Uncompressed recordings can be memory-mapped for analysis")
+        self.layout_gen.addWidget(QLabel("Compression:"), this_row, 0)
+        self.layout_gen.addWidget(self.input_compression, this_row, 1)
+        
+        this_row += 1
+        self.input_storage_policy = QComboBox()
+        self.input_storage_policy.addItems(list(storage_monitor.POLICIES))
+        self.input_storage_policy.setCurrentText(self.config.get("storage_policy", "alert"))
+        self.input_storage_policy.setToolTip("What to do if the disk can't keep up or is filling up: just warn, "
+                                             "switch to zstd compression, or only save every Nth frame")
+        self.layout_gen.addWidget(QLabel("If disk too slow:"), this_row, 0)
+        self.layout_gen.addWidget(self.input_storage_policy, this_row, 1)
+        
         self.layout_left.addWidget(self.group_gen)
+        
+        # Preview Settings (binned down so drawing the ROI box stays responsive)
+        self.group_preview_settings = QGroupBox("Preview")
+        self.layout_preview_settings = QGridLayout()
+        self.group_preview_settings.setLayout(self.layout_preview_settings)
+        
+        self.input_preview_binning = QComboBox()
+        for factor in (1, 2, 4, 8):
+            self.input_preview_binning.addItem(f"{factor}x{factor} ({4096 // factor}x{3000 // factor} px)", factor)
+        self.input_preview_binning.setCurrentIndex(self.input_preview_binning.findData(int(self.config.get("preview_binning", 4))))
+        self.layout_preview_settings.addWidget(QLabel("Binning:"), 0, 0)
+        self.layout_preview_settings.addWidget(self.input_preview_binning, 0, 1)
+        
+        self.input_preview_fps = QDoubleSpinBox()
+        self.input_preview_fps.setRange(0.5, 30.0)
+        self.input_preview_fps.setValue(float(self.config.get("preview_fps", 5.0)))
+        self.layout_preview_settings.addWidget(QLabel("Preview FPS:"), 1, 0)
+        self.layout_preview_settings.addWidget(self.input_preview_fps, 1, 1)
+        
+        self.layout_left.addWidget(self.group_preview_settings)
+        
+        # Triggered recording (only the frames around events are saved)
+        self.group_triggered = QGroupBox("Recording")
+        self.layout_triggered = QGridLayout()
+        self.group_triggered.setLayout(self.layout_triggered)
+        
+        self.input_record_mode = QComboBox()
+        self.input_record_mode.addItems(list(RECORD_MODES))
+        self.input_record_mode.setCurrentText(self.config.get("record_mode", "Continuous"))
+        self.input_record_mode.setToolTip("Triggered: keep the last frames in memory and only save those around "
+                                          "current spikes, polarity reversals or the Record event button")
+        self.layout_triggered.addWidget(QLabel("Mode:"), 0, 0)
+        self.layout_triggered.addWidget(self.input_record_mode, 0, 1)
+        
+        self.input_pre_frames = QSpinBox()
+        self.input_pre_frames.setRange(0, 500)
+        self.input_pre_frames.setValue(int(self.config.get("pre_trigger_frames", 10)))
+        self.input_pre_frames.setToolTip("Frames kept in memory, up to ~25 MB each at full sensor")
+        self.layout_triggered.addWidget(QLabel("Frames before:"), 1, 0)
+        self.layout_triggered.addWidget(self.input_pre_frames, 1, 1)
+        
+        self.input_post_frames = QSpinBox()
+        self.input_post_frames.setRange(0, 100000)
+        self.input_post_frames.setValue(int(self.config.get("post_trigger_frames", 30)))
+        self.layout_triggered.addWidget(QLabel("Frames after:"), 2, 0)
+        self.layout_triggered.addWidget(self.input_post_frames, 2, 1)
+        
+        self.input_trigger_current = QDoubleSpinBox()
+        self.input_trigger_current.setRange(0, 1e6)
+        self.input_trigger_current.setDecimals(1)
+        self.input_trigger_current.setSuffix(" nA")
+        self.input_trigger_current.setSpecialValueText("Off")
+        self.input_trigger_current.setValue(float(self.config.get("trigger_current_na", 0.0)))
+        self.layout_triggered.addWidget(QLabel("Current spike over:"), 3, 0)
+        self.layout_triggered.addWidget(self.input_trigger_current, 3, 1)
+        
+        self.input_trigger_polarity = QCheckBox("Record polarity reversals")
+        self.input_trigger_polarity.setChecked(self.config.get("trigger_on_polarity", False))
+        self.layout_triggered.addWidget(self.input_trigger_polarity, 4, 0, 1, 2)
+        
+        # Reduction (continuous mode only): averaged/summed and binned images are saved instead of every frame
+        self.input_reduction = QComboBox()
+        self.input_reduction.addItems(list(REDUCTIONS))
+        self.input_reduction.setCurrentText(self.config.get("reduction", "None"))
+        self.input_reduction.setToolTip("Continuous mode: save the mean or sum of every N frames instead of each frame "
+                                        "(sums are saved as 32 bit)")
+        self.layout_triggered.addWidget(QLabel("Save reduced:"), 5, 0)
+        self.layout_triggered.addWidget(self.input_reduction, 5, 1)
+        
+        self.input_reduce_frames = QSpinBox()
+        self.input_reduce_frames.setRange(1, 10000)
+        self.input_reduce_frames.setValue(int(self.config.get("reduce_frames", 10)))
+        self.layout_triggered.addWidget(QLabel("Frames per image:"), 6, 0)
+        self.layout_triggered.addWidget(self.input_reduce_frames, 6, 1)
+        
+        self.input_reduce_binning = QComboBox()
+        for factor in BINNING_FACTORS:
+            self.input_reduce_binning.addItem(f"{factor}x{factor}", factor)
+        self.input_reduce_binning.setCurrentIndex(max(0, self.input_reduce_binning.findData(int(self.config.get("reduce_binning", 1)))))
+        self.input_reduce_binning.setToolTip("Binning of the saved images only, the display stays at full resolution")
+        self.layout_triggered.addWidget(QLabel("Save binning:"), 7, 0)
+        self.layout_triggered.addWidget(self.input_reduce_binning, 7, 1)
+        
+        self.input_reduce_polarity = QCheckBox("Separate images per polarity")
+        self.input_reduce_polarity.setChecked(self.config.get("reduce_by_polarity", False))
+        self.layout_triggered.addWidget(self.input_reduce_polarity, 8, 0, 1, 2)
+        
+        # Per-frame metrics logged to _FRAME_METRICS.csv and plotted under the voltage/current
+        self.input_frame_metrics = QCheckBox("Log frame metrics")
+        self.input_frame_metrics.setChecked(self.config.get("frame_metrics", True))
+        self.input_frame_metrics.setToolTip("Mean, max, plume centroid/spread and saturated pixels of every frame")
+        self.layout_triggered.addWidget(self.input_frame_metrics, 9, 0, 1, 2)
+        
+        self.input_metrics_stride = QSpinBox()
+        self.input_metrics_stride.setRange(1, 32)
+        self.input_metrics_stride.setValue(int(self.config.get("metrics_stride", 4)))
+        self.input_metrics_stride.setToolTip("Use every Nth pixel for the mean and plume shape (max and saturation use them all)")
+        self.layout_triggered.addWidget(QLabel("Metrics subsample:"), 10, 0)
+        self.layout_triggered.addWidget(self.input_metrics_stride, 10, 1)
+        
+        self.layout_left.addWidget(self.group_triggered)
 
         # ROI Settings
         self.group_roi = QGroupBox("Region of Interest")
@@ -879,6 +413,14 @@ class menu_camera_settings(QDialog):
         self.full_frame_button = QPushButton("Reset to full frame")
         self.full_frame_button.clicked.connect(self.reset_roi_to_full)
        
+            # Named sub-ROIs saved instead of the whole ROI (the camera reads out the box around them)
+        self.input_sub_rois = QLineEdit(self.config.get("sub_rois", ""))
+        self.input_sub_rois.setPlaceholderText("tip: 1800,300,2300,900; collector: 1500,2400,2600,2900")
+        self.input_sub_rois.setToolTip("name: TL_x,TL_y,BR_x,BR_y; ... in sensor pixels. Only these regions are saved, "
+                                       "each as its own dataset (_IMAGES_ROIS.h5). Leave empty to save the whole ROI.")
+        self.add_sub_roi_button = QPushButton("Add box as sub-ROI")
+        self.add_sub_roi_button.clicked.connect(self.add_sub_roi)
+        
         
             # Add to layout
         self.layout_roi.addWidget(QLabel("Top left"), 0, 0)
@@ -893,7 +435,10 @@ class menu_camera_settings(QDialog):
         self.layout_roi.addWidget(QLabel("y:"), 1, 3)
         self.layout_roi.addWidget(self.spin_BR_y, 1, 4)
         
+        self.layout_roi.addWidget(self.add_sub_roi_button, 2, 0, 1, 3)
         self.layout_roi.addWidget(self.full_frame_button, 2, 3, 1, 2)
+        self.layout_roi.addWidget(QLabel("Sub-ROIs:"), 3, 0)
+        self.layout_roi.addWidget(self.input_sub_rois, 3, 1, 1, 4)
         
         self.layout_left.addWidget(self.group_roi)
         
@@ -909,12 +454,10 @@ class menu_camera_settings(QDialog):
         self.group_preview.setLayout(self.layout_preview)
         self.main_layout.addWidget(self.group_preview, 3)
 
-        self.cam_view = pg.ImageView(view=pg.PlotItem())
-        self.cam_view.ui.roiBtn.hide()
-        self.cam_view.ui.menuBtn.hide()
-        self.cam_view.ui.histogram.hide()
-        self.cam_view.getView().setAspectLocked(True)
-        self.cam_view.getView().invertY(True)
+        self.cam_view = pg.PlotWidget()
+        self.cam_view.setAspectLocked(True)
+        self.cam_view.invertY(True)
+        self.cam_display = FastImageDisplay(self.cam_view.getPlotItem(), bit_depth=bit_depth)
         self.layout_preview.addWidget(self.cam_view)
 
         self.roi_tool = pg.RectROI(pos=[self.curr_TL_x, self.curr_TL_y],
@@ -932,6 +475,10 @@ class menu_camera_settings(QDialog):
         self.spin_BR_y.valueChanged.connect(self.update_roi_from_spinbox)
 
         self.start_preview()
+        
+        # Restart the preview when its settings change
+        self.input_preview_binning.currentIndexChanged.connect(self.start_preview)
+        self.input_preview_fps.editingFinished.connect(self.start_preview)
 
     def start_preview(self):
         """Configure worker for FULL FRAME preview"""
@@ -946,6 +493,8 @@ class menu_camera_settings(QDialog):
         self.worker.ROI = [0, 0, 4096, 3000] 
         self.worker.trigger_mode = "Software" 
         self.worker.exposure_time_us = 2000 
+        self.worker.binning = self.input_preview_binning.currentData()
+        self.worker.preview_fps = self.input_preview_fps.value()
         
         # 3. Connect signal to the dialog
         try:
@@ -953,13 +502,26 @@ class menu_camera_settings(QDialog):
         except:
             pass
         self.worker.image_ready.connect(self.update_image)
+        try:
+            self.worker.camera_metadata.disconnect(self.update_bit_depth)
+        except TypeError:
+            pass
+        self.worker.camera_metadata.connect(self.update_bit_depth)
         
         # 4. Start
         self.worker.start()
 
+    @pyqtSlot(dict)
+    def update_bit_depth(self, cam_meta):
+        # Sent before the first preview frame, the camera may not have been opened before
+        if cam_meta["bit_depth"] != self.cam_display.bit_depth:
+            self.cam_display.bit_depth = cam_meta["bit_depth"]
+            self.cam_display.reset()
+
     @pyqtSlot(object)
     def update_image(self, image_array):
-        self.cam_view.setImage(image_array.T, autoLevels=True)
+        # Stretch the (binned) preview over the full sensor so the ROI box is in full-sensor pixels
+        self.cam_display.set_frame(image_array, rect=QRectF(0, 0, 4096, 3000))
 
     def update_spinbox_from_roi(self):
         size = self.roi_tool.size()
@@ -1005,14 +567,50 @@ class menu_camera_settings(QDialog):
         self.roi_tool.setPos((0, 0))
         self.roi_tool.setSize([4096, 3000])
 
+    def add_sub_roi(self):
+        """Append the box drawn now to the sub-ROIs, as roi1, roi2..."""
+        try:
+            rois = parse_rois(self.input_sub_rois.text())
+        except ValueError as e:
+            QMessageBox.warning(self, "Sub-ROIs not valid", str(e))
+            return
+        n = len(rois) + 1
+        while f"roi{n}" in rois:
+            n += 1
+        rois[f"roi{n}"] = [self.spin_TL_x.value(), self.spin_TL_y.value(), self.spin_BR_x.value(), self.spin_BR_y.value()]
+        self.input_sub_rois.setText(multi_roi.format_rois(rois))
+
     def save_and_close(self):
+        try:
+            sub_rois = parse_rois(self.input_sub_rois.text())
+        except ValueError as e:
+            QMessageBox.warning(self, "Sub-ROIs not valid", str(e))
+            return
+        
         self.config["fps"] = self.input_fps.value()
         self.config["timing_mode"] = self.input_timing.currentText()
         self.config["trigger_mode"] = self.input_trigger.currentText()
+        self.config["separate_process"] = self.input_separate_process.isChecked()
+        self.config["compression"] = self.input_compression.currentText()
+        self.config["storage_policy"] = self.input_storage_policy.currentText()
+        self.config["record_mode"] = self.input_record_mode.currentText()
+        self.config["pre_trigger_frames"] = self.input_pre_frames.value()
+        self.config["post_trigger_frames"] = self.input_post_frames.value()
+        self.config["trigger_current_na"] = self.input_trigger_current.value()
+        self.config["trigger_on_polarity"] = self.input_trigger_polarity.isChecked()
+        self.config["reduction"] = self.input_reduction.currentText()
+        self.config["reduce_frames"] = self.input_reduce_frames.value()
+        self.config["reduce_binning"] = self.input_reduce_binning.currentData()
+        self.config["reduce_by_polarity"] = self.input_reduce_polarity.isChecked()
+        self.config["frame_metrics"] = self.input_frame_metrics.isChecked()
+        self.config["metrics_stride"] = self.input_metrics_stride.value()
+        self.config["preview_binning"] = self.input_preview_binning.currentData()
+        self.config["preview_fps"] = self.input_preview_fps.value()
         self.config["roi_TL_x"] = self.spin_TL_x.value()
         self.config["roi_TL_y"] = self.spin_TL_y.value()
         self.config["roi_BR_x"] = self.spin_BR_x.value()
         self.config["roi_BR_y"] = self.spin_BR_y.value()
+        self.config["sub_rois"] = multi_roi.format_rois(sub_rois)
         self.close_cleanly()
         self.accept()
         
@@ -1030,9 +628,12 @@ class menu_camera_settings(QDialog):
         # 2. Disconnect signal
         try:
             self.worker.image_ready.disconnect(self.update_image)
+            self.worker.camera_metadata.disconnect(self.update_bit_depth)
         except:
             pass
         self.worker.trigger_mode = self.config.get("trigger_mode", "Hardware")      
+        self.worker.binning = 1
+        self.worker.preview_fps = 0
     
     def closeEvent(self, event):
         self.close_cleanly()
@@ -1159,6 +760,13 @@ class ElectrosprayUI(QMainWindow):
         self.live_set_layout.addWidget(self.input_tare, 4, 0)
         self.live_set_layout.addWidget(self.input_check_smooth, 4, 1)
         
+                # Manual event (triggered recording)
+        self.btn_record_event = QPushButton("Record event")
+        self.btn_record_event.setToolTip("Save the frames around now (triggered recording mode)")
+        self.btn_record_event.setEnabled(False)
+        self.btn_record_event.clicked.connect(self.record_event)
+        self.live_set_layout.addWidget(self.btn_record_event, 5, 0, 1, 2)
+        
             # MAKE WHOLE ROW: Add both groups to the layout
         self.settings_layout.addWidget(self.group_static_settings, 1)
         self.settings_layout.addWidget(self.group_live_settings, 1)
@@ -1173,15 +781,12 @@ class ElectrosprayUI(QMainWindow):
         self.cam_feed_layout = QVBoxLayout()
         self.group_cam_feed.setLayout(self.cam_feed_layout)
         
-            # Create imageview
-        # view=pg.PlotItem() hides the histogram/ROI tools by default for a cleaner look
-        self.cam_view = pg.ImageView(view=pg.PlotItem()) 
-        self.cam_view.ui.roiBtn.hide()        # Hide the "ROI" button
-        self.cam_view.ui.menuBtn.hide()       # Hide the "Menu" button
-        self.cam_view.ui.histogram.hide()     # Hide Histogram (CPU heavy, enable if needed)
-        self.cam_view.getView().getAxis('left').hide()
-        self.cam_view.getView().getAxis('bottom').hide()
-        self.cam_view.getView().setAspectLocked(True)
+            # Create image view
+        # A bare ViewBox with one persistent ImageItem (no histogram/ROI tools to update every frame)
+        self.cam_view = pg.GraphicsLayoutWidget()
+        self.cam_viewbox = self.cam_view.addViewBox()
+        self.cam_viewbox.setAspectLocked(True)
+        self.cam_display = FastImageDisplay(self.cam_viewbox)
         
         self.cam_feed_layout.addWidget(self.cam_view)
 
@@ -1192,10 +797,12 @@ class ElectrosprayUI(QMainWindow):
         
                 # Plot window
                     # Set-up the rolling window data
-        self.plot_max_points = 300      # How many points to plot at once
-        self.data_time = deque(maxlen = self.plot_max_points)
-        self.data_voltage = deque(maxlen = self.plot_max_points)
-        self.data_current = deque(maxlen = self.plot_max_points)
+        self.plot_max_points = 20000    # How many points to plot at once
+        self.plot_fps = 30              # Redraw rate of the live plot (independent of DAQ rate)
+        self.plot_data = RingBuffer(self.plot_max_points, n_channels = 3)    # Time, Voltage, Current (each chunk's min/max)
+        self.plot_smooth = RingBuffer(self.plot_max_points, n_channels = 3)  # Time, Voltage, Current (rolling mean, if smoothing)
+        self.plot_history = LODHistory()    # Whole run, for panning/zooming back in time
+        self.plot_dirty = False
         self.start_time = time.time()
         
                     # Graph widget set-up
@@ -1211,6 +818,8 @@ class ElectrosprayUI(QMainWindow):
         self.plot_V.setLabel("left", "Voltage", units = "V")
         self.curve_V = self.plot_V.plot(pen = pg.mkPen(self.voltage_colour, width = 2), name = "Voltage")
         self.plot_V.setLabel("bottom", "Time", units = "s")
+        self.curve_V.setClipToView(True)
+        self.curve_V.setDownsampling(auto = True, method = "peak")
         
                     # Plot 2 - Collector current
         self.view_current = pg.ViewBox()
@@ -1223,12 +832,25 @@ class ElectrosprayUI(QMainWindow):
         self.view_current.addItem(self.curve_I)
         self.legend.addItem(self.curve_I, "Collector current")
         
+                    # Rolling means, drawn over the min/max when the live plot is smoothed
+        self.curve_V_mean = self.plot_V.plot()
+        self.curve_I_mean = pg.PlotCurveItem()
+        self.view_current.addItem(self.curve_I_mean)
+        self.set_plot_pens(self.input_check_smooth.isChecked())
+        
                     # Plot 3 - Photo triggers
         self.trigger_scatter = pg.ScatterPlotItem(size = 10, pen = pg.mkPen(None), brush=pg.mkBrush(255, 0, 0, 200))
         self.plot_V.addItem(self.trigger_scatter)
-        self.trigger_points_x = deque(maxlen=self.plot_max_points)
-        self.trigger_points_y = deque(maxlen=self.plot_max_points)
+        self.trigger_points = RingBuffer(self.plot_max_points, n_channels = 2)  # Time, Voltage
+        
         
+                    # Plot 4 - Frame metrics (see frame_metrics.py), under the voltage/current on the same time axis
+        self.plot_M = self.graph_widget.addPlot(row = 1, col = 0)
+        self.plot_M.setXLink(self.plot_V)
+        self.plot_M.setMaximumHeight(160)
+        self.plot_M.setLabel("left", METRIC_HEADERS[2])
+        self.curve_M = self.plot_M.plot(pen = pg.mkPen("#2ca02c", width = 2), connect = "finite")
+        self.metric_data = RingBuffer(self.plot_max_points, n_channels = 1 + len(METRICS))   # Time, METRICS
         
         def update_views():
             # Function to update the view box to match the first (voltage)
@@ -1237,9 +859,28 @@ class ElectrosprayUI(QMainWindow):
         
         self.plot_V.vb.sigResized.connect(update_views)
         
+                    # Panning/zooming stops the live scroll and draws from the whole-run history instead
+                    # (the "A" button in the corner of the plot goes back to the live view)
+        self.plot_V.vb.sigRangeChangedManually.connect(self.history_view_changed)
+        
+                    # Redraw timer (also collects everything the workers sent since the last tick)
+        self.plot_timer = QTimer(self)
+        self.plot_timer.timeout.connect(self.gui_tick)
+        self.plot_timer.start(int(1000 / self.plot_fps))
+        
                     # Add graphs to layout
         self.plots_layout.addWidget(self.graph_widget)
         
+                    # Which frame metric is plotted
+        self.input_plot_metric = QComboBox()
+        self.input_plot_metric.addItems(METRIC_HEADERS[2:])
+        self.input_plot_metric.currentIndexChanged.connect(self.update_plot_metric)
+        self.metric_select_layout = QHBoxLayout()
+        self.metric_select_layout.addWidget(QLabel("Frame metric:"))
+        self.metric_select_layout.addWidget(self.input_plot_metric)
+        self.metric_select_layout.addStretch()
+        self.plots_layout.addLayout(self.metric_select_layout)
+        
                 # Log Window
         self.log_box = QTextEdit()
         self.log_box.setReadOnly(True)
@@ -1252,9 +893,17 @@ class ElectrosprayUI(QMainWindow):
         self.main_layout.addLayout(self.feeds_layout, stretch = 2)
 
         # Initialize Workers
+        # Their frequent updates go through the telemetry bus, drained once per GUI tick
+        self.telemetry = TelemetryBus()
+        self.camera_session = CameraSession()     # SDK and camera stay open between runs/previews
         self.cam_worker = CameraWorker()
+        self.cam_worker.session = self.camera_session
         self.daq_worker = DAQWorker()
         self.ks_worker = KeysightWorker()
+        self.resource_check = ResourceCheckWorker()     # Calibration and disk speed for the resource planner
+        self.cam_worker.bus = self.telemetry
+        self.daq_worker.bus = self.telemetry
+        self.ks_worker.bus = self.telemetry
 
         # Connect Signals (Worker -> GUI)
         self.cam_worker.log_message.connect(self.append_log)
@@ -1265,6 +914,7 @@ class ElectrosprayUI(QMainWindow):
         self.daq_worker.photo_triggered.connect(self.mark_photo_on_graph)
         self.ks_worker.log_message.connect(self.append_log)
         self.ks_worker.ks_reading.connect(self.daq_worker.update_ks_value)
+        self.resource_check.log_message.connect(self.append_log)
 
 
         # Recall previous settings values
@@ -1273,30 +923,16 @@ class ElectrosprayUI(QMainWindow):
             # restore values
                 # filepath
         self.input_filepath.setText(self.settings.value("filepath", ""))  
+        self.input_filepath.editingFinished.connect(lambda: self.resource_check.check(self.input_filepath.text()))
+        self.resource_check.check(self.input_filepath.text())
                 # Voltage Controls
         self.input_voltage.setValue(float(self.settings.value("voltage", 0.0)))
         self.input_high_time.setValue(float(self.settings.value("high_time", 1.0)))
         self.input_polarity_mode.setCurrentIndex(int(self.settings.value("polarity_idx", 0)))
         self.input_gain.setCurrentText(self.settings.value("gain", "10⁶"))
         
-        self.hw_config = {
-            "ai_device": self.settings.value("ai_device", "cDAQ9185-2023AF4Mod1"),
-            "ai_channels": self.settings.value("ai_channels", "0, 1"),
-            "ao_device": self.settings.value("ao_device", "cDAQ9185-2023AF4Mod2"),
-            "ao_channels": self.settings.value("ao_channels", "0, 1"),
-            "ai_map": self.settings.value("ai_map", {}),
-            "ao_map": self.settings.value("ao_map", {})
-        }
-        
-        self.cam_config = {
-            "fps": float(self.settings.value("cam_fps", 10.0)),
-            "timing_mode": self.settings.value("cam_timing", "Continuous"),
-            "trigger_mode": self.settings.value("cam_trigger", "Software"),
-            "roi_TL_x" : int(self.settings.value("cam_roi_TL_x", 0)),
-            "roi_TL_y" : int(self.settings.value("cam_roi_TL_y", 0)),
-            "roi_BR_x" : int(self.settings.value("cam_roi_BR_x", 4096)),
-            "roi_BR_y" : int(self.settings.value("cam_roi_BR_y", 3000))
-        }
+        self.hw_config = read_hw_config(self.settings)
+        self.cam_config = read_cam_config(self.settings)
 
         # Menu Bar and Hardware Config Menu/Dialogue
         self.menubar = self.menuBar()
@@ -1310,18 +946,24 @@ class ElectrosprayUI(QMainWindow):
         action_camera.triggered.connect(self.open_camera_config)
 
     def start_system(self):
+        # Check this PC and disk can keep up before anything starts
+        if not self.check_plan():
+            return
+        
         # UI Updates
         self.btn_start.setEnabled(False)
         self.btn_stop.setEnabled(True)
         self.combo_mode.setEnabled(False)
         self.append_log("System Starting...")
         
-        # Recreate camera worker fresh to avoid stale SDK state from preview
+        # Recreate camera worker fresh (the SDK and camera are kept open in the session)
         try:
             self.cam_worker.image_ready.disconnect(self.update_image_display)
         except TypeError:
             pass
         self.cam_worker = CameraWorker()
+        self.cam_worker.session = self.camera_session
+        self.cam_worker.bus = self.telemetry
         self.cam_worker.log_message.connect(self.append_log)
         self.cam_worker.image_ready.connect(self.update_image_display)
         self.cam_worker.camera_metadata.connect(self.append_camera_metadata)
@@ -1334,13 +976,16 @@ class ElectrosprayUI(QMainWindow):
         self.input_sample_rate.setEnabled(False)
         
         # Clear buffers (for plot)
-        self.data_time.clear()
-        self.data_voltage.clear()
-        self.data_current.clear()
-        self.trigger_points_x.clear()
-        self.trigger_points_y.clear()
+        self.plot_data.clear()
+        self.plot_smooth.clear()
+        self.plot_history.clear()
+        self.trigger_points.clear()
         self.trigger_scatter.setData([], [])
+        self.metric_data.clear()
+        self.plot_dirty = True
         self.start_time = time.time()
+        self.daq_worker.experiment_start_time = None    # Set again when the DAQ starts (frame metrics are plotted against it)
+        metrics.reset()
         self.daq_worker.current_frame_id = 0
         self.daq_worker.last_fval_state = False
         self.daq_worker.last_cam_trigger_time = time.time()
@@ -1366,11 +1011,39 @@ class ElectrosprayUI(QMainWindow):
         if use_cam == True:
             self.cam_worker.filepath = f"{self.input_filepath.text()}/{self.filenametime}_IMAGES.tiff"
             
-            self.cam_worker.ROI = [self.cam_config["roi_TL_x"],
-                                   self.cam_config["roi_TL_y"],
-                                   self.cam_config["roi_BR_x"],
-                                   self.cam_config["roi_BR_y"]]
+            self.cam_worker.ROI = camera_roi(self.cam_config)
+            self.cam_worker.sub_rois = parse_rois(self.cam_config["sub_rois"])
             self.cam_worker.trigger_mode = self.cam_config["trigger_mode"]
+            self.cam_worker.use_process = self.cam_config["separate_process"]
+            self.cam_worker.compression = self.cam_config["compression"]
+            self.cam_worker.storage_policy = self.cam_config["storage_policy"]
+            self.cam_worker.record_mode = self.cam_config["record_mode"]
+            self.cam_worker.pre_trigger_frames = self.cam_config["pre_trigger_frames"]
+            self.cam_worker.post_trigger_frames = self.cam_config["post_trigger_frames"]
+            self.cam_worker.reduction = self.cam_config["reduction"]
+            self.cam_worker.reduce_frames = self.cam_config["reduce_frames"]
+            self.cam_worker.reduce_binning = self.cam_config["reduce_binning"]
+            self.cam_worker.reduce_by_polarity = self.cam_config["reduce_by_polarity"]
+            self.cam_worker.frame_metrics = self.cam_config["frame_metrics"]
+            self.cam_worker.metrics_stride = self.cam_config["metrics_stride"]
+        
+        # Events to record around (straight to the camera worker, it only queues them)
+        triggered = use_cam and self.cam_config["record_mode"] == "Triggered"
+        self.daq_worker.trigger_current_a = self.cam_config["trigger_current_na"] * 1e-9 if triggered else 0.0
+        self.daq_worker.trigger_on_polarity = triggered and self.cam_config["trigger_on_polarity"]
+        try:
+            self.daq_worker.recording_event.disconnect()
+        except TypeError:
+            pass
+        self.daq_worker.recording_event.connect(self.cam_worker.trigger_recording, Qt.ConnectionType.DirectConnection)
+        self.btn_record_event.setEnabled(triggered)
+        
+        # Polarity for per-polarity reduction, also straight through (it's just an attribute write)
+        try:
+            self.daq_worker.polarity_changed.disconnect()
+        except TypeError:
+            pass
+        self.daq_worker.polarity_changed.connect(self.cam_worker.set_polarity, Qt.ConnectionType.DirectConnection)
             
             # Daq worker
         self.daq_worker.filepath = f"{self.input_filepath.text()}/{self.filenametime}_DATA.csv"
@@ -1383,19 +1056,8 @@ class ElectrosprayUI(QMainWindow):
         ao_str = self.hw_config.get("ao_channels", "")
 
         try:
-            # Split by comma, strip whitespace, and ignore empty strings
-            # This handles "0, 1" AND "" safely.
-            
-            if ai_str.strip():
-                ai_chans = [int(x.strip()) for x in ai_str.split(',') if x.strip()]
-            else:
-                ai_chans = [] # Empty list if string is empty
-
-            if ao_str.strip():
-                ao_chans = [int(x.strip()) for x in ao_str.split(',') if x.strip()]
-            else:
-                ao_chans = []
-                
+            ai_chans = parse_channel_list(ai_str)
+            ao_chans = parse_channel_list(ao_str)
         except ValueError:
             self.append_log("Error parsing channels! Check config format.")
             self.btn_start.setEnabled(True) 
@@ -1428,6 +1090,59 @@ class ElectrosprayUI(QMainWindow):
         
         self.append_log(f"Camera timing mode: {self.cam_config['timing_mode']}") 
         
+    def check_plan(self):
+        """
+        Expected data rates, CPU and disk use of the run (see resource_planner.py).
+        Won't start a run that will overrun, and asks first if there's little headroom.
+        """
+        use_cam = "Camera" in self.combo_mode.currentText()
+        if self.input_sample_rate.value() <= 0:
+            self.append_log("Cannot start: the DAQ sample period must be more than 0 ms")
+            return False
+        try:
+            roi = camera_roi(self.cam_config)
+        except ValueError as e:
+            self.append_log(f"Cannot start: {e}")
+            QMessageBox.critical(self, "Sub-ROIs not valid", str(e))
+            return False
+        try:
+            n_ai = len(parse_channel_list(self.hw_config.get("ai_channels", "")))
+            n_ao = len(parse_channel_list(self.hw_config.get("ao_channels", "")))
+        except ValueError:
+            n_ai = n_ao = 0     # start_system reports the bad channel list
+        directory = self.input_filepath.text()
+        if not self.resource_check.ready(directory):
+            # Benchmarking here would freeze the window for seconds
+            self.resource_check.check(directory)
+            self.append_log("Resource planner: still calibrating and measuring the save folder, press Start again in a moment")
+            return False
+        
+        plan = resource_planner.plan(roi, self.cam_config["fps"], 1000 / self.input_sample_rate.value(), n_ai, n_ao,
+                                     self.cam_config["compression"], self.cam_display.bit_depth, use_camera=use_cam,
+                                     separate_process=self.cam_config["separate_process"],
+                                     saved_fraction=reduction_fraction(self.cam_config),
+                                     directory=directory, calibration=self.resource_check.calibration,
+                                     measure_disk=False, disk_bandwidth=self.resource_check.bandwidths.get(directory))
+        self.append_log(resource_planner.describe(plan))
+        disk = plan["disk"]
+        if disk is not None and disk["bandwidth_mb_s"] is not None:
+            self.append_log(f"Storage: disk writes {disk['bandwidth_mb_s']:.1f} MB/s, {disk['free_gb']:.1f} GB free "
+                            f"(full in {storage_monitor.format_duration(disk['time_to_full_s'])})")
+        
+        for problem in plan["problems"]:
+            self.append_log(f"Cannot start: {problem}")
+        for warning in plan["warnings"]:
+            self.append_log(f"Warning: {warning}")
+        
+        if plan["problems"]:
+            QMessageBox.critical(self, "Settings not sustainable", "\n".join(plan["problems"]))
+            return False
+        if plan["warnings"]:
+            answer = QMessageBox.warning(self, "Little headroom", "\n".join(plan["warnings"]) + "\n\nStart anyway?",
+                                         QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+            return answer == QMessageBox.StandardButton.Yes
+        return True
+        
     def closeEvent(self, event):
         """
         Runs automatically when the user clicks 'X'.
@@ -1437,6 +1152,14 @@ class ElectrosprayUI(QMainWindow):
         if self.daq_worker.is_running or self.cam_worker.is_running or self.ks_worker.is_running:
             self.stop_system() # Force a safe shutdown of hardware
             time.sleep(0.5)    # Give threads a tiny moment to close file handles
+        
+        self.resource_check.wait()
+        
+        # Release the camera and SDK
+        try:
+            self.camera_session.close()
+        except Exception as e:
+            print(f"Camera close error: {e}")
             
         # Save all settings to file
         self.settings.setValue("filepath", self.input_filepath.text())
@@ -1460,6 +1183,23 @@ class ElectrosprayUI(QMainWindow):
         self.settings.setValue("cam_roi_TL_y", self.cam_config["roi_TL_y"])
         self.settings.setValue("cam_roi_BR_x", self.cam_config["roi_BR_x"])
         self.settings.setValue("cam_roi_BR_y", self.cam_config["roi_BR_y"])
+        self.settings.setValue("cam_separate_process", self.cam_config["separate_process"])
+        self.settings.setValue("cam_preview_binning", self.cam_config["preview_binning"])
+        self.settings.setValue("cam_preview_fps", self.cam_config["preview_fps"])
+        self.settings.setValue("cam_compression", self.cam_config["compression"])
+        self.settings.setValue("cam_storage_policy", self.cam_config["storage_policy"])
+        self.settings.setValue("cam_record_mode", self.cam_config["record_mode"])
+        self.settings.setValue("cam_pre_trigger_frames", self.cam_config["pre_trigger_frames"])
+        self.settings.setValue("cam_post_trigger_frames", self.cam_config["post_trigger_frames"])
+        self.settings.setValue("cam_trigger_current_na", self.cam_config["trigger_current_na"])
+        self.settings.setValue("cam_trigger_on_polarity", self.cam_config["trigger_on_polarity"])
+        self.settings.setValue("cam_reduction", self.cam_config["reduction"])
+        self.settings.setValue("cam_reduce_frames", self.cam_config["reduce_frames"])
+        self.settings.setValue("cam_reduce_binning", self.cam_config["reduce_binning"])
+        self.settings.setValue("cam_reduce_by_polarity", self.cam_config["reduce_by_polarity"])
+        self.settings.setValue("cam_frame_metrics", self.cam_config["frame_metrics"])
+        self.settings.setValue("cam_metrics_stride", self.cam_config["metrics_stride"])
+        self.settings.setValue("cam_sub_rois", self.cam_config["sub_rois"])
         
         # Close up
         event.accept()
@@ -1502,14 +1242,18 @@ class ElectrosprayUI(QMainWindow):
         except TypeError:
             pass 
 
-        # 3. Open Dialog
-        dialog = menu_camera_settings(self.cam_config, self.cam_worker, self)
+        # 3. Open Dialog (the preview uses the worker's own signals, not the telemetry bus)
+        self.cam_worker.bus = None
+        dialog = menu_camera_settings(self.cam_config, self.cam_worker, self, bit_depth=self.cam_display.bit_depth)
         
         if dialog.exec():
             self.append_log(f"Config Updated. ROI: ({self.cam_config['roi_TL_x']}, {self.cam_config['roi_TL_y']}) to ({self.cam_config['roi_BR_x']}, {self.cam_config['roi_BR_y']})")
+            if self.cam_config["sub_rois"]:
+                self.append_log(f"Sub-ROIs (saved instead of the whole ROI): {self.cam_config['sub_rois']}")
             
         # 4. Reconnect Main Window Signal
         self.cam_worker.image_ready.connect(self.update_image_display)
+        self.cam_worker.bus = self.telemetry
 
     def stop_system(self):
         self.append_log("Stopping...")
@@ -1517,6 +1261,14 @@ class ElectrosprayUI(QMainWindow):
         self.daq_worker.stop()
         self.ks_worker.stop()
         
+        # Stage timings of the run go in its metadata file
+        if hasattr(self, "filenametime"):
+            filepath = f"{self.inputted_filepath}/{self.filenametime}_METADATA.json"
+            save_to_metadata(filepath)
+            self.append_log(f"Timing metrics saved to {filepath}")
+            if self.cam_worker.storage_summary is not None:
+                storage_monitor.save_to_metadata(filepath, self.cam_worker.storage_summary)
+        
         # unlock inputs
         self.input_sample_rate.setEnabled(True)
         self.input_filepath.setEnabled(True)
@@ -1524,6 +1276,7 @@ class ElectrosprayUI(QMainWindow):
         self.btn_start.setEnabled(True)
         self.btn_stop.setEnabled(False)
         self.combo_mode.setEnabled(True)
+        self.btn_record_event.setEnabled(False)
 
     def write_metadata(self, cam_meta=None):
         metadata = {
@@ -1549,54 +1302,117 @@ class ElectrosprayUI(QMainWindow):
 
     @pyqtSlot(object)
     def update_image_display(self, image_array):
-        # Transpose to fix rotation (Cameras scan differently than screens)
-        display_data = image_array.T
+        # Zooms to fit on the first frame (or a new ROI size), afterwards keeps the user's zoom/pan
+        t = time.perf_counter_ns()
+        self.cam_display.set_frame(image_array)
+        gui_image_time.record_since(t)
+            
+    @pyqtSlot(dict)
+    def update_daq_display(self, envelope):
+        # Just store the chunk, the plot timer does the drawing
+        self.plot_data.extend(envelope["t"], envelope["volts"], envelope["current"])
+        self.plot_smooth.extend(envelope["smooth_t"], envelope["smooth_volts"], envelope["smooth_current"])
+        self.plot_history.extend(envelope["t"], envelope["volts"], envelope["current"])
+        
+        # Frames seen on the FVAL line, marked where they happened within the chunk
+        edges = envelope["fval_edges"]
+        if len(edges) > 0:
+            edge_volts = np.interp(edges, envelope["t"], envelope["volts"])
+            self.trigger_points.extend(edges, edge_volts)
+            self.plot_history.add_triggers(edges, edge_volts)
+        self.plot_dirty = True
 
-        # AUTO-RANGE LOGIC
-        # If the view is empty (first frame), Force Zoom-to-Fit
-        if self.cam_view.image is None:
-            self.cam_view.setImage(display_data, autoLevels=True, autoRange=True)
-        else:
-            # Afterwards, keep user's zoom/pan
-            self.cam_view.setImage(display_data, autoLevels=False, autoRange=False)
+    @pyqtSlot()
+    def gui_tick(self):
+        # One snapshot of everything the workers posted since the last tick
+        t = time.perf_counter_ns()
+        snapshot = self.telemetry.drain()
+        
+        if snapshot["log"]:
+            if snapshot["log_dropped"]:
+                snapshot["log"].insert(0, f"({snapshot['log_dropped']} log lines dropped)")
+            self.append_log("\n".join(snapshot["log"]))
+        if snapshot["envelope"] is not None:
+            self.update_daq_display(snapshot["envelope"])
+        if snapshot["triggers"]:
+            self.mark_triggers(snapshot["triggers"])
+        if snapshot["frame_metrics"]:
+            self.update_metrics_display(snapshot["frame_metrics"])
+        if snapshot["frame"] is not None:
+            self.update_image_display(snapshot["frame"])
             
-    @pyqtSlot(float, float)
-    def update_daq_display(self, volts, amps):
-        # Update plots
-        t = time.time() - self.start_time
-        self.data_time.append(t)
-        self.data_voltage.append(volts)
-        self.data_current.append(amps)
-        
-        self.curve_V.setData(list(self.data_time), list(self.data_voltage))
-        self.curve_I.setData(list(self.data_time), list(self.data_current))
-        
-        if len(self.data_time) > 0:
-            oldest_visible_time = self.data_time[0]
-            markers_changed = False
+        self.refresh_plot()
+        gui_tick_time.record_since(t)
+
+    def update_metrics_display(self, rows):
+        # Frame metrics rows (frame ID, time.time(), *METRICS) onto the plot's time axis (seconds since the DAQ started)
+        rows = np.asarray(rows, dtype=np.float64)
+        daq_start = getattr(self.daq_worker, "experiment_start_time", None)
+        t0 = daq_start.timestamp() if daq_start is not None else self.start_time
+        self.metric_data.extend(rows[:, 1] - t0, *rows[:, 2:].T)
+        self.plot_dirty = True
+
+    @pyqtSlot()
+    def update_plot_metric(self):
+        self.plot_M.setLabel("left", self.input_plot_metric.currentText())
+        self.plot_dirty = True
+
+    @pyqtSlot()
+    def history_view_changed(self):
+        self.plot_dirty = True
+
+    @pyqtSlot()
+    def refresh_plot(self):
+        # Redraw at a fixed rate, and only if new data has arrived
+        if not self.plot_dirty:
+            return
+        self.plot_dirty = False
+        t_draw = time.perf_counter_ns()
+        
+        if self.plot_V.vb.autoRangeEnabled()[0]:
+            # LIVE VIEW: the most recent points from the ring buffer
+            # Copies, as the ring buffer keeps being written to after setData
+            t, v, i = self.plot_data.view().copy()
+            smooth_t, smooth_v, smooth_i = self.plot_smooth.view().copy()
             
-            # Get rid of old photo dots
-            while len(self.trigger_points_x) > 0 and self.trigger_points_x[0] < oldest_visible_time:
-                self.trigger_points_x.popleft()
-                self.trigger_points_y.popleft()
-                markers_changed = True
-                
-            # If we deleted a dot, refresh the scatter plot to clear it from the screen
-            if markers_changed:
-                self.trigger_scatter.setData(list(self.trigger_points_x), list(self.trigger_points_y))
+            # Only show photo dots (and means) that are still within the plotted window
+            trig_t, trig_v = self.trigger_points.view()
+            if len(t) > 0:
+                visible = trig_t >= t[0]
+                trig_t, trig_v = trig_t[visible], trig_v[visible]
+                visible = smooth_t >= t[0]
+                smooth_t, smooth_v, smooth_i = smooth_t[visible], smooth_v[visible], smooth_i[visible]
+        else:
+            # HISTORY VIEW: pick the pyramid level giving ~2 points per pixel of the visible range
+            x_min, x_max = self.plot_V.vb.viewRange()[0]
+            n_pixels = max(100, int(self.plot_V.vb.width()))
+            t, v, i = self.plot_history.get(x_min, x_max, 2 * n_pixels).copy()
+            smooth_t = smooth_v = smooth_i = t[:0]     # The history keeps the min/max only
+            trig_t, trig_v = self.plot_history.get_triggers(x_min, x_max, n_pixels)
+            
+        self.curve_V.setData(t, v, skipFiniteCheck = True)
+        self.curve_I.setData(t, i, skipFiniteCheck = True)
+        self.curve_V_mean.setData(smooth_t, smooth_v, skipFiniteCheck = True)
+        self.curve_I_mean.setData(smooth_t, smooth_i, skipFiniteCheck = True)
+        self.trigger_scatter.setData(trig_t.copy(), trig_v.copy())
+        
+        # Frame metrics (NaN centroids/spread when there's no plume, so not skipFiniteCheck)
+        metric = self.metric_data.view()
+        self.curve_M.setData(metric[0].copy(), metric[1 + self.input_plot_metric.currentIndex()].copy())
+        gui_plot_time.record_since(t_draw)
         
         #self.voltage_placeholder_text.setText(f"Voltage: {volts:.2f} V | Current: {amps:.6f} A")
 
-    @pyqtSlot()
-    def mark_photo_on_graph(self):
-        # Only mark it if we have valid voltage data
-        if len(self.data_time) > 0:
-            current_t = self.data_time[-1]
-            current_v = self.data_voltage[-1]
-            
-            self.trigger_points_x.append(current_t)
-            self.trigger_points_y.append(current_v)
-            self.trigger_scatter.setData(list(self.trigger_points_x), list(self.trigger_points_y))
+    @pyqtSlot(float, float)
+    def mark_photo_on_graph(self, t, volts):
+        self.mark_triggers([(t, volts)])
+
+    def mark_triggers(self, points):
+        # One marker per camera trigger, at the time it was sent
+        t, volts = np.asarray(points, dtype=np.float64).T
+        self.trigger_points.extend(t, volts)
+        self.plot_history.add_triggers(t, volts)
+        self.plot_dirty = True
 
     @pyqtSlot()
     def tare_voltage(self):
@@ -1607,17 +1423,37 @@ class ElectrosprayUI(QMainWindow):
         else:
             self.append_log("Cannot tare: Start the acquisition first so the DAQ can read the baseline!")
 
+    @pyqtSlot()
+    def record_event(self):
+        # Around the newest frame the camera has
+        self.cam_worker.trigger_recording("manual")
+        self.append_log(f"Event recorded at frame {self.daq_worker.current_frame_id}")
+
     @pyqtSlot()
     def update_gain(self):
         self.daq_worker.gain = self.input_gain.currentData()
 
     @pyqtSlot()
     def update_DAQ_smoothing(self):
-        self.daq_worker.smooth_display = self.input_check_smooth.isChecked()
+        smooth = self.input_check_smooth.isChecked()
+        self.daq_worker.smooth_display = smooth
+        self.set_plot_pens(smooth)
+        if not smooth:
+            self.plot_smooth.clear()
+            self.plot_dirty = True
+
+    def set_plot_pens(self, smooth):
+        # Smoothed: thin min/max lines with the mean over them, otherwise just the min/max
+        self.curve_V.setPen(pg.mkPen(self.voltage_colour, width = 1 if smooth else 2))
+        self.curve_I.setPen(pg.mkPen(self.collector_current_colour, width = 1 if smooth else 2))
+        self.curve_V_mean.setPen(pg.mkPen(QColor(self.voltage_colour).darker(150), width = 2))
+        self.curve_I_mean.setPen(pg.mkPen(QColor(self.collector_current_colour).darker(150), width = 2))
 
     @pyqtSlot(dict)
     def append_camera_metadata(self, cam_meta):
         self.write_metadata(cam_meta=cam_meta)
+        self.cam_display.bit_depth = cam_meta["bit_depth"]
+        self.cam_display.reset()
         self.append_log(f"Camera metadata appended: readout offset = {cam_meta['readout_time_us']} us")
 
 # --- APP ENTRY POINT ---
@@ -1626,4 +1462,11 @@ if __name__ == "__main__":
     window = ElectrosprayUI()
     window.setWindowIcon(QIcon("icon.ico"))
     window.show()
+    if "--profile-imports" in sys.argv:
+        print(lazy_imports.report())
+    if "--metrics-port" in sys.argv:
+        # Prometheus text at http://127.0.0.1:<port>/metrics
+        metrics_port = int(sys.argv[sys.argv.index("--metrics-port") + 1])
+        metrics_server = start_http_server(metrics_port)
+        print(f"Metrics at http://127.0.0.1:{metrics_port}/metrics")
     sys.exit(app.exec())
\ No newline at end of file
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Delta codec
+
+Lossless temporal compression for recordings where most of each frame is
+the same static background. Rather than compressing every frame on its own,
+frames are stored as residuals against a reference, which are mostly small
+numbers and compress much better:
+
+    "previous"      - every keyframe_interval-th frame is stored as it is,
+                      the frames after it as the difference from the frame
+                      before. Reading frame i means summing the residuals
+                      from its keyframe.
+    "background"    - frames are taken in groups of keyframe_interval, the
+                      (rounded) mean of each group is stored as its
+                      background, and every frame as the difference from its
+                      group's background. Averaging takes most of the shot
+                      noise out of the reference, and any frame is decoded
+                      from two reads. The writer holds one group in memory.
+
+Residuals are taken modulo 2^16 and zigzag mapped (0, -1, 1, -2... -> 0, 1,
+2, 3...) so small differences of either sign become small unsigned numbers,
+then byte shuffled and compressed by HDF5 one frame per chunk (the codecs of
+tiff_compressor.py). This is lossless for any uint16 data.
+
+File layout (HDF5):
+    espray_delta                (n_frames, rows, cols) uint16, residuals or keyframes
+    espray_delta_backgrounds    (n_groups, rows, cols) uint16, "background" mode only
+with the mode, keyframe_interval and codec as attributes of espray_delta.
+
+Reading:
+    with DeltaReader("..._IMAGES_DELTA.h5") as stack:
+        frame = stack[120]
+        block = stack[100:200]
+
+Converting an existing recording (and comparing with per-frame compression):
+    python delta_codec.py ESPRAY_2026-03-10_1546_IMAGES.tiff --mode background
+
+@author: edh1g18
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import tifffile
+import h5py
+
+from tiff_compressor import dataset_filters, hdf5plugin
+
+DATASET = "espray_delta"
+BACKGROUNDS = "espray_delta_backgrounds"
+MODES = ("previous", "background")
+ENCODING = "delta-v1"
+
+
+def zigzag_encode(residual):
+    """uint16 residuals (mod 2^16) -> zigzag mapped uint16, in place"""
+    signed = residual.view(np.int16)
+    sign = signed >> 15             # 0 or -1
+    signed <<= 1
+    signed ^= sign
+    return residual
+
+
+def zigzag_decode(mapped):
+    """Inverse of zigzag_encode, in place (mod 2^16)"""
+    sign = (mapped & 1) * np.uint16(0xFFFF)
+    mapped >>= 1
+    mapped ^= sign
+    return mapped
+
+
+def residual(frame, reference):
+    """Zigzag mapped frame - reference"""
+    return zigzag_encode(np.subtract(frame, reference, dtype=np.uint16))
+
+
+def default_codec():
+    """zstd (fast) if hdf5plugin is installed, otherwise gzip"""
+    return ("zstd", 3) if hdf5plugin is not None else ("gzip", 4)
+
+
+class DeltaWriter:
+    """
+    Writes frames one at a time (the same interface as the frame_writers.py
+    writers, so CameraWorker can record with it).
+    """
+    def __init__(self, filepath, mode="previous", keyframe_interval=32, codec=None, level=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown delta mode '{mode}', expected one of {MODES}")
+        if codec is None:
+            codec, level = default_codec()
+        self.filepath = filepath
+        self.mode = mode
+        self.keyframe_interval = keyframe_interval
+        self.codec = codec
+        self.level = level
+        self.compression = "delta"
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.h5 = h5py.File(filepath, 'w')
+        self.dataset = None
+        self.backgrounds = None
+        self.previous = None
+        self.group = []
+
+    def create_datasets(self, shape):
+        h, w = shape
+        filters = dataset_filters(self.codec, self.level)
+        self.dataset = self.h5.create_dataset(DATASET, shape=(0, h, w), maxshape=(None, h, w), dtype=np.uint16,
+                                              chunks=(1, h, w), **filters)
+        self.dataset.attrs.update({"encoding": ENCODING, "mode": self.mode, "keyframe_interval": self.keyframe_interval,
+                                   "codec": self.codec, "level": -1 if self.level is None else self.level})
+        if self.mode == "background":
+            self.backgrounds = self.h5.create_dataset(BACKGROUNDS, shape=(0, h, w), maxshape=(None, h, w),
+                                                      dtype=np.uint16, chunks=(1, h, w), **filters)
+
+    def write(self, image):
+        if image.dtype != np.uint16:
+            raise ValueError(f"The delta codec stores uint16 frames, not {image.dtype}")
+        if self.dataset is None:
+            self.create_datasets(image.shape)
+        elif image.shape != self.dataset.shape[1:]:
+            raise ValueError(f"Frame shape changed from {self.dataset.shape[1:]} to {image.shape}")
+
+        if self.mode == "previous":
+            if self.frames_written % self.keyframe_interval == 0:
+                stored = image
+            else:
+                stored = residual(image, self.previous)
+            # Copied, the caller may reuse its frame buffer for the next frame
+            if self.previous is None:
+                self.previous = image.copy()
+            else:
+                np.copyto(self.previous, image)
+            self.append(self.dataset, stored)
+        else:
+            self.group.append(image.copy())
+            if len(self.group) == self.keyframe_interval:
+                self.flush_group()
+        self.frames_written += 1
+        self.bytes_written += image.nbytes
+
+    def flush_group(self):
+        """Background mode: store the buffered group against its mean"""
+        if not self.group:
+            return
+        frames = np.stack(self.group)
+        background = np.round(frames.mean(axis=0, dtype=np.float32)).astype(np.uint16)
+        self.append(self.backgrounds, background)
+        for frame in frames:
+            self.append(self.dataset, residual(frame, background))
+        self.group = []
+
+    @staticmethod
+    def append(dataset, frame):
+        n = dataset.shape[0]
+        dataset.resize(n + 1, axis=0)
+        dataset[n] = frame
+
+    def set_compression(self, compression):
+        pass    # Already compressed, the storage policy can only decimate this
+
+    def close(self):
+        if self.h5 is not None:
+            if self.mode == "background":
+                self.flush_group()
+            self.h5.close()
+            self.h5 = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DeltaReader:
+    """
+    Random access to a delta coded recording: stack[i], stack[a:b] or
+    stack[[i, j, ...]] give uint16 frames. Reading forwards through a
+    "previous" mode file carries on from the last frame rather than going
+    back to the keyframe each time.
+    """
+    def __init__(self, filepath):
+        self.h5 = h5py.File(filepath, 'r')
+        self.dataset = self.h5[DATASET]
+        if self.dataset.attrs.get("encoding") != ENCODING:
+            raise ValueError(f"{filepath} is not a delta coded recording")
+        self.mode = str(self.dataset.attrs["mode"])
+        self.keyframe_interval = int(self.dataset.attrs["keyframe_interval"])
+        self.backgrounds = self.h5[BACKGROUNDS] if self.mode == "background" else None
+        self._last = (None, None)   # (index, frame) of the last "previous" mode frame decoded
+
+    @property
+    def shape(self):
+        return self.dataset.shape
+
+    @property
+    def dtype(self):
+        return np.dtype(np.uint16)
+
+    def __len__(self):
+        return self.dataset.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError(f"Frame {index} out of range (0 to {len(self) - 1})")
+            return self.read_range(index, index + 1)[0]
+        if isinstance(index, slice):
+            frames = range(*index.indices(len(self)))
+            if len(frames) == 0:
+                return np.zeros((0, *self.shape[1:]), np.uint16)
+            # Decode the span once (forwards, as the deltas run) and pick the frames out of it
+            first = min(frames[0], frames[-1])
+            return self.read_range(first, max(frames[0], frames[-1]) + 1)[np.asarray(frames) - first]
+        return np.stack([self[int(i)] for i in index])
+
+    def read_range(self, start, stop):
+        """Frames start to stop-1, decoded a group at a time"""
+        out = np.empty((stop - start, *self.shape[1:]), dtype=np.uint16)
+        k = self.keyframe_interval
+        i = start
+        while i < stop:
+            group_stop = min(stop, (i // k + 1) * k)
+            if self.mode == "background":
+                out[i - start:group_stop - start] = self.decode_background(i, group_stop)
+            else:
+                out[i - start:group_stop - start] = self.decode_previous(i, group_stop)
+            i = group_stop
+        return out
+
+    def decode_background(self, start, stop):
+        background = self.backgrounds[start // self.keyframe_interval]
+        frames = zigzag_decode(self.dataset[start:stop])
+        frames += background
+        return frames
+
+    def decode_previous(self, start, stop):
+        """Frames start to stop-1, all in the same keyframe group"""
+        keyframe = start - start % self.keyframe_interval
+        last_index, last_frame = self._last
+        if last_index is not None and keyframe <= last_index < start:
+            # Carry on from the last frame decoded
+            block = zigzag_decode(self.dataset[last_index + 1:stop])
+            block[0] += last_frame
+            first = last_index + 1
+        else:
+            block = self.dataset[keyframe:stop]
+            zigzag_decode(block[1:])
+            first = keyframe
+        np.cumsum(block, axis=0, dtype=np.uint16, out=block)
+        self._last = (stop - 1, block[-1].copy())
+        return block[start - first:]
+
+    def close(self):
+        self.h5.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_delta_file(filepath):
+    try:
+        with h5py.File(filepath, 'r') as h5:
+            return DATASET in h5
+    except OSError:
+        return False
+
+
+def convert(input_fp, output_fp, mode="previous", keyframe_interval=32, codec=None, level=None):
+    """Delta code an existing TIFF recording. Returns a stats dict."""
+    t0 = time.perf_counter()
+    with tifffile.TiffFile(input_fp) as tif, DeltaWriter(output_fp, mode, keyframe_interval, codec, level) as writer:
+        for page in tif.pages:
+            writer.write(page.asarray())
+        raw_bytes = writer.bytes_written
+    return {"frames": writer.frames_written, "raw_bytes": raw_bytes, "stored_bytes": os.path.getsize(output_fp),
+            "ratio": raw_bytes / os.path.getsize(output_fp), "seconds": time.perf_counter() - t0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Losslessly delta code a TIFF recording into HDF5.")
+    parser.add_argument("input", help="_IMAGES.tiff recording")
+    parser.add_argument("--output", help="Output file (default: <input>_DELTA.h5)")
+    parser.add_argument("--mode", choices=MODES, default="previous")
+    parser.add_argument("--keyframe-interval", type=int, default=32)
+    parser.add_argument("--codec", default=None, help="HDF5 codec for the residuals (default zstd, or gzip)")
+    parser.add_argument("--level", type=int, default=None)
+    parser.add_argument("--verify", action="store_true", help="Decode everything and check it matches")
+    args = parser.parse_args(argv)
+
+    output_fp = args.output or os.path.splitext(args.input)[0] + "_DELTA.h5"
+    stats = convert(args.input, output_fp, args.mode, args.keyframe_interval, args.codec, args.level)
+    print(f"{stats['frames']} frames, {stats['raw_bytes'] / 1e6:.1f} MB -> {stats['stored_bytes'] / 1e6:.1f} MB "
+          f"(ratio {stats['ratio']:.2f}) in {stats['seconds']:.1f} s")
+
+    if args.verify:
+        with tifffile.TiffFile(args.input) as tif, DeltaReader(output_fp) as stack:
+            for i, page in enumerate(tif.pages):
+                if not np.array_equal(page.asarray(), stack[i]):
+                    print(f"Frame {i} does not match!")
+                    return 1
+        print("Verified: every frame decodes exactly")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+"""
+Experiment reader
+
+Opens a run by its ESPRAY_<timestamp> prefix and lines up the DAQ samples
+(_DATA.csv) with the camera frames (_IMAGES.tiff, the _COMPRESSED.h5 made
+by tiff_compressor.py, a delta coded _IMAGES_DELTA.h5 from delta_codec.py or
+a 12-bit packed _IMAGES_PACKED.h5 from bitpack.py, unpacked as it's read).
+A multi-ROI recording (_IMAGES_ROIS.h5, see multi_roi.py) has a stack per
+named sub-ROI: roi_names() lists them and frame(), frames() and
+roi_images() take the name; images is the first one.
+
+The first time a run is opened the CSV is converted, a block at a time, to a
+float64 .npy next to it (the timestamps become seconds since the first
+sample), plus a small _INDEX.npz with the column names and the frame <->
+sample index. After that the samples are memory-mapped, so opening even a
+long run is instant and only the parts looked at are read from disk. The
+cache is rebuilt if the CSV changes.
+
+Frame N is the Nth rising edge of the camera FVAL/strobe channel: its
+samples are the CSV rows with "Frame ID" == N, and it is page N-1 of the
+TIFF. Polarity is taken from the sign of the Matsusada control output. If
+the storage policy skipped frames during the run (see storage_monitor.py),
+or it was a triggered recording (triggered_recording.py), only the saved
+frame IDs have images. If frames were averaged/binned before saving
+(frame_reduction.py) the pages are the reduced images instead: see
+reduced_pages() and pages_in_polarity().
+
+The per-frame metrics logged during the run (_FRAME_METRICS.csv, see
+frame_metrics.py) are in frame_metrics(), without touching the images.
+
+Without an FVAL/strobe channel the DAQ never counts frames ("Frame ID" stays
+0), so frame N is just page N-1 of the images: frame(), frames() and
+frame_ids() work, but nothing that lines frames up with the samples does.
+
+Uncompressed recordings are opened as one numpy memmap (frames x rows x
+cols, see frame_writers.memmap_stack), so slicing a huge run only reads the
+frames touched; otherwise frames are decoded page by page.
+
+Example:
+    with Experiment("D:/espray data/ESPRAY_2026-03-10_1546") as run:
+        samples = run.samples_around_frame(120, before_s=0.5, after_s=0.5)
+        for frame_id in run.frames_in_polarity("negative"):
+            image = run.frame(frame_id)
+
+@author: edh1g18
+"""
+
+import csv
+import datetime
+import json
+import os
+import numpy as np
+import tifffile
+
+from frame_writers import memmap_stack
+from storage_monitor import saved_frame_ids
+
+CACHE_VERSION = 1
+ROWS_PER_BLOCK = 100000     # CSV rows converted at a time when building the cache
+
+POLARITY_STATES = {"positive": 1, "high": 1, "negative": -1, "zero": 0, "off": 0}
+
+
+def run_prefix(path):
+    """ESPRAY_..._DATA.csv / _IMAGES.tiff / _METADATA.json (or the prefix itself) -> the run prefix"""
+    for suffix in ("_DATA.csv", "_IMAGES_COMPRESSED.h5", "_IMAGES_DELTA.h5", "_IMAGES_PACKED.h5", "_IMAGES_ROIS.h5", "_IMAGES.tiff", "_METADATA.json", "_DATA.npy", "_INDEX.npz",
+                   "_FRAME_METRICS.csv"):
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def count_rows(csv_fp):
+    """Complete data rows in the CSV (a half-written last line from a live run is left out)"""
+    newlines = 0
+    with open(csv_fp, 'rb') as f:
+        while block := f.read(1 << 24):
+            newlines += block.count(b"\n")
+    return max(0, newlines - 1)
+
+
+def build_cache(csv_fp, npy_fp, index_fp):
+    """Convert the CSV to a float64 .npy and build the frame index (see the module docstring)"""
+    n_rows = count_rows(csv_fp)
+
+    with open(csv_fp, newline='') as f:
+        reader = csv.reader(f)
+        columns = next(reader)
+        samples = np.lib.format.open_memmap(npy_fp, mode='w+', dtype=np.float64, shape=(n_rows, len(columns)))
+
+        start_time = None
+        row_idx = 0
+        block = []
+        for row in reader:
+            if row_idx + len(block) >= n_rows:
+                break
+            block.append(row)
+            if len(block) == ROWS_PER_BLOCK:
+                start_time = write_block(samples, row_idx, block, start_time)
+                row_idx += len(block)
+                block = []
+        if block:
+            start_time = write_block(samples, row_idx, block, start_time)
+        samples.flush()
+
+    frame_col = columns.index("Frame ID")
+    frame_index = build_frame_index(samples[:, frame_col], samples[:, 0], polarity_signal(samples, columns))
+    stat = os.stat(csv_fp)
+    np.savez(index_fp,
+             version=CACHE_VERSION,
+             csv_size=stat.st_size,
+             csv_mtime=stat.st_mtime,
+             columns=np.array(columns),
+             start_time=str(start_time),
+             **frame_index)
+    del samples
+
+
+def write_block(samples, row_idx, block, start_time):
+    """Parse a block of CSV rows into samples[row_idx:]. Returns the run's start time."""
+    timestamps = [datetime.datetime.fromisoformat(row[0]) for row in block]
+    if start_time is None:
+        start_time = timestamps[0]
+    n = len(block)
+    samples[row_idx:row_idx + n, 0] = [(t - start_time).total_seconds() for t in timestamps]
+    samples[row_idx:row_idx + n, 1:] = np.array([row[1:] for row in block], dtype=np.float64)
+    return start_time
+
+
+def polarity_signal(samples, columns):
+    """The output (or read-back) voltage column whose sign gives the polarity, or None"""
+    for name in ("Matsusada control", "Matsusada read in"):
+        for i, column in enumerate(columns):
+            if column.startswith(name):
+                return samples[:, i]
+    return None
+
+
+def build_frame_index(frame_ids, times, polarity=None):
+    """
+    First and last+1 sample of each frame (index 0 is frame 1), the time of
+    its FVAL edge and the polarity sign (+1, -1, 0) at that moment.
+    Frame IDs only ever count up, so this is a searchsorted.
+    """
+    n_frames = int(frame_ids[-1]) if len(frame_ids) else 0
+    ids = np.arange(1, n_frames + 1)
+    first = np.searchsorted(frame_ids, ids, side='left')
+    stop = np.searchsorted(frame_ids, ids, side='right')
+    frame_times = times[np.minimum(first, len(times) - 1)] if n_frames else np.zeros(0)
+
+    if polarity is not None and n_frames:
+        values = polarity[np.minimum(first, len(times) - 1)]
+        # Read-backs are noisy around zero, anything under 1% of full scale counts as zero
+        threshold = 0.01 * max(np.max(np.abs(polarity)), 1e-12)
+        frame_polarity = np.where(values > threshold, 1, np.where(values < -threshold, -1, 0))
+    else:
+        frame_polarity = np.zeros(n_frames, dtype=int)
+
+    return {
+        "frame_first_sample": first,
+        "frame_stop_sample": stop,
+        "frame_time": frame_times,
+        "frame_polarity": frame_polarity.astype(np.int8),
+        }
+
+
+class Experiment:
+    """
+    One run (DAQ samples, camera frames and metadata), opened lazily.
+
+    samples: memory-mapped (n_samples, n_columns) array, column 0 is time in s
+    columns: the CSV column names
+    """
+    def __init__(self, path, use_cache=True):
+        self.prefix = run_prefix(path)
+        self.csv_fp = f"{self.prefix}_DATA.csv"
+        self.npy_fp = f"{self.prefix}_DATA.npy"
+        self.index_fp = f"{self.prefix}_INDEX.npz"
+        self.metadata_fp = f"{self.prefix}_METADATA.json"
+
+        if not (use_cache and self.cache_is_fresh()):
+            build_cache(self.csv_fp, self.npy_fp, self.index_fp)
+
+        with np.load(self.index_fp) as index:
+            self.columns = [str(c) for c in index["columns"]]
+            self.start_time = datetime.datetime.fromisoformat(str(index["start_time"])) \
+                if str(index["start_time"]) != "None" else None
+            self.frame_first_sample = index["frame_first_sample"]
+            self.frame_stop_sample = index["frame_stop_sample"]
+            self.frame_time = index["frame_time"]
+            self.frame_polarity = index["frame_polarity"]
+        self.samples = np.load(self.npy_fp, mmap_mode='r')
+        self._images = None
+        self._image_file = None
+
+        self.metadata = {}
+        if os.path.exists(self.metadata_fp):
+            with open(self.metadata_fp) as f:
+                self.metadata = json.load(f)
+        storage = self.metadata.get("storage", {})
+
+        # No FVAL edges, number the frames by page instead (see the module docstring), or by the
+        # frames the camera worker counted if it skipped some
+        self.frames_from_daq = len(self.frame_time) > 0
+        if not self.frames_from_daq and self.image_path() is not None:
+            n = storage.get("frames_seen") or len(self.images)
+            self.frame_first_sample = self.frame_stop_sample = np.zeros(n, dtype=int)
+            self.frame_time = np.full(n, np.nan)
+            self.frame_polarity = np.zeros(n, dtype=np.int8)
+
+        # Frame ID of each page, if the storage policy decimated the recording or only events were recorded
+        events = storage.get("events", [])
+        self.saved_frames = None
+        if any(event["save_every"] > 1 for event in events):
+            self.saved_frames = np.asarray(saved_frame_ids(len(self.frame_time), events))
+        elif "triggered" in storage:
+            segments = storage["triggered"]["segments"]
+            self.saved_frames = np.concatenate([np.arange(first, last + 1) for first, last in segments]) \
+                if segments else np.zeros(0, dtype=int)
+        if self.saved_frames is not None:
+            self.saved_frames = self.saved_frames[self.saved_frames <= len(self.frame_time)]
+        
+        # What went into each page, if the frames were reduced before saving
+        self.reduction = storage.get("reduction")
+        if self.reduction is not None:
+            self.saved_frames = np.zeros(0, dtype=int)
+
+    def cache_is_fresh(self):
+        if not (os.path.exists(self.npy_fp) and os.path.exists(self.index_fp)):
+            return False
+        stat = os.stat(self.csv_fp)
+        with np.load(self.index_fp) as index:
+            return (int(index["version"]) == CACHE_VERSION and int(index["csv_size"]) == stat.st_size
+                    and float(index["csv_mtime"]) == stat.st_mtime)
+
+    # --- DAQ SAMPLES ---
+    def column_index(self, name):
+        """Column number from its full name or the start of it, e.g. "Current collector (FEMTO)" """
+        if name in self.columns:
+            return self.columns.index(name)
+        matches = [i for i, column in enumerate(self.columns) if column.startswith(name)]
+        if len(matches) != 1:
+            raise KeyError(f"'{name}' matches {len(matches)} columns of {self.columns}")
+        return matches[0]
+
+    def __getitem__(self, name):
+        """One column over the whole run (a memmap view, nothing is read until used)"""
+        return self.samples[:, self.column_index(name)]
+
+    @property
+    def time(self):
+        return self.samples[:, 0]
+
+    def sample_range(self, t0, t1):
+        """First and last+1 sample between t0 and t1 (seconds since the start)"""
+        return int(np.searchsorted(self.time, t0, side='left')), int(np.searchsorted(self.time, t1, side='left'))
+
+    def samples_between(self, t0, t1):
+        """{column name: values} for t0 <= time < t1, views on the memmap"""
+        first, stop = self.sample_range(t0, t1)
+        block = self.samples[first:stop]
+        return {name: block[:, i] for i, name in enumerate(["time"] + self.columns[1:])}
+
+    def samples_of_frame(self, frame_id):
+        """The samples recorded while frame_id was the latest frame"""
+        self.check_frame_timing()
+        i = self.check_frame(frame_id) - 1
+        block = self.samples[self.frame_first_sample[i]:self.frame_stop_sample[i]]
+        return {name: block[:, j] for j, name in enumerate(["time"] + self.columns[1:])}
+
+    def samples_around_frame(self, frame_id, before_s=0.5, after_s=0.5):
+        """Samples from before_s before to after_s after the frame's FVAL edge"""
+        self.check_frame_timing()
+        t = self.frame_time[self.check_frame(frame_id) - 1]
+        return self.samples_between(t - before_s, t + after_s)
+
+    # --- FRAMES ---
+    @property
+    def n_frames(self):
+        """Frames seen by the DAQ that are also in the image file"""
+        n = len(self.frame_time) if self.saved_frames is None else len(self.saved_frames)
+        if self.image_path() is not None:
+            n = min(n, len(self.images))
+        return n
+
+    def check_frame(self, frame_id):
+        if not 1 <= frame_id <= len(self.frame_time):
+            raise IndexError(f"Frame {frame_id} not in this run (frames 1 to {len(self.frame_time)})")
+        return frame_id
+
+    def check_frame_timing(self):
+        if not self.frames_from_daq:
+            raise ValueError(f"{self.prefix} has no FVAL/strobe channel, its frames can't be lined up with the DAQ samples")
+
+    def frame_ids(self):
+        """IDs of the frames with images"""
+        if self.saved_frames is not None:
+            return self.saved_frames[:self.n_frames]
+        return np.arange(1, self.n_frames + 1)
+
+    def page_of_frame(self, frame_id):
+        """Page of the image file holding frame_id"""
+        self.check_frame(frame_id)
+        if self.saved_frames is None:
+            return frame_id - 1
+        if self.reduction is not None:
+            raise KeyError(f"Frame {frame_id} was not saved on its own, the frames were reduced "
+                           f"({self.reduction['mode']} of {self.reduction['n_frames']}, see reduced_pages)")
+        page = int(np.searchsorted(self.saved_frames, frame_id))
+        if page == len(self.saved_frames) or self.saved_frames[page] != frame_id:
+            raise KeyError(f"Frame {frame_id} was not saved (the storage policy was skipping frames)")
+        return page
+
+    def frames_in_window(self, t0, t1):
+        """Frame IDs whose FVAL edge is between t0 and t1 (seconds since the start)"""
+        self.check_frame_timing()
+        ids = self.frame_ids()
+        times = self.frame_time[ids - 1]
+        return ids[(times >= t0) & (times < t1)]
+
+    def frames_in_polarity(self, state):
+        """Frame IDs taken while the output was "positive"/"high", "negative" or "zero"/"off" """
+        self.check_frame_timing()
+        sign = POLARITY_STATES[state.lower()]
+        ids = self.frame_ids()
+        return ids[self.frame_polarity[ids - 1] == sign]
+
+    def reduced_pages(self):
+        """For a reduced recording: per page, the first/last frame IDs in it, how many and the polarity"""
+        if self.reduction is None:
+            raise ValueError(f"{self.prefix} was not a reduced recording")
+        return self.reduction["pages"]
+
+    def pages_in_polarity(self, state):
+        """Pages of a per-polarity reduced recording taken while the output was "positive", "negative" or "zero" """
+        sign = POLARITY_STATES[state.lower()]
+        return [page for page, info in enumerate(self.reduced_pages()) if info["polarity"] == sign]
+
+    def frame_metrics(self):
+        """
+        The per-frame metrics logged during the run as {column name: array}, one
+        entry per frame ID logged ("Frame ID" says which), or None if there weren't any
+        """
+        path = f"{self.prefix}_FRAME_METRICS.csv"
+        if not os.path.exists(path):
+            return None
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            headers = next(reader)
+            rows = list(reader)
+        columns = {name: np.asarray([row[i] for row in rows], dtype=float) for i, name in enumerate(headers) if name != "Timestamp"}
+        columns["Frame ID"] = columns["Frame ID"].astype(int)
+        return columns
+
+    def image_path(self):
+        for suffix in ("_IMAGES_COMPRESSED.h5", "_IMAGES_DELTA.h5", "_IMAGES_PACKED.h5", "_IMAGES_ROIS.h5", "_IMAGES.tiff"):
+            path = f"{self.prefix}{suffix}"
+            if os.path.exists(path):
+                return path
+        return None
+
+    @property
+    def images(self):
+        """
+        The image stack, indexable by page (frame ID - 1): a memmap of an
+        uncompressed TIFF, the HDF5 dataset, a DeltaReader or PackedReader, the
+        first sub-ROI's dataset of a multi-ROI recording, or the TIFF pages otherwise.
+        """
+        if self._images is None:
+            path = self.image_path()
+            if path is None:
+                raise FileNotFoundError(f"No images found for {self.prefix}")
+            if path.endswith("_DELTA.h5"):
+                from delta_codec import DeltaReader
+                self._image_file = self._images = DeltaReader(path)
+            elif path.endswith("_PACKED.h5"):
+                from bitpack import PackedReader
+                self._image_file = self._images = PackedReader(path)
+            elif path.endswith(".h5"):
+                import h5py
+                try:
+                    import hdf5plugin   # noqa: F401 - registers the zstd/blosc filters
+                except ImportError:
+                    pass
+                self._image_file = h5py.File(path, 'r')
+                if path.endswith("_ROIS.h5"):
+                    self._images = self.roi_images(self.roi_names()[0])
+                else:
+                    self._images = self._image_file['espray']
+            else:
+                self._images = memmap_stack(path)
+                if self._images is None:
+                    self._image_file = tifffile.TiffFile(path)
+                    self._images = self._image_file.pages
+        return self._images
+
+    def roi_names(self):
+        """Names of the sub-ROIs of a multi-ROI recording, in the order they were set ([] otherwise)"""
+        path = self.image_path()
+        if path is None or not path.endswith("_ROIS.h5"):
+            return []
+        if self._image_file is None:
+            self.images     # Opens the file
+        return [str(name) for name in self._image_file.attrs["names"]]
+
+    def roi_images(self, name):
+        """The image stack of one sub-ROI (an HDF5 dataset, indexed by page like images)"""
+        names = self.roi_names()
+        if name not in names:
+            raise KeyError(f"No sub-ROI '{name}' in {self.prefix} (has {names})")
+        return self._image_file["rois"][name]
+
+    def frame(self, frame_id, roi=None):
+        """One frame as a 2D array (of the sub-ROI called roi, for a multi-ROI recording)"""
+        images = self.images if roi is None else self.roi_images(roi)
+        image = images[self.page_of_frame(frame_id)]
+        return image if isinstance(image, np.ndarray) else image.asarray()
+
+    def frames(self, frame_ids, roi=None):
+        """Several frames stacked as (n, rows, cols)"""
+        if isinstance(self.images, np.ndarray) and roi is None:
+            return self.images[np.asarray([self.page_of_frame(int(i)) for i in frame_ids])]
+        return np.stack([self.frame(int(i), roi) for i in frame_ids])
+
+    def close(self):
+        if self._image_file is not None:
+            self._image_file.close()
+        self._image_file = self._images = None
+        self.samples = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
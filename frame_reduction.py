@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Frame reduction
+
+For runs that only need averaged or binned images, the camera writer can
+reduce the frames before they're saved instead of writing every raw frame:
+
+    "Mean"  - the mean of every n_frames frames (uint16, rounded)
+    "Sum"   - their sum (uint32, so nothing is lost)
+
+with optional spatial binning (binning x binning blocks summed into one
+pixel, averaged for "Mean") of the saved images only; the display still
+gets every frame at full resolution. The camera's own binning setting still
+applies before this.
+
+Each frame is added straight into a preallocated uint32 accumulator, so
+nothing is allocated per frame. With per_polarity the frames taken while
+the output was high and low go into separate accumulators, and each is
+saved when it has n_frames in it, so a run gives interleaved "positive" and
+"negative" averages. DAQWorker.polarity_changed passes on each switch with
+the DAQ's Frame ID at the time, and frames are put in by their own frame ID
+rather than by when they reach the camera thread, so frames still on their
+way at a reversal go with the polarity they were taken in (the same as the
+events of triggered_recording.py).
+
+The disk and encoding cost drop by n_frames x binning^2 (half that for
+"Sum", whose pixels are twice the size). Each saved page is listed in
+summary()["pages"] with the first and last frame IDs that went into it, how
+many, and the polarity; this goes under "storage" -> "reduction" in the
+run's _METADATA.json for experiment_reader.py.
+
+@author: edh1g18
+"""
+
+from collections import deque
+import numpy as np
+
+from frame_writers import UINT16_FORMATS
+
+REDUCTIONS = ("None", "Mean", "Sum")
+BINNING_FACTORS = (1, 2, 4, 8)
+
+
+def saved_fraction(reduction="None", n_frames=1, binning=1):
+    """Bytes saved / raw frame bytes received, for the resource planner"""
+    if reduction not in ("Mean", "Sum"):
+        return 1.0
+    return (2.0 if reduction == "Sum" else 1.0) / (n_frames * binning * binning)
+
+
+def recording_compression(compression, reducer, log=print):
+    """Sums are uint32, which the delta and packed formats can't store, so those recordings fall back to zstd"""
+    if reducer is not None and reducer.dtype != np.uint16 and compression in UINT16_FORMATS:
+        log(f"Camera: summed frames can't be saved as {compression}, recording them with zstd instead")
+        return "zstd"
+    return compression
+
+
+class Accumulator:
+    """Running uint32 sum of frames (binned) for one group"""
+    def __init__(self, shape, binning):
+        self.binning = binning
+        self.sum = np.zeros(shape, dtype=np.uint32)
+        self.scratch = np.empty(shape, dtype=np.uint32) if binning > 1 else None
+        self.count = 0
+        self.first_frame = None
+        self.last_frame = None
+
+    def add(self, image, frame_id):
+        b = self.binning
+        if b > 1:
+            h, w = self.sum.shape
+            blocks = image[:h * b, :w * b].reshape(h, b, w, b)
+            np.sum(blocks, axis=(1, 3), dtype=np.uint32, out=self.scratch)
+            self.sum += self.scratch
+        else:
+            self.sum += image
+        if self.count == 0:
+            self.first_frame = frame_id
+        self.last_frame = frame_id
+        self.count += 1
+
+    def reset(self):
+        self.sum.fill(0)
+        self.count = 0
+        self.first_frame = self.last_frame = None
+
+
+class FrameReducer:
+    """
+    Accumulates frames and hands back the reduced images to save, see the
+    module docstring.
+
+        reducer = FrameReducer(10, "Mean", binning=2, per_polarity=True)
+        for each frame:
+            for image in reducer.add(frame):
+                writer.write(image)
+        for image in reducer.flush():
+            writer.write(image)
+    """
+    def __init__(self, n_frames=10, mode="Mean", binning=1, per_polarity=False):
+        if mode not in ("Mean", "Sum"):
+            raise ValueError(f"Unknown reduction '{mode}', expected 'Mean' or 'Sum'")
+        self.n_frames = max(1, int(n_frames))
+        self.mode = mode
+        self.binning = max(1, int(binning))
+        self.per_polarity = per_polarity
+        self.switches = deque([(0, 1)])  # (Frame ID, state) of the DAQ output switches still to come, from the DAQ thread
+        self.frame_id = 0               # Frames received (the DAQ's Frame ID of the latest)
+        self.accumulators = {}          # Polarity (or None) -> Accumulator
+        self.pages = []                 # What went into each saved image
+
+    @property
+    def dtype(self):
+        return np.dtype(np.uint16 if self.mode == "Mean" else np.uint32)
+
+    def set_polarity(self, state, frame_id=None):
+        """
+        The DAQ output switched to state (1, -1 or 0) after frame frame_id (None
+        for the latest received). Can be called from any thread.
+        """
+        self.switches.append((self.frame_id if frame_id is None else int(frame_id), int(state)))
+
+    def polarity_of(self, frame_id):
+        """The output state frame_id was taken in (switches before it are dropped, frames come in order)"""
+        while len(self.switches) > 1 and self.switches[1][0] < frame_id:
+            self.switches.popleft()
+        return self.switches[0][1]
+
+    def add(self, image):
+        """Call for every frame received. Returns the reduced images to save now (0 or 1)."""
+        self.frame_id += 1
+        key = self.polarity_of(self.frame_id) if self.per_polarity else None
+        accumulator = self.accumulators.get(key)
+        if accumulator is None:
+            shape = (image.shape[0] // self.binning, image.shape[1] // self.binning)
+            accumulator = self.accumulators[key] = Accumulator(shape, self.binning)
+        accumulator.add(image, self.frame_id)
+        if accumulator.count < self.n_frames:
+            return []
+        return [self.emit(key, accumulator)]
+
+    def flush(self):
+        """The part-filled groups at the end of a run (their page says how many frames they hold)"""
+        return [self.emit(key, accumulator) for key, accumulator in self.accumulators.items() if accumulator.count]
+
+    def emit(self, key, accumulator):
+        if self.mode == "Mean":
+            divisor = accumulator.count * self.binning * self.binning
+            image = ((accumulator.sum + divisor // 2) // divisor).astype(np.uint16)
+        else:
+            image = accumulator.sum.copy()
+        self.pages.append({"first_frame": accumulator.first_frame, "last_frame": accumulator.last_frame,
+                           "n_frames": accumulator.count, "polarity": key})
+        accumulator.reset()
+        return image
+
+    def summary(self):
+        return {
+            "mode": self.mode,
+            "n_frames": self.n_frames,
+            "binning": self.binning,
+            "per_polarity": self.per_polarity,
+            "frames_seen": self.frame_id,
+            "pages": self.pages,
+            }
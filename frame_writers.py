@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Frame writers
+
+How CameraWorker and camera_process.py save frames. A writer is opened once
+per run and kept open, rather than reopening the file for every frame:
+
+    writer = open_frame_writer(filepath, compression)
+    writer.write(image)         # for each frame
+    writer.close()
+
+TiffFrameWriter writes a BigTIFF, one page per frame. With no compression
+every frame goes straight after the last one in a single contiguous series,
+so the whole recording can be opened as a numpy memmap (frames x rows x cols)
+without reading it in (see memmap_stack). The page headers of a contiguous
+series are written when the file is closed; if the program dies first the
+frame data is still there in one block after the first page, and
+memmap_stack recovers it. With compression each frame is its own
+compressed page, as before. set_compression() switches the rest of a
+recording to another compression (storage_monitor.py does this when the disk
+can't keep up); frames already written stay as they are.
+
+The other formats record to HDF5 files in place of _IMAGES.tiff (see
+recording_path), with set_compression doing nothing to them:
+    "delta"         - _IMAGES_DELTA.h5, delta_codec.DeltaWriter stores each
+                      frame as its difference from the one before. Suits long
+                      runs of a mostly static scene.
+    "packed12"      - _IMAGES_PACKED.h5, bitpack.PackedWriter stores the
+                      12-bit pixels in 1.5 bytes rather than 2
+    "packed12-zstd" - the same, zstd compressed as well
+These only take uint16 frames (UINT16_FORMATS).
+
+@author: edh1g18
+"""
+
+import os
+import numpy as np
+import lazy_imports
+
+# Compression options for recordings (tifffile names, None for uncompressed)
+TIFF_COMPRESSIONS = {"none": None, "zlib": "zlib", "zstd": "zstd", "lzw": "lzw"}
+# Everything a recording can be saved as (the dialog's choices)
+RECORDING_FORMATS = list(TIFF_COMPRESSIONS) + ["delta", "packed12", "packed12-zstd"]
+UINT16_FORMATS = ("delta", "packed12", "packed12-zstd")
+
+
+class TiffFrameWriter:
+    """Persistent BigTIFF writer, see the module docstring."""
+    def __init__(self, filepath, compression=None):
+        tifffile = lazy_imports.load("tifffile")
+        self.filepath = filepath
+        self.compression = TIFF_COMPRESSIONS.get(compression, compression)
+        self.contiguous = self.compression is None
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.frame_shape = None
+        self.tiff = tifffile.TiffWriter(filepath, bigtiff=True)
+
+    def write(self, image):
+        if self.contiguous and self.frame_shape is not None and image.shape != self.frame_shape:
+            raise ValueError(f"Frame shape changed from {self.frame_shape} to {image.shape} in a contiguous recording")
+        self.frame_shape = image.shape
+
+        if self.contiguous:
+            self.tiff.write(image, contiguous=True)
+        else:
+            self.tiff.write(image, compression=self.compression)
+        self.frames_written += 1
+        self.bytes_written += image.nbytes
+
+    def set_compression(self, compression):
+        """Compress the frames written from now on (the file can no longer be memmapped)"""
+        compression = TIFF_COMPRESSIONS.get(compression, compression)
+        if compression != self.compression:
+            self.compression = compression
+            self.contiguous = False
+
+    def close(self):
+        if self.tiff is not None:
+            self.tiff.close()
+            self.tiff = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def recording_path(filepath, compression=None):
+    """Where a recording meant for filepath (..._IMAGES.tiff) actually goes"""
+    if compression == "delta":
+        return os.path.splitext(filepath)[0] + "_DELTA.h5"
+    if compression in ("packed12", "packed12-zstd"):
+        return os.path.splitext(filepath)[0] + "_PACKED.h5"
+    return filepath
+
+
+def hdf5_writer(target, compression):
+    """The writer of one of the HDF5 formats, to a path or file-like object"""
+    if compression == "delta":
+        from delta_codec import DeltaWriter
+        return DeltaWriter(target)
+    from bitpack import PackedWriter
+    if compression == "packed12":
+        return PackedWriter(target)
+    if compression == "packed12-zstd":
+        return PackedWriter(target, "zstd", 3)
+    raise ValueError(f"'{compression}' is not an HDF5 recording format")
+
+
+def open_frame_writer(filepath, compression=None):
+    """The writer for a recording. compression is one of RECORDING_FORMATS."""
+    if compression in UINT16_FORMATS:
+        return hdf5_writer(recording_path(filepath, compression), compression)
+    return TiffFrameWriter(filepath, compression)
+
+
+def memmap_stack(filepath):
+    """
+    A contiguous uncompressed recording as a read-only (frames, rows, cols)
+    numpy memmap, or None if the file isn't laid out that way (compressed,
+    or frames of different sizes). Works on a file that was never closed too.
+    """
+    tifffile = lazy_imports.load("tifffile")
+    with tifffile.TiffFile(filepath) as tif:
+        page = tif.pages[0]
+        if page.compression != 1 or not page.is_contiguous:
+            return None
+        series = tif.series[0]
+        shape = series.shape if len(series.shape) == 3 else (1, *page.shape)
+        offset = series.dataoffset
+        dtype = page.dtype
+        n_pages = len(tif.pages)
+
+    if offset is None:
+        return None
+    frame_bytes = int(np.prod(shape[1:])) * dtype.itemsize
+
+    if n_pages > 1 and shape[0] != n_pages:
+        return None     # Compressed pages after the contiguous ones (see set_compression)
+    if n_pages == 1:
+        # Page headers after the first are only written on close, so after a
+        # crash count the frames from the file size instead
+        n_frames = (os.path.getsize(filepath) - offset) // frame_bytes
+        shape = (n_frames, *shape[1:])
+    return np.memmap(filepath, dtype=dtype, mode='r', offset=offset, shape=tuple(shape))
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Headless acquisition
+
+Runs the same CameraWorker/DAQWorker/KeysightWorker as the GUI, but from the
+command line with no window or plotting, for overnight or scripted runs. The
+hardware set-up comes from the QSettings config file the GUI saves
+(config.ini), status is printed to stdout and a small TCP control socket
+accepts one-line commands:
+
+    status              - samples/frames so far and the latest readings
+    voltage <V>         - set the emitter voltage
+    polarity <idx>      - 0 bipolar switching, 1 unipolar switching, 2 unipolar constant
+    tare                - tare the voltage reading
+    event               - save the frames around now (triggered recording mode)
+    stop                - stop the run and exit
+
+No window is created, just a QCoreApplication event loop for the worker
+threads. The workers come from acquisition_workers.py, which only needs
+QtCore, so QtWidgets and pyqtgraph are never imported.
+
+Example:
+    python headless_acquisition.py --camera --duration 3600 --control-port 5555
+
+@author: edh1g18
+"""
+
+import argparse
+import json
+import signal
+import socketserver
+import sys
+import threading
+import time
+
+from PyQt6.QtCore import QCoreApplication, QSettings, QTimer, Qt
+
+from acquisition_workers import (CameraWorker, DAQWorker, KeysightWorker,
+                                 read_hw_config, read_cam_config, parse_channel_list, reduction_fraction,
+                                 camera_roi)
+from multi_roi import parse_rois
+from telemetry import TelemetryBus
+from metrics import metrics, start_http_server, save_to_metadata
+import resource_planner
+import storage_monitor
+from frame_metrics import METRICS
+
+POLARITY_MODES = ["Bipolar switching", "Unipolar switching", "Unipolar constant"]
+
+
+class HeadlessRunner:
+    """
+    Configures and runs the workers without the GUI. Worker updates come in
+    through a TelemetryBus which is drained on a timer and printed.
+    """
+    def __init__(self, args):
+        self.args = args
+        self.settings = QSettings(args.config, QSettings.Format.IniFormat)
+        self.hw_config = read_hw_config(self.settings)
+        self.cam_config = read_cam_config(self.settings)
+        self.filepath = args.output or self.settings.value("filepath", ".")
+
+        self.telemetry = TelemetryBus()
+        self.cam_worker = CameraWorker()
+        self.daq_worker = DAQWorker()
+        self.ks_worker = KeysightWorker()
+        for worker in (self.cam_worker, self.daq_worker, self.ks_worker):
+            worker.bus = self.telemetry
+        self.cam_worker.camera_metadata.connect(self.write_metadata)
+        self.ks_worker.ks_reading.connect(self.daq_worker.update_ks_value)
+        self.daq_worker.recording_event.connect(self.cam_worker.trigger_recording, Qt.ConnectionType.DirectConnection)
+        self.daq_worker.polarity_changed.connect(self.cam_worker.set_polarity, Qt.ConnectionType.DirectConnection)
+
+        # Once at startup, it's a few seconds of benchmark if there's no current calibration
+        self.calibration = resource_planner.load_calibration(log=self.log)
+
+        self.stop_requested = False
+        self.frames_seen = 0
+        self.latest_envelope = None
+        self.latest_frame_metrics = None
+        self.control_server = None
+
+    def log(self, text):
+        print(f"{time.strftime('%H:%M:%S')} {text}", flush=True)
+
+    def start(self):
+        self.filenametime = time.strftime("ESPRAY_%Y-%m-%d_%H%M")
+        self.start_time = time.time()
+        metrics.reset()
+        use_cam = self.args.camera
+        if not self.check_plan(use_cam):
+            return False
+
+        # Camera worker
+        if use_cam:
+            self.cam_worker.filepath = f"{self.filepath}/{self.filenametime}_IMAGES.tiff"
+            self.cam_worker.ROI = camera_roi(self.cam_config)
+            self.cam_worker.sub_rois = parse_rois(self.cam_config["sub_rois"])
+            self.cam_worker.trigger_mode = self.cam_config["trigger_mode"]
+            self.cam_worker.use_process = self.cam_config["separate_process"]
+            self.cam_worker.compression = self.cam_config["compression"]
+            self.cam_worker.storage_policy = self.cam_config["storage_policy"]
+            self.cam_worker.record_mode = self.cam_config["record_mode"]
+            self.cam_worker.pre_trigger_frames = self.cam_config["pre_trigger_frames"]
+            self.cam_worker.post_trigger_frames = self.cam_config["post_trigger_frames"]
+            self.cam_worker.reduction = self.cam_config["reduction"]
+            self.cam_worker.reduce_frames = self.cam_config["reduce_frames"]
+            self.cam_worker.reduce_binning = self.cam_config["reduce_binning"]
+            self.cam_worker.reduce_by_polarity = self.cam_config["reduce_by_polarity"]
+            self.cam_worker.frame_metrics = self.cam_config["frame_metrics"]
+            self.cam_worker.metrics_stride = self.cam_config["metrics_stride"]
+        else:
+            self.write_metadata()
+
+        # DAQ worker
+        self.daq_worker.use_camera = use_cam
+        self.daq_worker.filepath = f"{self.filepath}/{self.filenametime}_DATA.csv"
+        self.daq_worker.ai_channel_name = self.hw_config["ai_device"]
+        self.daq_worker.ao_channel_name = self.hw_config["ao_device"]
+        self.daq_worker.ai_channels_to_use = parse_channel_list(self.hw_config.get("ai_channels", ""))
+        self.daq_worker.ao_channels_to_use = parse_channel_list(self.hw_config.get("ao_channels", ""))
+        self.daq_worker.ao_map = self.hw_config.get("ao_map", {})
+        self.daq_worker.ai_map = self.hw_config.get("ai_map", {})
+        self.daq_worker.cam_fps = self.cam_config["fps"]
+        self.daq_worker.cam_timing_mode = self.cam_config["timing_mode"]
+
+        self.daq_worker.set_voltage(float(self.settings.value("voltage", 0.0)))
+        self.daq_worker.set_hightime(float(self.settings.value("high_time", 1.0)))
+        self.daq_worker.set_polarity_mode(POLARITY_MODES[int(self.settings.value("polarity_idx", 0))])
+        self.daq_worker.set_fps(self.cam_config["fps"])
+        self.daq_worker.sample_rate = self.args.sample_rate_ms / 1000
+        self.daq_worker.gain = self.args.gain
+        self.daq_worker.last_cam_trigger_time = time.time()
+
+        triggered = use_cam and self.cam_config["record_mode"] == "Triggered"
+        self.daq_worker.trigger_current_a = self.cam_config["trigger_current_na"] * 1e-9 if triggered else 0.0
+        self.daq_worker.trigger_on_polarity = triggered and self.cam_config["trigger_on_polarity"]
+
+        self.log(f"Mode: {'Camera + DAQ' if use_cam else 'DAQ Only (Camera OFF)'}, saving to {self.filepath}/{self.filenametime}_*")
+
+        # Start threads
+        if use_cam:
+            self.cam_worker.start()
+        self.daq_worker.start()
+        if not self.args.no_keysight:
+            self.ks_worker.start()
+
+        if self.args.control_port:
+            self.start_control_server(self.args.control_port)
+        if self.args.metrics_port:
+            self.metrics_server = start_http_server(self.args.metrics_port)
+            self.log(f"Metrics at http://127.0.0.1:{self.args.metrics_port}/metrics")
+
+    def check_plan(self, use_cam):
+        """
+        Expected rates and loads of the run (see resource_planner.py). Nobody to
+        ask here, so warnings are only logged and runs that will overrun need --force.
+        """
+        if self.args.sample_rate_ms <= 0:
+            self.log("Cannot start: --sample-rate-ms must be more than 0")
+            return False
+        try:
+            roi = camera_roi(self.cam_config)
+        except ValueError as e:
+            self.log(f"Cannot start: {e}")
+            return False
+        plan = resource_planner.plan(roi, self.cam_config["fps"], 1000 / self.args.sample_rate_ms,
+                                     len(parse_channel_list(self.hw_config.get("ai_channels", ""))),
+                                     len(parse_channel_list(self.hw_config.get("ao_channels", ""))),
+                                     self.cam_config["compression"], use_camera=use_cam,
+                                     separate_process=self.cam_config["separate_process"], directory=self.filepath,
+                                     saved_fraction=reduction_fraction(self.cam_config),
+                                     calibration=self.calibration)
+        self.log(resource_planner.describe(plan))
+        for warning in plan["warnings"]:
+            self.log(f"Warning: {warning}")
+        for problem in plan["problems"]:
+            self.log(f"{'Warning' if self.args.force else 'Cannot start'}: {problem}")
+        return self.args.force or not plan["problems"]
+
+    def stop(self):
+        self.log("Stopping...")
+        self.cam_worker.stop()
+        self.daq_worker.stop()
+        self.ks_worker.stop()
+        if self.control_server is not None:
+            self.control_server.shutdown()
+        self.tick()     # Print the final log lines from the workers
+        save_to_metadata(f"{self.filepath}/{self.filenametime}_METADATA.json")
+        if self.cam_worker.storage_summary is not None:
+            storage_monitor.save_to_metadata(f"{self.filepath}/{self.filenametime}_METADATA.json", self.cam_worker.storage_summary)
+        self.log(f"Timing metrics: {json.dumps(metrics.snapshot()['latency'])}")
+
+    def tick(self):
+        snapshot = self.telemetry.drain()
+        for line in snapshot["log"]:
+            self.log(line)
+        if snapshot["frame"] is not None:
+            self.frames_seen += 1 + snapshot["frames_skipped"]
+        if snapshot["envelope"] is not None:
+            self.latest_envelope = snapshot["envelope"]
+        if snapshot["frame_metrics"]:
+            self.latest_frame_metrics = snapshot["frame_metrics"][-1]
+
+    def status(self):
+        status = {
+            "running_s": round(time.time() - self.start_time, 1),
+            "samples": getattr(self.daq_worker, "total_samples_read", 0),
+            "frame_id": self.daq_worker.current_frame_id,
+            "frames_received": self.frames_seen,
+            "voltage_setpoint": self.daq_worker.target_voltage,
+            "polarity_mode": self.daq_worker.polarity_mode,
+            }
+        if self.latest_envelope is not None:
+            status["volts_mean"] = self.latest_envelope["volts_mean"]
+            status["current_mean"] = self.latest_envelope["current_mean"]
+        if self.latest_frame_metrics is not None:
+            frame_id, _, *values = self.latest_frame_metrics
+            status["frame_metrics"] = {"frame_id": frame_id, **dict(zip(METRICS, values))}
+        return status
+
+    def write_metadata(self, cam_meta=None):
+        metadata = {
+            "timestamp": self.filenametime,
+            "sample_rate_ms": self.args.sample_rate_ms,
+            "ai_channel_map": self.hw_config["ai_map"],
+            "ao_channel_map": self.hw_config["ao_map"],
+        }
+        if cam_meta is not None:
+            metadata["camera"] = cam_meta
+
+        filepath = f"{self.filepath}/{self.filenametime}_METADATA.json"
+        with open(filepath, 'w') as f:
+            json.dump(metadata, f, indent=4)
+        self.log(f"Metadata saved to {filepath}")
+
+    # --- CONTROL SOCKET ---
+    def handle_command(self, line):
+        parts = line.split()
+        if not parts:
+            return "error: empty command"
+        command, values = parts[0].lower(), parts[1:]
+
+        try:
+            if command == "status":
+                return json.dumps(self.status())
+            elif command == "voltage":
+                self.daq_worker.set_voltage(float(values[0]))
+            elif command == "polarity":
+                self.daq_worker.set_polarity_mode(POLARITY_MODES[int(values[0])])
+            elif command == "tare":
+                self.daq_worker.request_tare = True
+            elif command == "event":
+                self.cam_worker.trigger_recording("manual")
+            elif command == "stop":
+                self.stop_requested = True
+            else:
+                return f"error: unknown command '{command}'"
+        except (IndexError, ValueError) as e:
+            return f"error: {e}"
+
+        self.log(f"Control: {line}")
+        return "ok"
+
+    def start_control_server(self, port):
+        runner = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for raw in self.rfile:
+                    reply = runner.handle_command(raw.decode(errors="replace").strip())
+                    self.wfile.write((reply + "\n").encode())
+
+        # Localhost only, there is no authentication
+        self.control_server = socketserver.ThreadingTCPServer(("127.0.0.1", port), Handler)
+        self.control_server.daemon_threads = True
+        threading.Thread(target=self.control_server.serve_forever, daemon=True).start()
+        self.log(f"Control socket listening on 127.0.0.1:{port}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an electrospray acquisition without the GUI.")
+    parser.add_argument("--config", default="config.ini", help="QSettings ini file saved by the GUI")
+    parser.add_argument("--output", help="Save directory (defaults to the filepath in the config)")
+    parser.add_argument("--camera", action="store_true", help="Record camera frames as well as the DAQ")
+    parser.add_argument("--duration", type=float, default=0, help="Stop after this many seconds (0 = until stopped)")
+    parser.add_argument("--sample-rate-ms", type=float, default=40, help="DAQ sample period in ms")
+    parser.add_argument("--gain", type=float, default=1E+6, help="FEMTO gain (V/A)")
+    parser.add_argument("--no-keysight", action="store_true", help="Don't poll the Keysight multimeter")
+    parser.add_argument("--control-port", type=int, default=0, help="TCP port for the control socket (0 = off)")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve timing metrics (Prometheus text) on this port (0 = off)")
+    parser.add_argument("--status-interval", type=float, default=10, help="Seconds between status lines")
+    parser.add_argument("--force", action="store_true", help="Start even if the resource planner says the run will overrun")
+    args = parser.parse_args(argv)
+
+    app = QCoreApplication(sys.argv[:1])
+    runner = HeadlessRunner(args)
+
+    # Ctrl+C stops cleanly (the timer below gives Python a chance to run the handler)
+    signal.signal(signal.SIGINT, lambda *_: setattr(runner, "stop_requested", True))
+
+    last_status = [time.time()]
+
+    def on_tick():
+        runner.tick()
+        now = time.time()
+        if args.status_interval and now - last_status[0] >= args.status_interval:
+            runner.log(f"Status: {json.dumps(runner.status())}")
+            last_status[0] = now
+        if args.duration and now - runner.start_time >= args.duration:
+            runner.stop_requested = True
+        if runner.stop_requested:
+            timer.stop()
+            runner.stop()
+            app.quit()
+
+    timer = QTimer()
+    timer.timeout.connect(on_tick)
+    timer.start(200)
+
+    if runner.start() is False:
+        return 1
+    return app.exec()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Fast camera display
+
+Draws camera frames into one persistent pyqtgraph ImageItem instead of calling
+ImageView.setImage for every frame. Display levels are estimated from a
+subsampled percentile a few times a second, and the 12-bit camera values are
+mapped to 8-bit through a lookup table into a preallocated buffer, so the
+preview keeps up even at full sensor size.
+
+@author: edh1g18
+"""
+
+import time
+import numpy as np
+import pyqtgraph as pg
+
+
+class FastImageDisplay:
+    """
+    Persistent ImageItem added to a pyqtgraph ViewBox/PlotItem.
+
+    Call set_frame() with each new (rows, cols) camera frame.
+    """
+    def __init__(self, view, bit_depth=12, level_interval_s=1.0, subsample=8, percentiles=(0.5, 99.5)):
+        self.view = view
+        self.bit_depth = bit_depth
+        self.level_interval_s = level_interval_s    # How often to re-estimate the display levels
+        self.subsample = subsample                  # Stride used for the percentile estimate
+        self.percentiles = percentiles
+
+        # Row-major so frames can be shown as they come off the camera (no transpose copy)
+        self.image_item = pg.ImageItem(axisOrder='row-major')
+        self.view.addItem(self.image_item)
+
+        self.lut = None
+        self.levels = None
+        self.last_level_time = 0.0
+        self.buffer = None
+
+    def reset(self):
+        """Forget the levels and image size, e.g. when the ROI changes."""
+        self.levels = None
+        self.last_level_time = 0.0
+        self.buffer = None
+
+    def set_levels(self, low, high):
+        """Rebuild the camera value -> 8-bit lookup table for a new black/white level."""
+        high = max(high, low + 1)
+        values = np.arange(2 ** self.bit_depth, dtype=np.float32)
+        self.lut = np.clip((values - low) * (255.0 / (high - low)), 0, 255).astype(np.uint8)
+        self.levels = (low, high)
+
+    def update_levels(self, image):
+        """Estimate levels from a strided subsample of the frame."""
+        sample = image[::self.subsample, ::self.subsample]
+        low, high = np.percentile(sample, self.percentiles)
+        self.set_levels(float(low), float(high))
+        self.last_level_time = time.monotonic()
+
+    def set_frame(self, image, rect=None):
+        """
+        Show a frame. `rect` (a QRectF) places it in other coordinates, e.g. a
+        binned preview drawn over the full sensor's pixel coordinates.
+        """
+        first_frame = self.buffer is None or self.buffer.shape != image.shape
+
+        if first_frame or (time.monotonic() - self.last_level_time) >= self.level_interval_s:
+            self.update_levels(image)
+
+        # Map through the LUT straight into the buffer the ImageItem already holds
+        if first_frame:
+            self.buffer = np.empty(image.shape, dtype=np.uint8)
+        np.take(self.lut, image, out=self.buffer, mode='clip')
+
+        if first_frame:
+            self.image_item.setImage(self.buffer, autoLevels=False, levels=(0, 255))
+            if rect is not None:
+                self.image_item.setRect(rect)
+            self.view.autoRange()
+        else:
+            self.image_item.updateImage(self.buffer)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy imports
+
+The hardware and codec libraries (nidaqmx, the Thorlabs SDK, tifffile,
+pyvisa, pyserial...) take a long time to import, so they are only loaded
+the first time a worker needs them. Every import made through here is timed,
+and report() gives an import-time profile of the session (run the GUI with
+--profile-imports to have it printed once the window is up).
+
+Modules can be swapped out by putting them in `overrides` (name -> module),
+which is how simulated_hardware.py stands in for the real devices. Setting
+the ESPRAY_SIMULATED_HARDWARE environment variable installs the simulation
+on import, in this process and any it spawns.
+
+@author: edh1g18
+"""
+
+import importlib
+import os
+import time
+from contextlib import contextmanager
+
+# Where the ThorCam installer puts the Thorlabs native DLLs
+THORLABS_DLL_DIR = r"C:\Program Files\Thorlabs\Scientific Imaging\ThorCam"
+
+PROCESS_START = time.perf_counter()
+import_times = {}   # {name: seconds} in the order they were loaded
+overrides = {}      # {name: module} handed out by load() instead of importing
+
+
+@contextmanager
+def timed(name):
+    """Time a block of (eager) imports so it shows up in the report."""
+    t0 = time.perf_counter()
+    yield
+    import_times[name] = import_times.get(name, 0.0) + time.perf_counter() - t0
+
+
+def load(name):
+    """Import a module by name on first use (later calls are a dictionary lookup)."""
+    if name in overrides:
+        return overrides[name]
+    if name in import_times:
+        return importlib.import_module(name)
+    with timed(name):
+        return importlib.import_module(name)
+
+
+def thorlabs_sdk():
+    """Load the Thorlabs camera SDK, adding the DLL folder to the path the first time."""
+    if "thorlabs_tsi_sdk.tl_camera" not in import_times and "thorlabs_tsi_sdk.tl_camera" not in overrides:
+        try:
+            import windows_setup   # This is Thorlabs windows set-up code
+            windows_setup.configure_path(THORLABS_DLL_DIR)
+        except ImportError:
+            pass
+    return load("thorlabs_tsi_sdk.tl_camera"), load("thorlabs_tsi_sdk.tl_camera_enums")
+
+
+def report():
+    """Import-time profile, slowest first."""
+    lines = [f"Import profile ({time.perf_counter() - PROCESS_START:.2f} s since start):"]
+    for name, seconds in sorted(import_times.items(), key=lambda item: -item[1]):
+        lines.append(f"  {seconds * 1000:8.1f} ms  {name}")
+    return "\n".join(lines)
+
+
+if os.environ.get("ESPRAY_SIMULATED_HARDWARE"):
+    import simulated_hardware
+    simulated_hardware.install_from_environment()
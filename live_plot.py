@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Live plot buffers
+
+Preallocated NumPy ring buffers backing the live voltage/current plot. The DAQ
+worker pushes whole chunks of samples, the GUI appends them here and a timer
+redraws the curves at a fixed frame rate, so the plotting cost no longer
+depends on how fast the DAQ is running.
+
+@author: edh1g18
+"""
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed size circular buffer for one or more parallel channels
+    (e.g. time, voltage, current).
+
+    Every sample is written twice, at idx and idx + capacity, so the most
+    recent samples are always available as one contiguous slice (no copying
+    or np.roll needed to read the buffer back in time order).
+    """
+    def __init__(self, capacity, n_channels=1, dtype=np.float64):
+        self.capacity = int(capacity)
+        self.n_channels = n_channels
+        self._data = np.zeros((n_channels, 2 * self.capacity), dtype=dtype)
+        self._head = 0     # Next index to write to
+        self.size = 0      # Number of valid samples held
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        self._head = 0
+        self.size = 0
+
+    def extend(self, *columns):
+        """Append a chunk of samples, one 1D array per channel."""
+        chunk = np.asarray(columns, dtype=self._data.dtype).reshape(self.n_channels, -1)
+        n = chunk.shape[1]
+        if n == 0:
+            return
+
+        # Only the newest `capacity` samples can ever be shown
+        if n > self.capacity:
+            chunk = chunk[:, -self.capacity:]
+            n = self.capacity
+
+        idx = (self._head + np.arange(n)) % self.capacity
+        self._data[:, idx] = chunk
+        self._data[:, idx + self.capacity] = chunk
+
+        self._head = (self._head + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def append(self, *values):
+        """Append a single sample (one value per channel)."""
+        self.extend(*[[v] for v in values])
+
+    def view(self):
+        """Contiguous (n_channels, size) view of the held samples, oldest first."""
+        stop = self._head + self.capacity
+        return self._data[:, stop - self.size:stop]
+
+    def last(self):
+        """Most recent sample as a tuple (one value per channel), or None if empty."""
+        if self.size == 0:
+            return None
+        return tuple(self._data[:, self._head + self.capacity - 1])
+
+
+def rolling_mean(tail, chunk, window):
+    """
+    Moving average of `chunk` over the last `window` samples, carrying the end
+    of the previous chunk in `tail` so the smoothing is continuous across chunks.
+
+    Returns (smoothed chunk, new tail).
+    """
+    chunk = np.asarray(chunk, dtype=np.float64)
+    joined = np.concatenate((tail, chunk))
+    csum = np.concatenate(([0.0], np.cumsum(joined)))
+
+    # Window end (exclusive) and start for every sample in the new chunk
+    stop = np.arange(len(tail) + 1, len(joined) + 1)
+    start = np.maximum(0, stop - window)
+    smoothed = (csum[stop] - csum[start]) / (stop - start)
+
+    return smoothed, joined[-(window - 1):] if window > 1 else joined[:0]
+
+
+def min_max_envelope(values):
+    """
+    Min, max and mean of one channel over a chunk.
+
+    Also returns the sample indices of the min and max in the order they
+    occurred, so plotting them at those samples' times keeps a spike where
+    (and in the direction) it happened.
+    """
+    i_min = int(np.argmin(values))
+    i_max = int(np.argmax(values))
+    order = np.array([min(i_min, i_max), max(i_min, i_max)])
+    return order, float(values[i_min]), float(values[i_max]), float(np.mean(values))
+
+
+class GrowableArray:
+    """
+    Append-only (n_channels, n) array that doubles its storage when full, so
+    appending a chunk is amortised O(chunk length).
+    """
+    def __init__(self, n_channels=1, capacity=1024, dtype=np.float64):
+        self._data = np.zeros((n_channels, capacity), dtype=dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        self.size = 0
+
+    def extend(self, chunk):
+        """Append a (n_channels, n) chunk."""
+        n = chunk.shape[1]
+        if self.size + n > self._data.shape[1]:
+            new_capacity = max(2 * self._data.shape[1], self.size + n)
+            grown = np.zeros((self._data.shape[0], new_capacity), dtype=self._data.dtype)
+            grown[:, :self.size] = self._data[:, :self.size]
+            self._data = grown
+        self._data[:, self.size:self.size + n] = chunk
+        self.size += n
+
+    def view(self):
+        return self._data[:, :self.size]
+
+
+class LODHistory:
+    """
+    Whole-run history of the live plot, stored as a min/max pyramid so any
+    time window can be drawn with roughly one point per screen pixel.
+
+    Level 0 holds every (time, voltage, current) point pushed to the plot.
+    Each level above it groups `factor` entries of the level below into one
+    bin holding (start time, V min, V max, I min, I max). Drawing a bin as its
+    min followed by its max keeps spikes visible however far zoomed out.
+
+    Trigger markers are kept in one array. Since they're roughly evenly
+    spaced in time, thinning them with a stride is enough to limit how many
+    are drawn.
+    """
+    def __init__(self, factor=4):
+        self.factor = factor
+        self.raw = GrowableArray(n_channels=3)      # Time, Voltage, Current
+        self.levels = []                            # [GrowableArray(5 channels), ...]
+        self.triggers = GrowableArray(n_channels=2) # Time, Voltage
+
+    def clear(self):
+        self.raw.clear()
+        self.levels = []
+        self.triggers.clear()
+
+    def extend(self, times, volts, amps):
+        """Append a chunk of plotted points and update the pyramid above it."""
+        self.raw.extend(np.asarray((times, volts, amps), dtype=np.float64))
+
+        # Bin level 0 into level 1
+        self._fold(self.raw.view(), 0, lambda b: (b[0, :, 0],
+                                                  b[1].min(axis=1), b[1].max(axis=1),
+                                                  b[2].min(axis=1), b[2].max(axis=1)))
+        # Then every level into the one above it (adding levels as the run grows)
+        k = 0
+        while k < len(self.levels) and len(self.levels[k]) >= 2 * self.factor:
+            self._fold(self.levels[k].view(), k + 1, lambda b: (b[0, :, 0],
+                                                                b[1].min(axis=1), b[2].max(axis=1),
+                                                                b[3].min(axis=1), b[4].max(axis=1)))
+            k += 1
+
+    def _fold(self, source, level, reduce):
+        # Create the level if needed, then bin any newly completed groups of `factor` entries
+        if level == len(self.levels):
+            self.levels.append(GrowableArray(n_channels=5))
+        target = self.levels[level]
+
+        done = len(target)
+        complete = source.shape[1] // self.factor
+        if complete <= done:
+            return
+
+        block = source[:, done * self.factor:complete * self.factor]
+        block = block.reshape(source.shape[0], -1, self.factor)
+        target.extend(np.asarray(reduce(block)))
+
+    def add_triggers(self, times, volts):
+        self.triggers.extend(np.asarray((times, volts), dtype=np.float64))
+
+    def get(self, t0, t1, max_points):
+        """
+        (time, voltage, current) arrays covering [t0, t1] with at most roughly
+        `max_points` points, taken from the finest level that fits.
+        """
+        raw = self.raw.view()
+        a, b = self._window(raw[0], t0, t1)
+        if b - a <= max_points:
+            return raw[:, a:b]
+
+        for level in self.levels:
+            data = level.view()
+            a, b = self._window(data[0], t0, t1)
+            if 2 * (b - a) <= max_points or level is self.levels[-1]:
+                # Interleave each bin's min and max so the line sweeps the full envelope
+                data = data[:, a:b]
+                t = np.repeat(data[0], 2)
+                v = np.column_stack((data[1], data[2])).ravel()
+                i = np.column_stack((data[3], data[4])).ravel()
+                return np.vstack((t, v, i))
+
+        return raw[:, a:b]
+
+    def get_triggers(self, t0, t1, max_points):
+        """(time, voltage) of trigger markers within [t0, t1], thinned to at most `max_points`."""
+        triggers = self.triggers.view()
+        a, b = np.searchsorted(triggers[0], (t0, t1))
+        stride = max(1, int(np.ceil((b - a) / max(1, max_points))))
+        return triggers[:, a:b:stride]
+
+    @staticmethod
+    def _window(t, t0, t1):
+        # Index range of the entries inside [t0, t1], padded by one each side so lines reach the edges
+        a, b = np.searchsorted(t, (t0, t1))
+        return max(0, a - 1), min(len(t), b + 1)
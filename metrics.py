@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics
+
+Cheap timing of each stage of the acquisition (frame poll, copy, emit,
+write, DAQ read, row building, GUI drawing...), so when a run starts to lag
+it's clear which stage is slow.
+
+Timings go into log-bucketed histograms (HDR style: 4 buckets per power of
+two of nanoseconds, so about 19% resolution from 1 ns to minutes), which
+costs a couple of integer operations per record and no allocation:
+
+    t0 = time.perf_counter_ns()
+    ...
+    camera_poll_time.record_since(t0)
+
+The whole registry can be served in Prometheus text format on a local HTTP
+port (start_http_server), and snapshot() gives a dict of count / mean /
+percentiles for saving in the _METADATA.json file.
+
+Each histogram should only be recorded from one thread (they don't lock).
+
+@author: edh1g18
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SUB_BUCKETS = 4         # Per power of two
+N_BUCKETS = 64 * SUB_BUCKETS
+PREFIX = "espray_"
+
+# Bucket bounds reported to Prometheus (seconds): powers of 2 from ~1 us to ~68 s
+PROMETHEUS_BOUNDS_NS = [2 ** e for e in range(10, 37)]
+
+
+def bucket_index(ns):
+    """Log bucket for a duration in ns: the power of two, then which quarter of it"""
+    if ns <= 0:
+        return 0
+    exponent = ns.bit_length() - 1
+    if exponent < 2:
+        return exponent * SUB_BUCKETS
+    return exponent * SUB_BUCKETS + ((ns >> (exponent - 2)) & (SUB_BUCKETS - 1))
+
+
+def bucket_upper_ns(index):
+    """Largest duration (ns) that falls in a bucket"""
+    exponent, sub = divmod(index, SUB_BUCKETS)
+    if exponent < 2:
+        return 2 ** (exponent + 1) - 1
+    return (2 ** exponent) + (sub + 1) * (2 ** (exponent - 2)) - 1
+
+
+class LatencyHistogram:
+    """Counts of durations in log buckets, plus the total and the maximum."""
+    def __init__(self, name, help_text=""):
+        self.name = name
+        self.help_text = help_text
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * N_BUCKETS
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, ns):
+        self.counts[bucket_index(ns)] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def record_since(self, t0_ns):
+        """Record the time since t0_ns (from time.perf_counter_ns()), and return now for the next stage."""
+        now = time.perf_counter_ns()
+        self.record(now - t0_ns)
+        return now
+
+    def percentile(self, q):
+        """Upper bound (ns) of the bucket holding the q-th percentile"""
+        if self.count == 0:
+            return 0
+        target = q / 100 * self.count
+        running = 0
+        for index, n in enumerate(self.counts):
+            running += n
+            if n and running >= target:
+                return min(bucket_upper_ns(index), self.max_ns)
+        return self.max_ns
+
+    def summary(self):
+        """count, mean, p50/p90/p99 and max in ms"""
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ns / self.count / 1e6 if self.count else 0.0,
+            "p50_ms": self.percentile(50) / 1e6,
+            "p90_ms": self.percentile(90) / 1e6,
+            "p99_ms": self.percentile(99) / 1e6,
+            "max_ms": self.max_ns / 1e6,
+            }
+
+    def prometheus(self):
+        name = PREFIX + self.name
+        lines = [f"# HELP {name} {self.help_text}", f"# TYPE {name} histogram"]
+        counts = list(self.counts)     # Copy, the worker may still be recording
+        cumulative = 0
+        index = 0
+        for bound in PROMETHEUS_BOUNDS_NS:
+            while index < N_BUCKETS and bucket_upper_ns(index) < bound:
+                cumulative += counts[index]
+                index += 1
+            lines.append(f'{name}_bucket{{le="{bound / 1e9:.9g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {sum(counts)}')
+        lines.append(f"{name}_sum {self.total_ns / 1e9:.9g}")
+        lines.append(f"{name}_count {sum(counts)}")
+        return lines
+
+
+class Counter:
+    """A number that only goes up (frames saved, samples read...)"""
+    def __init__(self, name, help_text=""):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+
+    def reset(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def prometheus(self):
+        name = PREFIX + self.name
+        return [f"# HELP {name} {self.help_text}", f"# TYPE {name} counter", f"{name} {self.value}"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def histogram(self, name, help_text=""):
+        """The histogram called `name`, made on first use"""
+        if name not in self.histograms:
+            self.histograms[name] = LatencyHistogram(name, help_text)
+        return self.histograms[name]
+
+    def counter(self, name, help_text=""):
+        if name not in self.counters:
+            self.counters[name] = Counter(name, help_text)
+        return self.counters[name]
+
+    def reset(self):
+        """Start counting afresh, e.g. at the start of a run"""
+        for metric in list(self.histograms.values()) + list(self.counters.values()):
+            metric.reset()
+
+    def snapshot(self):
+        """Everything recorded so far, for the metadata file"""
+        return {
+            "latency": {name: h.summary() for name, h in self.histograms.items() if h.count},
+            "counters": {name: c.value for name, c in self.counters.items()},
+            }
+
+    def prometheus_text(self):
+        lines = []
+        for metric in list(self.histograms.values()) + list(self.counters.values()):
+            lines.extend(metric.prometheus())
+        return "\n".join(lines) + "\n"
+
+
+# The registry the workers and GUI record into
+metrics = MetricsRegistry()
+
+
+def save_to_metadata(filepath, registry=metrics):
+    """Add a snapshot of the registry to a run's _METADATA.json (under "metrics"), creating it if needed"""
+    metadata = {}
+    try:
+        with open(filepath) as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        pass
+    metadata["metrics"] = registry.snapshot()
+    with open(filepath, 'w') as f:
+        json.dump(metadata, f, indent=4)
+
+
+def start_http_server(port, registry=metrics):
+    """
+    Serve the registry at http://127.0.0.1:<port>/metrics from a daemon
+    thread. Localhost only. Returns the server (call shutdown() to stop it).
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass    # Don't print every scrape
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
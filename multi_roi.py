@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-ROI recording
+
+The camera has one hardware ROI, so imaging two regions (e.g. the emitter
+tip and the collector) used to mean recording the whole box around both.
+With sub-ROIs set, the camera reads out the smallest ROI enclosing them
+(enclosing_roi) and MultiRoiWriter saves only the named regions, each as its
+own dataset; the display and the frame metrics still see the whole readout.
+
+Sub-ROIs are written as a string, in full sensor pixels like the main ROI:
+
+    tip: 1800,300,2300,900; collector: 1500,2400,2600,2900
+
+(name: TL_x,TL_y,BR_x,BR_y, separated by semicolons). Each one is a numpy
+slice of the frame (a view, no copy) handed straight to HDF5, and keeps its
+place if the camera or the reduction bins the frames.
+
+The recording goes to _IMAGES_ROIS.h5 in place of _IMAGES.tiff. The
+datasets can be compressed with zlib (gzip) or zstd like a TIFF recording;
+the delta and packed formats don't apply per dataset, so those are saved
+with zstd (roi_compression). experiment_reader.py opens the datasets by name.
+
+File layout (HDF5):
+    rois/<name>     (n_frames, rows, cols), with the sub-ROI in sensor pixels
+                    ("roi") as an attribute
+with the sub-ROI names in order, and the camera ROI origin and binning the
+frames came with, as attributes of the file.
+
+@author: edh1g18
+"""
+
+import os
+import re
+import lazy_imports
+
+ENCODING = "multi-roi-v1"
+GROUP = "rois"
+SENSOR_SIZE = (4096, 3000)
+MIN_ROI_SIZE = (260, 4)     # Smallest hardware ROI (ThorLabs camera specification, see camera_control.configure_camera)
+# Recording format -> HDF5 codec and level of the datasets
+HDF5_CODECS = {"none": ("none", None), "zlib": ("gzip", 4), "zstd": ("zstd", 3)}
+
+
+def parse_rois(text):
+    """
+    "name: TL_x,TL_y,BR_x,BR_y; ..." -> {name: [TL_x, TL_y, BR_x, BR_y]}, in
+    the order given ({} for an empty string). Raises ValueError if it's
+    malformed or a region is empty or off the sensor.
+    """
+    rois = {}
+    for entry in text.split(";"):
+        if not entry.strip():
+            continue
+        name, sep, coords = entry.partition(":")
+        name = name.strip()
+        if not sep or not re.fullmatch(r"[A-Za-z0-9_\-]+", name):
+            raise ValueError(f"Sub-ROI '{entry.strip()}' should be 'name: TL_x,TL_y,BR_x,BR_y' (name of letters, digits, _ or -)")
+        if name in rois:
+            raise ValueError(f"Sub-ROI '{name}' is given twice")
+        try:
+            roi = [int(v.strip()) for v in coords.split(",")]
+        except ValueError:
+            raise ValueError(f"Sub-ROI '{name}' coordinates must be whole numbers, not '{coords.strip()}'")
+        if len(roi) != 4:
+            raise ValueError(f"Sub-ROI '{name}' needs 4 coordinates (TL_x,TL_y,BR_x,BR_y), not {len(roi)}")
+        TL_x, TL_y, BR_x, BR_y = roi
+        if not (0 <= TL_x < BR_x <= SENSOR_SIZE[0] and 0 <= TL_y < BR_y <= SENSOR_SIZE[1]):
+            raise ValueError(f"Sub-ROI '{name}' ({TL_x},{TL_y},{BR_x},{BR_y}) is empty or off the "
+                             f"{SENSOR_SIZE[0]}x{SENSOR_SIZE[1]} sensor")
+        rois[name] = roi
+    return rois
+
+
+def format_rois(rois):
+    """Inverse of parse_rois"""
+    return "; ".join(f"{name}: {','.join(str(v) for v in roi)}" for name, roi in rois.items())
+
+
+def enclosing_roi(rois):
+    """The smallest hardware ROI holding every sub-ROI, widened if needed to the camera's minimum size"""
+    TL_x = min(roi[0] for roi in rois.values())
+    TL_y = min(roi[1] for roi in rois.values())
+    BR_x = max(roi[2] for roi in rois.values())
+    BR_y = max(roi[3] for roi in rois.values())
+
+    # Grow a too-small box about its centre, kept on the sensor
+    box = [TL_x, TL_y, BR_x, BR_y]
+    for axis in (0, 1):
+        short = MIN_ROI_SIZE[axis] - (box[axis + 2] - box[axis])
+        if short > 0:
+            start = min(max(0, box[axis] - short // 2), SENSOR_SIZE[axis] - MIN_ROI_SIZE[axis])
+            box[axis], box[axis + 2] = start, start + MIN_ROI_SIZE[axis]
+    return box
+
+
+def saved_fraction(rois):
+    """Pixels saved / pixels read out, for the resource planner"""
+    if not rois:
+        return 1.0
+    TL_x, TL_y, BR_x, BR_y = enclosing_roi(rois)
+    area = sum((roi[2] - roi[0]) * (roi[3] - roi[1]) for roi in rois.values())
+    return min(1.0, area / ((BR_x - TL_x) * (BR_y - TL_y)))
+
+
+def rois_path(filepath):
+    """..._IMAGES.tiff -> ..._IMAGES_ROIS.h5"""
+    return os.path.splitext(filepath)[0] + "_ROIS.h5"
+
+
+def roi_compression(compression, log=print):
+    """The recording format to save the datasets with (one of HDF5_CODECS, zstd needs hdf5plugin)"""
+    from tiff_compressor import hdf5plugin
+    zstd = "zstd" if hdf5plugin is not None else "zlib"
+    if compression == "lzw":
+        return "zlib"
+    if compression == "zstd":
+        return zstd
+    if compression in HDF5_CODECS:
+        return compression
+    log(f"Camera: sub-ROIs are saved as separate datasets, compressing them with {zstd} rather than {compression}")
+    return zstd
+
+
+def frame_slices(rois, origin=(0, 0), binning=1):
+    """{name: (row slice, column slice)} of each sub-ROI in a frame read out from origin, binned by binning"""
+    slices = {}
+    for name, (TL_x, TL_y, BR_x, BR_y) in rois.items():
+        x0, y0 = (TL_x - origin[0]) // binning, (TL_y - origin[1]) // binning
+        x1, y1 = -(-(BR_x - origin[0]) // binning), -(-(BR_y - origin[1]) // binning)     # Partly covered binned pixels count
+        slices[name] = (slice(y0, y1), slice(x0, x1))
+    return slices
+
+
+class MultiRoiWriter:
+    """
+    Writes each frame's sub-ROIs to their own datasets (the same interface
+    as the frame_writers.py writers). origin is the top left of the camera
+    ROI the frames come from, in sensor pixels, and binning the total binning
+    they've had since.
+    """
+    def __init__(self, filepath, rois, origin=(0, 0), binning=1, compression="none"):
+        h5py = lazy_imports.load("h5py")
+        from tiff_compressor import dataset_filters
+        self.filepath = filepath
+        self.rois = dict(rois)
+        self.compression = compression
+        self.filters = dataset_filters(*HDF5_CODECS[compression])
+        self.slices = frame_slices(self.rois, origin, binning)
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.h5 = h5py.File(filepath, 'w')
+        self.h5.attrs.update({"encoding": ENCODING, "names": list(self.rois), "origin": tuple(origin[:2]), "binning": binning})
+        self.datasets = None
+
+    def create_datasets(self, image):
+        group = self.h5.create_group(GROUP)
+        self.datasets = {}
+        for name, (rows, cols) in self.slices.items():
+            # Slicing clips a sub-ROI running off the edge (e.g. the pixels binning drops), it just can't start outside
+            h, w = image[rows, cols].shape
+            if rows.start < 0 or cols.start < 0 or h == 0 or w == 0:
+                origin = [int(v) for v in self.h5.attrs["origin"]]
+                raise ValueError(f"Sub-ROI '{name}' {self.rois[name]} is not inside the camera ROI "
+                                 f"({image.shape[1]}x{image.shape[0]} frame from {origin})")
+            dataset = group.create_dataset(name, shape=(0, h, w), maxshape=(None, h, w), dtype=image.dtype,
+                                           chunks=(1, h, w), **self.filters)
+            dataset.attrs["roi"] = self.rois[name]
+            self.datasets[name] = dataset
+
+    def write(self, image):
+        if self.datasets is None:
+            self.create_datasets(image)
+        n = self.frames_written
+        for name, (rows, cols) in self.slices.items():
+            view = image[rows, cols]
+            dataset = self.datasets[name]
+            dataset.resize(n + 1, axis=0)
+            dataset[n] = view
+            self.bytes_written += view.nbytes
+        self.frames_written += 1
+
+    def set_compression(self, compression):
+        pass    # Fixed when the datasets are created, the storage policy can only decimate this
+
+    def close(self):
+        if self.h5 is not None:
+            self.h5.close()
+            self.h5 = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
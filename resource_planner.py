@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Resource planner
+
+Works out before a run whether the chosen camera and DAQ settings are
+sustainable on this PC: the frame bytes/s, DAQ rows/s, the size of an hour
+of recording after compression, how busy the camera and DAQ threads will be,
+and whether the disk keeps up (storage_monitor.forecast).
+
+The per-frame and per-row costs come from a quick self-benchmark (about a
+second) of the things the workers do: copying a frame out of the SDK buffer,
+compressing and writing it with each of the recording codecs, and formatting
+and writing CSV rows. The results are cached in resource_calibration.json
+(next to this file, wherever the program is started from) and redone when
+the PC, Python or numpy change, or after CALIBRATION_MAX_AGE_S. The GUI
+loads them and measures the save folder on a worker thread
+(acquisition_workers.ResourceCheckWorker) so pressing Start doesn't wait.
+
+plan() returns "problems" (the run will overrun, start_system won't start
+it) and "warnings" (little headroom, the user is asked first).
+
+Loads are in cores: 1.0 is one core flat out. The camera and DAQ workers
+share one interpreter (and the GIL) unless the camera runs in its own
+process, so their loads are added together with an allowance for the GUI.
+
+Example:
+    python resource_planner.py --fps 30 --roi 4096x3000 --codec zstd --sample-rate-ms 4 --dir D:/espray_data
+
+@author: edh1g18
+"""
+
+import argparse
+import csv
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import sys
+import time
+import numpy as np
+
+import storage_monitor
+from frame_writers import TIFF_COMPRESSIONS, UINT16_FORMATS, hdf5_writer
+
+CALIBRATION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resource_calibration.json")
+CALIBRATION_VERSION = 3
+CALIBRATION_MAX_AGE_S = 30 * 24 * 3600
+
+GUI_LOAD = 0.15             # Allowance for the GUI thread (plot and image drawing) in cores
+WARN_LOAD = 0.7             # Warn above this fraction of a core (or of the shared interpreter)
+CSV_EXTRA_COLUMNS = 5       # Timestamp, tare offset, gain, Keysight current and Frame ID
+
+
+def machine_key():
+    return {"node": platform.node(), "processor": platform.processor(), "python": sys.version.split()[0],
+            "numpy": np.__version__, "version": CALIBRATION_VERSION}
+
+
+def calibrate(n_frames=8, n_rows=20000, n_values=9):
+    """
+    Time the per-frame and per-row work of the workers on this PC.
+    Returns a dict of seconds per MB / per value and compression ratios.
+    """
+    import tifffile
+    from compression_benchmark import synthetic_frames
+
+    frames = synthetic_frames(n_frames)
+    frame_mb = frames[0].nbytes / 1e6
+
+    # Copying a frame out of the SDK buffer (frame_to_array)
+    t0 = time.perf_counter()
+    for frame in frames:
+        np.copy(frame)
+    copy_s_per_mb = (time.perf_counter() - t0) / (n_frames * frame_mb)
+
+    # Encoding each frame as a TIFF page, into memory so the disk isn't timed
+    codecs = {}
+    for name, compression in TIFF_COMPRESSIONS.items():
+        buffer = io.BytesIO()
+        try:
+            with tifffile.TiffWriter(buffer, bigtiff=True) as tiff:
+                t0 = time.perf_counter()
+                for frame in frames:
+                    if compression is None:
+                        tiff.write(frame, contiguous=True)
+                    else:
+                        tiff.write(frame, compression=compression)
+                encode_s = time.perf_counter() - t0
+        except Exception:
+            continue    # Codec not available here
+        codecs[name] = {"s_per_mb": encode_s / (n_frames * frame_mb),
+                        "ratio": buffer.tell() / (n_frames * frames[0].nbytes)}
+
+    # The HDF5 formats (delta coded and 12-bit packed), to in-memory files
+    for name in UINT16_FORMATS:
+        buffer = io.BytesIO()
+        try:
+            t0 = time.perf_counter()
+            with hdf5_writer(buffer, name) as writer:
+                for frame in frames:
+                    writer.write(frame)
+            encode_s = time.perf_counter() - t0
+        except Exception:
+            continue    # h5py or the codec not available here
+        codecs[name] = {"s_per_mb": encode_s / (n_frames * frame_mb),
+                        "ratio": buffer.getbuffer().nbytes / (n_frames * frames[0].nbytes)}
+
+    # Building and writing CSV rows as DAQWorker does
+    start = datetime.datetime.now()
+    step = datetime.timedelta(seconds=0.004)
+    values = np.random.default_rng(0).random((n_rows, n_values - 2)).tolist()
+    text = io.StringIO()
+    writer = csv.writer(text)
+    t0 = time.perf_counter()
+    rows = [[start + n * step] + row + [n // 100] for n, row in enumerate(values)]
+    writer.writerows(rows)
+    csv_s = time.perf_counter() - t0
+
+    return {
+        "copy_s_per_mb": copy_s_per_mb,
+        "codecs": codecs,
+        "csv_s_per_value": csv_s / (n_rows * n_values),
+        "csv_bytes_per_value": text.tell() / (n_rows * n_values),
+        }
+
+
+def load_calibration(filepath=CALIBRATION_FILE, recalibrate=False, log=print):
+    """The cached calibration for this PC, running calibrate() if there isn't a current one"""
+    if not recalibrate and os.path.exists(filepath):
+        try:
+            with open(filepath) as f:
+                cached = json.load(f)
+            if cached.get("machine") == machine_key() and time.time() - cached.get("time", 0) < CALIBRATION_MAX_AGE_S:
+                return cached["results"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    log("Resource planner: calibrating on this PC...")
+    results = calibrate()
+    try:
+        with open(filepath, 'w') as f:
+            json.dump({"machine": machine_key(), "time": time.time(), "results": results}, f, indent=4)
+    except OSError as e:
+        log(f"Resource planner: could not save the calibration ({e})")
+    return results
+
+
+def plan(roi, fps, sample_rate_hz, n_ai=3, n_ao=2, compression="none", bit_depth=12, use_camera=True,
+         separate_process=False, directory=None, calibration=None, measure_disk=True, saved_fraction=1.0,
+         disk_bandwidth=None):
+    """
+    Expected rates and loads of a run (see the module docstring).
+
+    roi: [TL_x, TL_y, BR_x, BR_y]
+    saved_fraction: bytes saved per raw frame byte, less than 1 when frames are
+                    averaged or binned before saving (frame_reduction.saved_fraction)
+    directory: save folder, to check its speed and free space (None to skip)
+    disk_bandwidth: bytes/s the folder was measured at earlier (None to measure it, if measure_disk)
+    calibration: from load_calibration() (loaded if None)
+    """
+    if calibration is None:
+        calibration = load_calibration()
+    problems, warnings = [], []
+
+    # Camera
+    frame_bytes = (roi[2] - roi[0]) * (roi[3] - roi[1]) * math.ceil(bit_depth / 8) if use_camera else 0
+    frame_fps = fps if use_camera else 0.0
+    codec = calibration["codecs"].get(compression)
+    if use_camera and codec is None:
+        warnings.append(f"No calibration for '{compression}' compression, assuming uncompressed")
+        codec = calibration["codecs"].get("none", {"s_per_mb": 0.0, "ratio": 1.0})
+    elif codec is None:
+        codec = {"s_per_mb": 0.0, "ratio": 1.0}
+    raw_mb_s = frame_bytes * frame_fps / 1e6
+    saved_mb_s = raw_mb_s * saved_fraction * codec["ratio"]
+    accumulate_s_per_mb = calibration["copy_s_per_mb"] if saved_fraction < 1 else 0.0   # About another pass over the frame
+    camera_load = raw_mb_s * (calibration["copy_s_per_mb"] + accumulate_s_per_mb + saved_fraction * codec["s_per_mb"])
+
+    # DAQ
+    n_values = n_ai + n_ao + CSV_EXTRA_COLUMNS
+    csv_mb_s = sample_rate_hz * n_values * calibration["csv_bytes_per_value"] / 1e6
+    daq_load = sample_rate_hz * n_values * calibration["csv_s_per_value"]
+
+    result = {
+        "frame_bytes": frame_bytes,
+        "frames_mb_s": raw_mb_s,
+        "saved_frames_mb_s": saved_mb_s,
+        "rows_per_s": sample_rate_hz,
+        "csv_mb_s": csv_mb_s,
+        "gb_per_hour": (saved_mb_s + csv_mb_s) * 3600 / 1e3,
+        "camera_load": camera_load,
+        "daq_load": daq_load,
+        "interpreter_load": daq_load + GUI_LOAD + (0.0 if separate_process else camera_load),
+        "disk": None,
+        }
+
+    # Writing to disk takes camera thread time too, at the disk's speed
+    if directory is not None:
+        disk = storage_monitor.forecast(directory, frame_fps * saved_fraction, roi if use_camera else None, compression,
+                                        sample_rate_hz=sample_rate_hz, measure=measure_disk,
+                                        bandwidth=disk_bandwidth)
+        result["disk"] = disk
+        if disk["bandwidth_mb_s"]:
+            result["camera_load"] += saved_mb_s / disk["bandwidth_mb_s"]
+            if not separate_process:
+                result["interpreter_load"] += saved_mb_s / disk["bandwidth_mb_s"]
+        if disk["time_to_overrun_s"] is not None:
+            problems.extend(disk["warnings"])
+        else:
+            warnings.extend(disk["warnings"])
+
+    if result["camera_load"] > 1.0:
+        problems.append(f"Saving a frame takes {1000 * result['camera_load'] / fps:.0f} ms but they arrive every "
+                        f"{1000 / fps:.0f} ms, frames will be lost (lower the fps, shrink the ROI or change the compression)")
+    elif result["camera_load"] > WARN_LOAD:
+        warnings.append(f"The camera thread will be {100 * result['camera_load']:.0f}% busy")
+    if result["interpreter_load"] > 1.0:
+        problems.append(f"The camera, DAQ and GUI need {result['interpreter_load']:.1f} cores of one Python process"
+                        + ("" if separate_process else " (try running the camera in a separate process)"))
+    elif result["interpreter_load"] > WARN_LOAD:
+        warnings.append(f"The acquisition will keep Python {100 * result['interpreter_load']:.0f}% busy")
+
+    if use_camera and compression in ("packed12", "packed12-zstd") and bit_depth > 12:
+        problems.append(f"The camera is {bit_depth} bit, its frames can't be packed into 12 bits")
+
+    result["problems"] = problems
+    result["warnings"] = warnings
+    return result
+
+
+def describe(result):
+    """One line summary of a plan for the log"""
+    return (f"Plan: frames {result['frames_mb_s']:.1f} MB/s ({result['saved_frames_mb_s']:.1f} MB/s saved), "
+            f"DAQ {result['rows_per_s']:.0f} rows/s, {result['gb_per_hour']:.1f} GB/hour, "
+            f"camera thread {100 * result['camera_load']:.0f}%, Python {100 * result['interpreter_load']:.0f}% of a core")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check camera/DAQ settings are sustainable on this PC.")
+    parser.add_argument("--fps", type=float, default=10.0)
+    parser.add_argument("--roi", default="4096x3000", help="ROI size as WIDTHxHEIGHT")
+    parser.add_argument("--bit-depth", type=int, default=12)
+    parser.add_argument("--codec", default="none", help="Recording compression (frame_writers.RECORDING_FORMATS)")
+    parser.add_argument("--sample-rate-ms", type=float, default=4.0, help="DAQ sample period (ms)")
+    parser.add_argument("--ai", type=int, default=3, help="Number of AI channels")
+    parser.add_argument("--ao", type=int, default=2, help="Number of AO channels")
+    parser.add_argument("--process", action="store_true", help="Camera in a separate process")
+    parser.add_argument("--dir", help="Save folder to check the speed and free space of")
+    parser.add_argument("--recalibrate", action="store_true", help="Redo the self-benchmark")
+    args = parser.parse_args(argv)
+
+    width, height = (int(v) for v in args.roi.lower().split("x"))
+    calibration = load_calibration(recalibrate=args.recalibrate)
+    result = plan([0, 0, width, height], args.fps, 1000 / args.sample_rate_ms, args.ai, args.ao, args.codec,
+                  args.bit_depth, separate_process=args.process, directory=args.dir, calibration=calibration)
+    print(describe(result))
+    for problem in result["problems"]:
+        print(f"PROBLEM: {problem}")
+    for warning in result["warnings"]:
+        print(f"Warning: {warning}")
+    return 1 if result["problems"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
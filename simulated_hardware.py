@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+Simulated hardware
+
+Stand-ins for nidaqmx, the Thorlabs camera SDK, pyvisa and pyserial, so the
+real CameraWorker/DAQWorker/KeysightWorker code can be run (and benchmarked)
+on a machine with no hardware attached. install() registers them with
+lazy_imports, so nothing else needs to change:
+
+    import simulated_hardware
+    simulated_hardware.install(fps=20, ai_buffer_s=5)
+
+install() also sets an environment variable, so a camera process spawned
+afterwards (camera_process.py) simulates too. To run the GUI on simulated
+hardware set ESPRAY_SIMULATED_HARDWARE=1 before starting it.
+
+The simulated devices follow the channel layout in config.ini: AI0 Matsusada
+read in (follows the Matsusada control output), AI1 FEMTO current, AI2
+camera FVAL (a pulse per frame at the camera's frame rate), AO0 Matsusada
+control. The camera free-runs at `fps` once software triggered (or as soon
+as it is armed in hardware triggered mode), keeps the last two frames like
+the real one armed with arm(2), and counts the frames it had to throw away
+because nobody collected them in time.
+
+@author: edh1g18
+"""
+
+import json
+import os
+import threading
+import time
+import types
+import numpy as np
+
+ENVIRONMENT_VARIABLE = "ESPRAY_SIMULATED_HARDWARE"
+
+# Device behaviour, shared by all the simulated devices (set by install())
+state = {
+    "fps": 10.0,                # Camera frame rate
+    "ai_buffer_s": 10.0,        # DAQ input buffer, samples older than this are lost
+    "ai_signals": {0: "volts", 1: "current", 2: "fval"},
+    "ao_matsusada": 0,          # AO channel driving the Matsusada
+    "keysight_value": 1.5e-6,
+    # Counters the benchmark reads back
+    "frames_produced": 0,
+    "frames_dropped": 0,
+    "samples_produced": 0,
+    "samples_lost": 0,
+    }
+lock = threading.Lock()
+
+
+def count(key, n=1):
+    with lock:
+        state[key] += n
+
+
+# --- NI DAQ ---
+class _Channels:
+    def __init__(self):
+        self.physical = []
+
+    def _add(self, name, **kwargs):
+        self.physical.append(int(name.rsplit("ai", 1)[-1].rsplit("ao", 1)[-1]))
+
+    add_ai_voltage_chan = _add
+    add_ao_voltage_chan = _add
+
+
+class _Timing:
+    def __init__(self):
+        self.rate = 1000.0
+        self.ai_conv_rate = None
+
+    def cfg_samp_clk_timing(self, rate, sample_mode=None, **kwargs):
+        self.rate = rate
+
+
+class Task:
+    """nidaqmx.Task for analogue in (clocked, continuous) and out (on demand)"""
+    last_ao = {}    # {AO channel: volts} shared between tasks, so AI can follow AO
+
+    def __init__(self):
+        self.ai_channels = _Channels()
+        self.ao_channels = _Channels()
+        self.timing = _Timing()
+        self.start_time = None
+        self.samples_read = 0
+        self.rng = np.random.default_rng()
+
+    def start(self):
+        self.start_time = time.perf_counter()
+
+    def read(self, number_of_samples_per_channel=-1):
+        if self.start_time is None:
+            self.start()
+        elapsed = time.perf_counter() - self.start_time
+        available = int(elapsed * self.timing.rate) - self.samples_read
+
+        # The DAQ's buffer is finite, anything older has been overwritten
+        limit = int(state["ai_buffer_s"] * self.timing.rate)
+        if available > limit:
+            count("samples_lost", available - limit)
+            self.samples_read += available - limit
+            available = limit
+        if number_of_samples_per_channel not in (-1, None):
+            available = min(available, number_of_samples_per_channel)
+
+        sample_times = (self.samples_read + np.arange(available)) / self.timing.rate
+        self.samples_read += available
+        count("samples_produced", available)
+
+        chunk = []
+        for chan in self.ai_channels.physical:
+            signal = state["ai_signals"].get(chan)
+            if signal == "volts":
+                values = Task.last_ao.get(state["ao_matsusada"], 0.0) + self.rng.normal(0, 0.002, available)
+            elif signal == "current":
+                values = 1e-3 + self.rng.normal(0, 1e-4, available)
+            elif signal == "fval":
+                # High for the first 20% of each frame period
+                values = np.where((sample_times * state["fps"]) % 1.0 < 0.2, 5.0, 0.0)
+            else:
+                values = self.rng.normal(0, 0.01, available)
+            chunk.append(values.tolist())
+
+        if len(chunk) == 1:
+            return chunk[0]
+        return chunk
+
+    def write(self, data, auto_start=False):
+        values = data if isinstance(data, (list, tuple)) else [data]
+        for chan, value in zip(self.ao_channels.physical, values):
+            Task.last_ao[chan] = value
+
+    def stop(self):
+        self.start_time = None
+
+    def close(self):
+        pass
+
+
+def nidaqmx_modules():
+    nidaqmx = types.ModuleType("nidaqmx")
+    nidaqmx.Task = Task
+    constants = types.ModuleType("nidaqmx.constants")
+    constants.AcquisitionType = types.SimpleNamespace(CONTINUOUS=10123, FINITE=10178)
+    constants.TerminalConfiguration = types.SimpleNamespace(RSE=10083, DIFF=10106)
+    constants.READ_ALL_AVAILABLE = -1
+    nidaqmx.constants = constants
+    return nidaqmx, constants
+
+
+# --- THORLABS CAMERA ---
+class _Frame:
+    def __init__(self, image_buffer, frame_count, timestamp_ns):
+        self.image_buffer = image_buffer
+        self.frame_count = frame_count
+        self.time_stamp_relative_ns_or_null = timestamp_ns
+
+
+class _Range:
+    def __init__(self, low, high):
+        self.min = low
+        self.max = high
+
+
+class SimulatedCamera:
+    """TLCamera look-alike that free-runs at state["fps"] once triggered"""
+    sensor_width_pixels = 4096
+    sensor_height_pixels = 3000
+    bit_depth = 12
+    sensor_readout_time_ns = 30000000
+    binx_range = _Range(1, 1)   # No on-sensor binning, like some of the Thorlabs models
+    biny_range = _Range(1, 1)
+
+    def __init__(self):
+        self.roi = (0, 0, self.sensor_width_pixels, self.sensor_height_pixels)
+        self.binx = self.biny = 1
+        self.exposure_time_us = 2000
+        self.image_poll_timeout_ms = 1000
+        self.operation_mode = 0
+        self.frames_per_trigger_zero_for_unlimited = 0
+        self.trigger_polarity = 0
+        self.is_frame_rate_control_enabled = False
+        self.frame_rate_control_value = 0
+        self.armed = False
+        self.running_since = None
+        self.next_frame = 0
+        self.frames = []
+
+    @property
+    def image_width_pixels(self):
+        return (self.roi[2] - self.roi[0]) // self.binx
+
+    @property
+    def image_height_pixels(self):
+        return (self.roi[3] - self.roi[1]) // self.biny
+
+    @property
+    def frame_time_us(self):
+        return int(1e6 / self.frame_rate)
+
+    @property
+    def frame_rate(self):
+        if self.is_frame_rate_control_enabled and self.frame_rate_control_value:
+            return min(state["fps"], self.frame_rate_control_value)
+        return state["fps"]
+
+    def arm(self, frames_to_buffer):
+        self.armed = True
+        self.buffer_frames = frames_to_buffer
+        # A few noisy frames to cycle through (making one per frame would be the bottleneck)
+        rng = np.random.default_rng(0)
+        n_pixels = self.image_width_pixels * self.image_height_pixels
+        self.frames = [rng.integers(0, 2 ** self.bit_depth, n_pixels, dtype=np.uint16) for _ in range(3)]
+        # Hardware triggered: the DAQ's trigger pulses are taken to arrive at state["fps"]
+        if self.operation_mode == 1:
+            self.running_since = time.perf_counter()
+            self.next_frame = 0
+
+    def disarm(self):
+        self.armed = False
+        self.running_since = None
+
+    def issue_software_trigger(self):
+        # Unlimited frames per trigger, so the first trigger starts it free-running
+        if self.armed and self.running_since is None:
+            self.running_since = time.perf_counter()
+            self.next_frame = 0
+
+    def get_pending_frame_or_null(self):
+        if not self.armed or self.running_since is None:
+            time.sleep(self.image_poll_timeout_ms / 1000)
+            return None
+
+        produced = int((time.perf_counter() - self.running_since) * self.frame_rate)
+        if produced <= self.next_frame:
+            # Wait for the next frame, up to the poll timeout
+            wait = (self.next_frame + 1) / self.frame_rate - (time.perf_counter() - self.running_since)
+            if wait * 1000 > self.image_poll_timeout_ms:
+                time.sleep(self.image_poll_timeout_ms / 1000)
+                return None
+            time.sleep(max(0.0, wait))
+            produced = self.next_frame + 1
+
+        # Only the newest buffer_frames frames are still in the camera
+        oldest_kept = produced - self.buffer_frames
+        if self.next_frame < oldest_kept:
+            count("frames_dropped", oldest_kept - self.next_frame)
+            self.next_frame = oldest_kept
+
+        count("frames_produced")
+        frame_number = self.next_frame
+        self.next_frame += 1
+        return _Frame(self.frames[frame_number % len(self.frames)], frame_number + 1,
+                      int(frame_number / self.frame_rate * 1e9))
+
+    def dispose(self):
+        self.disarm()
+
+
+class TLCameraSDK:
+    def discover_available_cameras(self):
+        return ["SIM00001"]
+
+    def open_camera(self, serial_number):
+        return SimulatedCamera()
+
+    def dispose(self):
+        pass
+
+
+def thorlabs_modules():
+    tl_camera = types.ModuleType("thorlabs_tsi_sdk.tl_camera")
+    tl_camera.TLCameraSDK = TLCameraSDK
+    tl_enums = types.ModuleType("thorlabs_tsi_sdk.tl_camera_enums")
+    tl_enums.OPERATION_MODE = types.SimpleNamespace(SOFTWARE_TRIGGERED=0, HARDWARE_TRIGGERED=1, BULB=2)
+    tl_enums.TRIGGER_POLARITY = types.SimpleNamespace(ACTIVE_HIGH=0, ACTIVE_LOW=1)
+    return tl_camera, tl_enums
+
+
+# --- KEYSIGHT MULTIMETER ---
+class _Instrument:
+    def __init__(self):
+        self.rng = np.random.default_rng()
+
+    def query(self, command):
+        if command.startswith("*IDN?"):
+            return "Keysight Technologies,U1282A,SIM00001,V1.00"
+        return f"{state['keysight_value'] * (1 + self.rng.normal(0, 0.01)):.6E}"
+
+    def close(self):
+        pass
+
+
+class ResourceManager:
+    def __init__(self, backend=None):
+        pass
+
+    def open_resource(self, resource):
+        return _Instrument()
+
+
+def keysight_modules():
+    pyvisa = types.ModuleType("pyvisa")
+    pyvisa.ResourceManager = ResourceManager
+    list_ports = types.ModuleType("serial.tools.list_ports")
+    port = types.SimpleNamespace(device="COM11", description="Prolific USB-to-Serial Comm Port (simulated)")
+    list_ports.comports = lambda: [port]
+    return pyvisa, list_ports
+
+
+# --- INSTALLING ---
+def install(**settings):
+    """
+    Make lazy_imports hand out the simulated devices. Keyword arguments
+    override entries of `state` (e.g. fps, ai_buffer_s).
+    """
+    import lazy_imports     # Not at the top, lazy_imports imports this module when the environment variable is set
+    with lock:
+        state.update(settings)
+        for key in ("frames_produced", "frames_dropped", "samples_produced", "samples_lost"):
+            state[key] = 0
+
+    nidaqmx, constants = nidaqmx_modules()
+    tl_camera, tl_enums = thorlabs_modules()
+    pyvisa, list_ports = keysight_modules()
+    lazy_imports.overrides.update({
+        "nidaqmx": nidaqmx,
+        "nidaqmx.constants": constants,
+        "thorlabs_tsi_sdk.tl_camera": tl_camera,
+        "thorlabs_tsi_sdk.tl_camera_enums": tl_enums,
+        "pyvisa": pyvisa,
+        "serial.tools.list_ports": list_ports,
+        })
+
+    # Picked up by lazy_imports in any process started from now on
+    settings = {key: value for key, value in settings.items() if key in ("fps", "ai_buffer_s", "keysight_value")}
+    os.environ[ENVIRONMENT_VARIABLE] = json.dumps(settings)
+
+
+def install_from_environment():
+    """Called by lazy_imports when ESPRAY_SIMULATED_HARDWARE is set ("1" or a JSON dict of settings)"""
+    value = os.environ.get(ENVIRONMENT_VARIABLE, "")
+    try:
+        settings = json.loads(value)
+    except ValueError:
+        settings = {}
+    install(**(settings if isinstance(settings, dict) else {}))
+
+
+def uninstall():
+    import lazy_imports
+    for name in ("nidaqmx", "nidaqmx.constants", "thorlabs_tsi_sdk.tl_camera", "thorlabs_tsi_sdk.tl_camera_enums",
+                 "pyvisa", "serial.tools.list_ports"):
+        lazy_imports.overrides.pop(name, None)
+    os.environ.pop(ENVIRONMENT_VARIABLE, None)
+
+
+def counters():
+    with lock:
+        return {key: state[key] for key in ("frames_produced", "frames_dropped", "samples_produced", "samples_lost")}
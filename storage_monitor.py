@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Storage monitor
+
+Checks the data disk can keep up with a recording, before and during a run.
+
+Before starting, forecast() compares the rate the run will write at (frames
+from the fps and ROI, plus the CSV rows) with the write bandwidth measured
+on the target folder and its free space, and predicts:
+
+    time_to_full_s      - when the disk runs out of space at that rate
+    time_to_overrun_s   - when the OS write cache has filled up at the
+                          shortfall rate (if the disk is too slow), after
+                          which frames are saved slower than they arrive
+                          and the camera starts dropping them
+
+The bandwidth test writes (and fsyncs) a temporary file in the folder, so a
+slow network or cloud-synced folder shows up as slow. Results are cached for
+a few minutes per folder.
+
+During the run the camera writer keeps a StorageMonitor. It times every
+frame write and every few seconds works out what fraction of the wall time
+was spent writing, and how long until the disk is full. If writing takes
+longer than utilisation_limit of the time, or the disk will be full within
+min_time_to_full_s, it applies its policy:
+
+    "alert"     - just log a warning
+    "compress"  - switch the rest of the recording to zstd (then decimate
+                  if that still isn't enough)
+    "decimate"  - only save every 2nd frame, then every 4th... up to
+                  MAX_SAVE_EVERY (not in triggered recording, where every
+                  frame around an event is kept, see triggered_recording.py)
+
+Changes are only ever made in that direction during a run. Every change is
+kept in summary()["events"] and saved under "storage" in the run's
+_METADATA.json, so experiment_reader.py knows which frames were saved.
+
+@author: edh1g18
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+POLICIES = ("alert", "compress", "decimate")
+MAX_SAVE_EVERY = 16
+BANDWIDTH_CACHE_S = 600
+
+# Rough compressed size / raw size of camera frames for the forecast (see compression_benchmark.py)
+ASSUMED_RATIOS = {"none": 1.0, "lzw": 0.8, "zlib": 0.6, "zstd": 0.55, "delta": 0.4, "packed12": 0.75, "packed12-zstd": 0.5}
+CSV_ROW_BYTES = 160         # A row of _DATA.csv with the default channels
+WRITE_CACHE_BYTES = 512e6   # Roughly how much the OS buffers before writes slow to disk speed
+
+_bandwidth_cache = {}
+
+
+def free_bytes(directory):
+    return shutil.disk_usage(directory).free
+
+
+def measure_write_bandwidth(directory, test_bytes=64 * 2**20, block_bytes=8 * 2**20, use_cache=True):
+    """Bytes/s writing (and fsyncing) a temporary file in `directory`"""
+    key = os.path.realpath(directory)
+    cached = _bandwidth_cache.get(key)
+    if use_cache and cached is not None and time.monotonic() - cached[0] < BANDWIDTH_CACHE_S:
+        return cached[1]
+
+    block = os.urandom(block_bytes)     # Random so compressed/deduplicating folders aren't flattered
+    fd, path = tempfile.mkstemp(prefix=".espray_bandwidth_", dir=directory)
+    try:
+        t0 = time.perf_counter()
+        written = 0
+        while written < test_bytes:
+            written += os.write(fd, block)
+        os.fsync(fd)
+        bandwidth = written / (time.perf_counter() - t0)
+    finally:
+        os.close(fd)
+        os.remove(path)
+
+    _bandwidth_cache[key] = (time.monotonic(), bandwidth)
+    return bandwidth
+
+
+def required_rate(fps, roi, compression="none", bytes_per_pixel=2, sample_rate_hz=0.0, csv_row_bytes=CSV_ROW_BYTES):
+    """Bytes/s a run writes. roi is [TL_x, TL_y, BR_x, BR_y] (None or fps 0 for no camera)."""
+    frame_bytes = 0.0
+    if roi is not None and fps:
+        frame_bytes = (roi[2] - roi[0]) * (roi[3] - roi[1]) * bytes_per_pixel * ASSUMED_RATIOS.get(compression, 1.0)
+    return frame_bytes * fps + sample_rate_hz * csv_row_bytes
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "never"
+    if seconds < 120:
+        return f"{seconds:.0f} s"
+    if seconds < 2 * 3600:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+
+def forecast(directory, fps, roi, compression="none", sample_rate_hz=0.0, measure=True, bandwidth=None):
+    """
+    Predicted storage behaviour of a run (see the module docstring). bandwidth
+    is the folder's write speed in bytes/s if it's already been measured
+    (otherwise it's measured here, unless measure is False). Returns a
+    dict of the rates, free space, time_to_full_s, time_to_overrun_s (None if
+    the disk keeps up) and "warnings", a list of messages for the user.
+    """
+    result = {"directory": directory, "required_mb_s": required_rate(fps, roi, compression, sample_rate_hz=sample_rate_hz) / 1e6,
+              "bandwidth_mb_s": None, "free_gb": None, "time_to_full_s": None, "time_to_overrun_s": None, "warnings": []}
+    if not os.path.isdir(directory):
+        result["warnings"].append(f"Save folder '{directory}' does not exist")
+        return result
+
+    required = result["required_mb_s"] * 1e6
+    free = free_bytes(directory)
+    result["free_gb"] = free / 1e9
+    if required > 0:
+        result["time_to_full_s"] = free / required
+    if result["time_to_full_s"] is not None and result["time_to_full_s"] < 3600:
+        result["warnings"].append(f"Disk full in {format_duration(result['time_to_full_s'])} "
+                                  f"({result['free_gb']:.1f} GB free at {result['required_mb_s']:.1f} MB/s)")
+
+    if required > 0 and bandwidth is None and measure:
+        try:
+            bandwidth = measure_write_bandwidth(directory)
+        except OSError as e:
+            result["warnings"].append(f"Could not measure write speed of '{directory}': {e}")
+            return result
+    if required > 0 and bandwidth is not None:
+        result["bandwidth_mb_s"] = bandwidth / 1e6
+        if required > bandwidth:
+            result["time_to_overrun_s"] = WRITE_CACHE_BYTES / (required - bandwidth)
+            result["warnings"].append(f"Disk writes {result['bandwidth_mb_s']:.1f} MB/s but the run needs "
+                                      f"{result['required_mb_s']:.1f} MB/s, frames will be lost after about "
+                                      f"{format_duration(result['time_to_overrun_s'])}")
+        elif required > 0.8 * bandwidth:
+            result["warnings"].append(f"The run needs {result['required_mb_s']:.1f} MB/s of the disk's "
+                                      f"{result['bandwidth_mb_s']:.1f} MB/s, little headroom")
+    return result
+
+
+class StorageMonitor:
+    """
+    Watches the frame writes of one recording and applies the policy (see the
+    module docstring). Only used from the thread doing the writing.
+
+        monitor = StorageMonitor(directory, "decimate")
+        for each frame:
+            if monitor.should_save():
+                ...write, timing it...
+                monitor.record_write(nbytes, seconds)
+            for message in monitor.check():
+                log(message)
+    """
+    def __init__(self, directory, policy="alert", compression="none", check_every_s=5.0,
+                 utilisation_limit=0.8, min_time_to_full_s=600.0, decimate=True):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown storage policy '{policy}', expected one of {POLICIES}")
+        self.directory = directory
+        self.policy = policy
+        self.compression = compression or "none"
+        self.check_every_s = check_every_s
+        self.utilisation_limit = utilisation_limit
+        self.min_time_to_full_s = min_time_to_full_s
+        self.decimate = decimate
+
+        self.save_every = 1
+        self.frame_id = 0               # Frames seen so far (the DAQ's Frame ID of the latest)
+        self.segment_start = 1          # First frame ID since save_every last changed
+        self.events = []
+        self.frames_saved = 0
+        self.bytes_saved = 0
+        self._window_start = None       # Set at the first write, the wait for the first frame isn't time the disk had
+        self._window_write_s = 0.0
+        self._window_bytes = 0
+        self.last_utilisation = 0.0
+        self.last_write_mb_s = None
+
+    def should_save(self):
+        """Call once per frame received: True if this frame is to be saved"""
+        self.frame_id += 1
+        return (self.frame_id - self.segment_start) % self.save_every == 0
+
+    def record_write(self, nbytes, seconds, n_frames=1):
+        if self._window_start is None:
+            self._window_start = time.monotonic() - seconds
+        self.frames_saved += n_frames
+        self.bytes_saved += nbytes
+        self._window_write_s += seconds
+        self._window_bytes += nbytes
+
+    def check(self, now=None):
+        """Every check_every_s: look at the last window and apply the policy. Returns messages to log."""
+        if self._window_start is None:
+            return []
+        now = time.monotonic() if now is None else now
+        elapsed = now - self._window_start
+        if elapsed < self.check_every_s:
+            return []
+
+        self.last_utilisation = self._window_write_s / elapsed
+        rate = self._window_bytes / elapsed
+        if self._window_write_s > 0:
+            self.last_write_mb_s = self._window_bytes / self._window_write_s / 1e6
+        self._window_start = now
+        self._window_write_s = 0.0
+        self._window_bytes = 0
+
+        messages = []
+        try:
+            time_to_full = free_bytes(self.directory) / rate if rate > 0 else None
+        except OSError:
+            time_to_full = None
+
+        if self.last_utilisation > self.utilisation_limit:
+            messages.append(f"Storage: writing frames is taking {100 * self.last_utilisation:.0f}% of the time "
+                            f"({self.last_write_mb_s:.1f} MB/s), frames will be lost")
+            messages.extend(self.apply_policy("slow disk"))
+        elif time_to_full is not None and time_to_full < self.min_time_to_full_s:
+            messages.append(f"Storage: disk full in {format_duration(time_to_full)}")
+            messages.extend(self.apply_policy("disk nearly full"))
+        return messages
+
+    def apply_policy(self, reason):
+        if self.policy == "compress" and self.compression == "none":
+            self.compression = "zstd"
+            self.add_event(reason)
+            return ["Storage: switched the recording to zstd compression"]
+        if self.policy in ("compress", "decimate") and self.decimate and self.save_every < MAX_SAVE_EVERY:
+            self.save_every *= 2
+            self.add_event(reason)
+            return [f"Storage: now saving every {self.save_every} frames (from frame {self.segment_start})"]
+        return []
+
+    def add_event(self, reason):
+        self.segment_start = self.frame_id + 1
+        self.events.append({
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "first_frame": self.frame_id + 1,
+            "save_every": self.save_every,
+            "compression": self.compression,
+            "reason": reason,
+            })
+
+    def summary(self):
+        return {
+            "policy": self.policy,
+            "frames_seen": self.frame_id,
+            "frames_saved": self.frames_saved,
+            "bytes_saved": self.bytes_saved,
+            "events": self.events,
+            }
+
+
+def saved_frame_ids(n_frames, events):
+    """Frame IDs (1 to n_frames) that were saved, given the decimation events of a run"""
+    segments = [(1, 1)] + [(e["first_frame"], e["save_every"]) for e in events]
+    saved = []
+    for i, (start, every) in enumerate(segments):
+        stop = segments[i + 1][0] if i + 1 < len(segments) else n_frames + 1
+        saved.extend(range(start, min(stop, n_frames + 1), every))
+    return saved
+
+
+def save_to_metadata(filepath, summary):
+    """Add a monitor's summary to a run's _METADATA.json (under "storage"), creating it if needed"""
+    metadata = {}
+    try:
+        with open(filepath) as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        pass
+    metadata["storage"] = summary
+    with open(filepath, 'w') as f:
+        json.dump(metadata, f, indent=4)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Telemetry bus
+
+Instead of firing a queued Qt signal for every chunk, frame, trigger and log
+line, the worker threads drop their updates into a TelemetryBus. The GUI
+drains it once per redraw tick and gets a single snapshot (latest frame,
+merged sample envelope, camera triggers, frame metrics and log lines), so the load on the GUI
+thread stays bounded however fast the acquisition runs.
+
+@author: edh1g18
+"""
+
+import threading
+from collections import deque
+import numpy as np
+
+
+class TelemetryBus:
+    """
+    Thread-safe mailbox shared between the workers (writers) and the GUI
+    (single reader, calling drain() on a timer).
+    """
+    def __init__(self, max_log_lines=200, max_metric_rows=1000):
+        self._lock = threading.Lock()
+        self._frame = None
+        self._frames_skipped = 0
+        self._envelopes = []
+        self._triggers = []
+        self._metric_rows = deque(maxlen=max_metric_rows)
+        self._log = deque(maxlen=max_log_lines)
+        self._log_dropped = 0
+
+    def post_frame(self, frame):
+        # Only the newest frame is ever shown, older undisplayed ones are just counted
+        with self._lock:
+            if self._frame is not None:
+                self._frames_skipped += 1
+            self._frame = frame
+
+    def post_envelope(self, envelope):
+        with self._lock:
+            self._envelopes.append(envelope)
+
+    def post_trigger(self, t, volts):
+        # Every trigger is kept (plot time and voltage), so fast triggering still gets one marker each
+        with self._lock:
+            self._triggers.append((t, volts))
+
+    def post_metrics(self, row):
+        # One row of frame_metrics.py per frame: (frame ID, time.time(), *METRICS)
+        with self._lock:
+            self._metric_rows.append(row)
+
+    def post_log(self, text):
+        with self._lock:
+            if len(self._log) == self._log.maxlen:
+                self._log_dropped += 1
+            self._log.append(text)
+
+    def drain(self):
+        """Take everything posted since the last call as one snapshot dict."""
+        with self._lock:
+            snapshot = {
+                "frame": self._frame,
+                "frames_skipped": self._frames_skipped,
+                "envelope": merge_envelopes(self._envelopes) if self._envelopes else None,
+                "triggers": self._triggers,
+                "frame_metrics": list(self._metric_rows),
+                "log": list(self._log),
+                "log_dropped": self._log_dropped,
+                }
+            self._frame = None
+            self._frames_skipped = 0
+            self._envelopes = []
+            self._triggers = []
+            self._metric_rows.clear()
+            self._log.clear()
+            self._log_dropped = 0
+        return snapshot
+
+
+def merge_envelopes(envelopes):
+    """Combine several DAQ chunk envelopes (see DAQWorker.run) into one."""
+    if len(envelopes) == 1:
+        return envelopes[0]
+
+    counts = [e["n"] for e in envelopes]   # Chunks differ in length, so the means are weighted by it
+    return {
+        "t": np.concatenate([e["t"] for e in envelopes]),
+        "volts": np.concatenate([e["volts"] for e in envelopes]),
+        "current": np.concatenate([e["current"] for e in envelopes]),
+        "smooth_t": np.concatenate([e["smooth_t"] for e in envelopes]),
+        "smooth_volts": np.concatenate([e["smooth_volts"] for e in envelopes]),
+        "smooth_current": np.concatenate([e["smooth_current"] for e in envelopes]),
+        "volts_min": min(e["volts_min"] for e in envelopes),
+        "volts_max": max(e["volts_max"] for e in envelopes),
+        "volts_mean": float(np.average([e["volts_mean"] for e in envelopes], weights=counts)),
+        "current_min": min(e["current_min"] for e in envelopes),
+        "current_max": max(e["current_max"] for e in envelopes),
+        "current_mean": float(np.average([e["current_mean"] for e in envelopes], weights=counts)),
+        "n": sum(counts),
+        "fval_edges": np.concatenate([e["fval_edges"] for e in envelopes]),
+        }
+
+
+class TelemetryPublisher:
+    """
+    Mixin for the worker threads. Updates go to `self.bus` when the GUI has
+    attached one, otherwise they are emitted on the worker's Qt signals as
+    before (e.g. for the camera settings preview).
+    """
+    bus = None
+
+    def publish_log(self, text):
+        if self.bus is not None:
+            self.bus.post_log(text)
+        else:
+            self.log_message.emit(text)
+
+    def publish_frame(self, frame):
+        if self.bus is not None:
+            self.bus.post_frame(frame)
+        else:
+            self.image_ready.emit(frame)
+
+    def publish_envelope(self, envelope):
+        if self.bus is not None:
+            self.bus.post_envelope(envelope)
+        else:
+            self.data_ready.emit(envelope)
+
+    def publish_trigger(self, t, volts):
+        if self.bus is not None:
+            self.bus.post_trigger(t, volts)
+        else:
+            self.photo_triggered.emit(t, volts)
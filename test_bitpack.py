@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Round-trip tests of bitpack.py
+
+    python -m pytest test_bitpack.py
+
+@author: edh1g18
+"""
+
+import numpy as np
+import pytest
+
+from bitpack import pack12, unpack12, packed_size, PackedWriter, PackedReader
+
+
+def frames_12bit(n=5, shape=(7, 9), seed=0):
+    """Random 12-bit frames, with the extremes in every frame"""
+    rng = np.random.default_rng(seed)
+    frames = rng.integers(0, 4096, (n, *shape), dtype=np.uint16)
+    frames[:, 0, 0] = 0
+    frames[:, -1, -1] = 4095
+    return frames
+
+
+@pytest.mark.parametrize("shape", [(7, 9), (8, 9), (1, 1), (2, 1)])
+def test_round_trip(shape):
+    # 63 and 1 pixels are odd (the last pixel takes two bytes), 72 and 2 are even
+    image = frames_12bit(1, shape)[0]
+    packed = pack12(image)
+    assert packed.dtype == np.uint8 and packed.size == packed_size(image.size)
+    assert np.array_equal(unpack12(packed, shape), image)
+
+
+@pytest.mark.parametrize("shift", [1, 4])
+def test_round_trip_shift(shift):
+    # e.g. 12-bit data scaled up to 16 bit: the low bits are always zero
+    image = frames_12bit(1, (5, 7))[0] << shift
+    assert np.array_equal(unpack12(pack12(image, shift), image.shape, shift), image)
+
+
+def test_too_many_bits():
+    image = frames_12bit(1)[0]
+    image[3, 3] = 4096
+    with pytest.raises(ValueError):
+        pack12(image)
+    # Still too big after dropping the low bits
+    with pytest.raises(ValueError):
+        pack12(np.full((2, 3), 4096 << 2, dtype=np.uint16), shift=2)
+
+
+def test_dropped_bits_not_zero():
+    image = frames_12bit(1)[0] << 2
+    image[1, 2] |= 1
+    with pytest.raises(ValueError):
+        pack12(image, shift=2)
+
+
+@pytest.mark.parametrize("shape", [(7, 9), (8, 9)])
+def test_reader(tmp_path, shape):
+    # Odd sized frames are padded to whole bytes, so slices are unpacked a frame at a time
+    frames = frames_12bit(6, shape)
+    path = tmp_path / "stack_PACKED.h5"
+    with PackedWriter(path) as writer:
+        for frame in frames:
+            writer.write(frame)
+
+    with PackedReader(path) as stack:
+        assert stack.shape == frames.shape
+        assert np.array_equal(stack[:], frames)
+        assert np.array_equal(stack[1:5], frames[1:5])
+        assert np.array_equal(stack[0:6:2], frames[0:6:2])
+        assert stack[3:3].shape == (0, *shape)
+        assert np.array_equal(stack[4], frames[4])
+        index = [5, 0, 2]
+        assert np.array_equal(stack[index], frames[index])
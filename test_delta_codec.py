@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Round-trip tests of delta_codec.py
+
+    python -m pytest test_delta_codec.py
+
+@author: edh1g18
+"""
+
+import numpy as np
+import pytest
+
+from delta_codec import DeltaWriter, DeltaReader
+
+
+def noisy_frames(n=70, shape=(24, 40), seed=0):
+    """A static background with noise, a moving blob, and some full range values"""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 4096, shape, dtype=np.uint16)
+    frames = np.repeat(background[None], n, axis=0)
+    frames += rng.integers(0, 30, frames.shape, dtype=np.uint16)
+    for i in range(n):
+        frames[i, i % shape[0], :5] = 65535
+        frames[i, -1, i % shape[1]] = 0
+    return frames
+
+
+@pytest.mark.parametrize("mode", ["previous", "background"])
+def test_round_trip(tmp_path, mode):
+    frames = noisy_frames()
+    path = tmp_path / "stack_DELTA.h5"
+    with DeltaWriter(path, mode=mode, keyframe_interval=16, codec="gzip", level=1) as writer:
+        for frame in frames:
+            writer.write(frame)
+
+    with DeltaReader(path) as stack:
+        assert stack.shape == frames.shape
+        assert np.array_equal(stack[0:len(frames)], frames)
+        # Single frames, in and out of order
+        for i in (0, 15, 16, 17, 69, 40, 3, -1):
+            assert np.array_equal(stack[i], frames[i])
+        # Slices starting mid-group, with steps, and empty
+        assert np.array_equal(stack[5:50], frames[5:50])
+        assert np.array_equal(stack[3:60:7], frames[3:60:7])
+        assert stack[10:10].shape == (0, *frames.shape[1:])
+        # Backwards
+        assert np.array_equal(stack[::-1], frames[::-1])
+        assert np.array_equal(stack[40:2:-3], frames[40:2:-3])
+        assert stack[2:40:-1].shape == (0, *frames.shape[1:])
+        # Fancy indexing
+        index = [66, 2, 31, 2, 17]
+        assert np.array_equal(stack[index], frames[index])
+
+
+@pytest.mark.parametrize("mode", ["previous", "background"])
+def test_reused_frame_buffer(tmp_path, mode):
+    # Cameras hand over the same buffer every frame, the writer must not hold on to it
+    frames = noisy_frames(n=20)
+    path = tmp_path / "stack_DELTA.h5"
+    buffer = np.empty_like(frames[0])
+    with DeltaWriter(path, mode=mode, keyframe_interval=8, codec="gzip", level=1) as writer:
+        for frame in frames:
+            buffer[:] = frame
+            writer.write(buffer)
+
+    with DeltaReader(path) as stack:
+        assert np.array_equal(stack[:], frames)
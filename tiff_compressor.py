@@ -6,40 +6,343 @@ Compress-a-tron 5000
 
 Compress those massive tiff files down to a hdf5
 
+Pages are decoded in a thread pool a chunk's worth of frames at a time, each
+HDF5 chunk is shuffled and compressed in the pool too, and the main thread
+just writes the finished chunks with write_direct_chunk. The output is a
+normal HDF5 file (dataset 'espray', frames x height x width) with the filters
+recorded on the dataset, so any HDF5 reader can open it. zstd and blosc
+need the hdf5plugin package to read back (and imagecodecs to write).
+
+Give it a directory to convert every ESPRAY_*_IMAGES.tiff in it, several
+files at once in separate processes. Outputs that are already complete are
+skipped and half-finished ones carry on where they stopped, so it can be left
+to archive a week of runs overnight:
+
+    python tiff_compressor.py "D:/espray data" --codec zstd --jobs 4 --threads 2
+
 @author: edh1g18
 """
 
+import argparse
+import glob
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import numpy as np
 import tifffile
 import h5py
 
-def tiff_to_h5(input_fp, output_fp):
+try:
+    import imagecodecs
+    import hdf5plugin
+except ImportError:
+    imagecodecs = hdf5plugin = None
+
+# Default levels for each codec (gzip was 9 before the other codecs came in, 4 is nearly as small and several times faster)
+CODEC_LEVELS = {"gzip": 4, "zstd": 3, "blosc-lz4": 5, "blosc-zstd": 3, "none": None}
+
+CHUNK_TARGET_BYTES = 4 * 1024 * 1024   # Aim for ~4 MB chunks by default
+
+
+def shuffle_bytes(data):
+    """HDF5 shuffle filter: all the first bytes of each value, then all the second bytes, ..."""
+    return np.ascontiguousarray(data).view(np.uint8).reshape(-1, data.dtype.itemsize).T.tobytes()
+
+
+def dataset_filters(codec, level):
+    """h5py create_dataset() keywords for a codec, matching encode_chunk()"""
+    if codec == "none":
+        return {}
+    if codec == "gzip":
+        return {"compression": "gzip", "compression_opts": level, "shuffle": True}
+    if hdf5plugin is None:
+        raise ImportError(f"The {codec} codec needs the imagecodecs and hdf5plugin packages")
+    if codec == "zstd":
+        return dict(hdf5plugin.Zstd(clevel=level), shuffle=True)
+    if codec in ("blosc-lz4", "blosc-zstd"):
+        # Blosc does its own byte shuffle
+        return dict(hdf5plugin.Blosc(cname=codec.split("-")[1], clevel=level, shuffle=hdf5plugin.Blosc.SHUFFLE))
+    raise ValueError(f"Unknown codec '{codec}' (choose from {', '.join(CODEC_LEVELS)})")
+
+
+def encode_chunk(chunk, codec, level):
+    """Encode one full HDF5 chunk exactly as the dataset's filter pipeline would."""
+    if codec == "none":
+        return np.ascontiguousarray(chunk).tobytes()
+    if codec == "gzip":
+        return zlib.compress(shuffle_bytes(chunk), level)
+    if codec == "zstd":
+        return imagecodecs.zstd_encode(shuffle_bytes(chunk), level)
+    return imagecodecs.blosc_encode(np.ascontiguousarray(chunk), level, compressor=codec.split("-")[1],
+                                    shuffle=1, typesize=chunk.dtype.itemsize)
+
+
+def default_chunk_shape(h, w, itemsize):
+    """Whole frames per chunk, as many as fit in CHUNK_TARGET_BYTES"""
+    return (max(1, CHUNK_TARGET_BYTES // (h * w * itemsize)), h, w)
+
+
+def read_and_encode(pages, start, chunk_shape, codec, level):
+    """
+    Decode a block of pages (starting at frame `start`) and encode it as HDF5 chunks.
+    Returns a list of (chunk offset, encoded bytes) and the raw byte count.
+    """
+    frames = np.stack([page.asarray() for page in pages])
+    n, h, w = frames.shape
+    cf, ch, cw = chunk_shape
+
+    # Chunks are always full size in HDF5, so pad the block (edges are cropped on read)
+    if (n, h, w) != (cf, -(-h // ch) * ch, -(-w // cw) * cw):
+        padded = np.zeros((cf, -(-h // ch) * ch, -(-w // cw) * cw), dtype=frames.dtype)
+        padded[:n, :h, :w] = frames
+    else:
+        padded = frames
+
+    encoded = []
+    for y in range(0, h, ch):
+        for x in range(0, w, cw):
+            encoded.append(((start, y, x), encode_chunk(padded[:, y:y + ch, x:x + cw], codec, level)))
+    return encoded, frames.nbytes
+
+
+def conversion_state(input_fp, output_fp):
+    """
+    How far an earlier conversion of input_fp got: returns (state, frames_written) with
+    state "missing", "complete", "partial" or "mismatch" (made from a different source file).
+    A file is only complete if it says so and its frame count matches the TIFF's.
+    """
+    if not os.path.exists(output_fp):
+        return "missing", 0
+    try:
+        with h5py.File(output_fp, 'r') as h5_in:
+            attrs = h5_in['espray'].attrs
+            source = (attrs.get("source_name"), attrs.get("source_size"))
+            frames_written = int(attrs.get("frames_written", 0))
+            source_frames = int(attrs.get("source_frames", -1))
+            complete = bool(attrs.get("complete", False))
+            n_dataset = h5_in['espray'].shape[0]
+    except (OSError, KeyError):
+        return "mismatch", 0    # Unreadable or not one of ours, convert from scratch
+
+    if source != (os.path.basename(input_fp), os.path.getsize(input_fp)):
+        return "mismatch", 0
+    if complete and frames_written == source_frames == n_dataset:
+        return "complete", frames_written
+    return "partial", frames_written
+
+
+def tiff_to_h5(input_fp, output_fp, codec="gzip", level=None, chunk_shape=None, workers=4, report_every_s=5.0,
+               resume=True):
+    """
+    Convert a TIFF stack to HDF5. Returns a dict of stats (frames, bytes in/out, seconds, MB/s).
+
+    codec: one of CODEC_LEVELS ("gzip", "zstd", "blosc-lz4", "blosc-zstd", "none")
+    chunk_shape: (frames, rows, cols) per HDF5 chunk, or just a number of whole frames,
+                 default whole frames ~4 MB per chunk
+    resume: carry on from a partial output (keeping its codec and chunks) instead of starting again
+
+    Progress is saved in the dataset's "frames_written" attribute (and the file
+    flushed) at each progress report, so an interrupted conversion can resume.
+    """
+    state, first_frame = conversion_state(input_fp, output_fp) if resume else ("missing", 0)
+    if state == "complete":
+        print(f"{output_fp} is already complete, skipping")
+        return {"frames": first_frame, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0, "mb_per_s": 0.0,
+                "ratio": 0.0, "skipped": True}
+
     print(f"Opening {input_fp}")
+    t0 = time.perf_counter()
+    bytes_in = 0
+    bytes_out = 0
+
     with tifffile.TiffFile(input_fp) as tiff_in:
+        tiff_in.filehandle.set_lock(True)   # Page data is read from several threads
         num_frames = len(tiff_in.pages)
-        
+
         frame_0 = tiff_in.pages[0].asarray()
         h,w = frame_0.shape
         data_type = frame_0.dtype
-        
-        print(f"File has {num_frames} frames, each {w}x{h} px./nCompressing now to HDF5 at {output_fp}")
-        
-        with h5py.File(output_fp, 'w') as h5_out:
-            dataset = h5_out.create_dataset(
-                'espray',
-                shape = (num_frames, h, w),
-                dtype = data_type,
-                compression = 'gzip',
-                compression_opts=9)
-            
-            for i, page in enumerate(tiff_in.pages):
-                dataset[i] = page.asarray()
-                
-                if i % 10 == 0:
-                    print(f"Converted frame {i}/{num_frames}")
-                
-                
-    print("Conversion complete.")
-                
-input_fp = "C:/Users/edh1g18/localfiles/test files/ESPRAY_2026-03-10_1546_IMAGES.tiff"
-output_fp ="C:/Users/edh1g18/localfiles/test files/ESPRAY_2026-03-10_1546_IMAGES_COMPRESSED.h5"
-tiff_to_h5(input_fp, output_fp)
\ No newline at end of file
+
+        if state == "partial":
+            h5_out = h5py.File(output_fp, 'a')
+            dataset = h5_out['espray']
+            codec = dataset.attrs["codec"]
+            level = dataset.attrs["level"] if codec != "none" else None
+            chunk_shape = dataset.chunks
+            print(f"Resuming {output_fp} from frame {first_frame}")
+        else:
+            if level is None:
+                level = CODEC_LEVELS[codec]
+            if chunk_shape is None:
+                chunk_shape = default_chunk_shape(h, w, data_type.itemsize)
+            elif isinstance(chunk_shape, int):
+                chunk_shape = (chunk_shape, h, w)
+            chunk_shape = (min(chunk_shape[0], num_frames), min(chunk_shape[1], h), min(chunk_shape[2], w))
+            first_frame = 0
+
+            h5_out = h5py.File(output_fp, 'w')
+            try:
+                dataset = h5_out.create_dataset(
+                    'espray',
+                    shape = (num_frames, h, w),
+                    dtype = data_type,
+                    chunks = chunk_shape,
+                    **dataset_filters(codec, level))
+                dataset.attrs.update({
+                    "source_name": os.path.basename(input_fp),
+                    "source_size": os.path.getsize(input_fp),
+                    "source_frames": num_frames,
+                    "codec": codec,
+                    "level": level if level is not None else 0,
+                    "frames_written": 0,
+                    "complete": False,
+                    })
+            except BaseException:
+                h5_out.close()      # e.g. a codec hdf5plugin isn't there for, don't leave the file open
+                raise
+
+        print(f"File has {num_frames} frames, each {w}x{h} px.\nCompressing now to HDF5 at {output_fp} "
+              f"({codec}, level {level}, chunks {chunk_shape}, {workers} workers)")
+
+        with h5_out:
+            blocks = [(start, min(start + chunk_shape[0], num_frames))
+                      for start in range(first_frame, num_frames, chunk_shape[0])]
+            last_report = time.perf_counter()
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                # Keep a bounded number of blocks in flight so memory use stays flat
+                in_flight = []
+                next_block = 0
+                done_frames = first_frame
+                while next_block < len(blocks) or in_flight:
+                    while next_block < len(blocks) and len(in_flight) < 2 * workers:
+                        start, stop = blocks[next_block]
+                        # Parsing the page headers isn't thread safe, so that stays here (holding the
+                        # file lock the decoding threads use), only decoding is in the pool
+                        with tiff_in.filehandle.lock:
+                            pages = [tiff_in.pages[i] for i in range(start, stop)]
+                        in_flight.append((stop - start, pool.submit(read_and_encode, pages, start,
+                                                                    chunk_shape, codec, level)))
+                        next_block += 1
+
+                    # Write in order as each block finishes
+                    n, future = in_flight.pop(0)
+                    encoded, raw_bytes = future.result()
+                    for offset, data in encoded:
+                        dataset.id.write_direct_chunk(offset, data)
+                        bytes_out += len(data)
+                    bytes_in += raw_bytes
+                    done_frames += n
+
+                    if time.perf_counter() - last_report >= report_every_s:
+                        dataset.attrs["frames_written"] = done_frames
+                        h5_out.flush()
+                        elapsed = time.perf_counter() - t0
+                        print(f"Converted frame {done_frames}/{num_frames} "
+                              f"({bytes_in / elapsed / 1e6:.1f} MB/s, ratio {bytes_in / max(1, bytes_out):.2f})")
+                        last_report = time.perf_counter()
+
+            dataset.attrs["frames_written"] = done_frames
+            dataset.attrs["complete"] = True
+
+    elapsed = time.perf_counter() - t0
+    stats = {
+        "frames": num_frames,
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "seconds": elapsed,
+        "mb_per_s": bytes_in / elapsed / 1e6,
+        "ratio": bytes_in / max(1, bytes_out),
+        "skipped": False,
+        }
+    print(f"Conversion complete: {stats['mb_per_s']:.1f} MB/s, ratio {stats['ratio']:.2f}, {elapsed:.1f} s")
+    return stats
+
+
+# --- BATCH CONVERSION ---
+def output_path_for(input_fp, output_dir=None):
+    """ESPRAY_..._IMAGES.tiff -> ESPRAY_..._IMAGES_COMPRESSED.h5 (next to it, or in output_dir)"""
+    stem = os.path.splitext(os.path.basename(input_fp))[0]
+    return os.path.join(output_dir or os.path.dirname(input_fp), f"{stem}_COMPRESSED.h5")
+
+
+def find_image_files(directory, pattern="ESPRAY_*_IMAGES.tiff", recursive=False):
+    """Camera recordings in a data directory, oldest first (the names start with the date)"""
+    search = os.path.join(directory, "**", pattern) if recursive else os.path.join(directory, pattern)
+    return sorted(glob.glob(search, recursive=recursive))
+
+
+def convert_one(input_fp, output_fp, options):
+    """Process pool entry point: convert one file, returning (input_fp, stats or error text)"""
+    try:
+        return input_fp, tiff_to_h5(input_fp, output_fp, **options)
+    except Exception as e:
+        return input_fp, f"{type(e).__name__}: {e}"
+
+
+def convert_directory(directory, output_dir=None, jobs=None, pattern="ESPRAY_*_IMAGES.tiff", recursive=False,
+                      overwrite=False, **options):
+    """
+    Convert every matching TIFF in `directory`, `jobs` files at a time in
+    separate processes. Finished outputs are skipped and partial ones resumed
+    (unless overwrite). Other keyword arguments go to tiff_to_h5, e.g. codec
+    and workers (threads per file). Returns {input_fp: stats dict or error text}.
+    """
+    files = find_image_files(directory, pattern, recursive)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    options["resume"] = not overwrite
+
+    todo = []
+    for input_fp in files:
+        output_fp = output_path_for(input_fp, output_dir)
+        state, frames_written = conversion_state(input_fp, output_fp)
+        if state == "complete" and not overwrite:
+            print(f"Skipping {os.path.basename(input_fp)} (already converted)")
+            continue
+        todo.append((input_fp, output_fp))
+    print(f"Found {len(files)} files in {directory}, {len(todo)} to convert")
+
+    jobs = jobs or max(1, (os.cpu_count() or 1) // options.get("workers", 4))
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(convert_one, input_fp, output_fp, options) for input_fp, output_fp in todo]
+        for future in as_completed(futures):
+            input_fp, result = future.result()
+            results[input_fp] = result
+            if isinstance(result, str):
+                print(f"FAILED {os.path.basename(input_fp)}: {result}")
+            else:
+                print(f"Finished {os.path.basename(input_fp)} ({len(results)}/{len(todo)})")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compress camera TIFF stacks to HDF5.")
+    parser.add_argument("input", help="An _IMAGES.tiff file, or a directory to convert all ESPRAY_*_IMAGES.tiff in")
+    parser.add_argument("--output", help="Output file (single file) or directory (batch), default next to the input")
+    parser.add_argument("--codec", default="gzip", choices=list(CODEC_LEVELS))
+    parser.add_argument("--level", type=int, help="Compression level (default depends on the codec)")
+    parser.add_argument("--chunk-frames", type=int, help="Frames per HDF5 chunk (default ~4 MB chunks)")
+    parser.add_argument("--threads", type=int, default=4, help="Decode/compress threads per file")
+    parser.add_argument("--jobs", type=int, help="Files converted at once in batch mode (default cores / threads)")
+    parser.add_argument("--pattern", default="ESPRAY_*_IMAGES.tiff", help="File pattern in batch mode")
+    parser.add_argument("--recursive", action="store_true", help="Also search subdirectories in batch mode")
+    parser.add_argument("--overwrite", action="store_true", help="Convert again even if the output is complete")
+    args = parser.parse_args(argv)
+
+    options = {"codec": args.codec, "level": args.level, "workers": args.threads, "chunk_shape": args.chunk_frames}
+
+    if os.path.isdir(args.input):
+        results = convert_directory(args.input, args.output, args.jobs, args.pattern, args.recursive,
+                                    args.overwrite, **options)
+        return 1 if any(isinstance(r, str) for r in results.values()) else 0
+
+    tiff_to_h5(args.input, args.output or output_path_for(args.input), resume=not args.overwrite, **options)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
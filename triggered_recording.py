@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Triggered recording
+
+Instead of saving every frame of a long run, only keep the frames around
+events. The camera writer passes every frame through a TriggeredRecorder,
+which keeps the last pre_frames of them in memory. When an event comes in
+(a current spike or polarity reversal seen by DAQWorker, or the "Record
+event" button) the frames in memory from pre_frames before the event are
+saved, followed by the next post_frames. An event during the post window
+extends it.
+
+Events can come from any thread (trigger() only takes a lock and appends),
+and are dealt with when the next frame arrives. An event can say which
+frame it happened in (the DAQ's Frame ID), so the time it takes to reach the
+camera thread doesn't shift the window.
+
+Frame IDs count the frames received since the start of the run, the same as
+the DAQ's Frame ID column. The saved frames are summary()["segments"], runs
+of [first, last] frame IDs, which go in the "storage" section of the run's
+_METADATA.json so experiment_reader.py knows which frame each page is.
+
+The ring holds references to the frames (they're already copies of the SDK
+buffer), so memory use is pre_frames full frames: about 25 MB each at full
+sensor.
+
+@author: edh1g18
+"""
+
+import threading
+import time
+from collections import deque
+
+RECORD_MODES = ("Continuous", "Triggered")
+
+
+class TriggeredRecorder:
+    """Pre-trigger ring and post-trigger window, see the module docstring."""
+    def __init__(self, pre_frames=10, post_frames=30):
+        self.pre_frames = pre_frames
+        self.post_frames = post_frames
+        self.ring = deque(maxlen=pre_frames)    # (frame ID, image) not saved (yet)
+        self.frame_id = 0                       # Latest frame received
+        self.record_until = 0                   # Save every frame up to this ID
+        self.events = []
+        self.segments = []                      # [first, last] frame IDs saved
+        self.frames_saved = 0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def trigger(self, reason, frame_id=None):
+        """Record around an event. frame_id is the frame it happened in (None for the latest)."""
+        with self._lock:
+            self._pending.append((reason, frame_id))
+
+    def add(self, image):
+        """Call for every frame received. Returns the frames to save now, oldest first."""
+        self.frame_id += 1
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        to_save = []
+        if pending:
+            first = self.frame_id
+            for reason, frame_id in pending:
+                event_frame = min(frame_id or self.frame_id, self.frame_id)
+                first = min(first, event_frame - self.pre_frames)
+                self.record_until = max(self.record_until, event_frame + self.post_frames)
+                self.events.append({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "frame": event_frame, "reason": reason})
+
+            # Frames from before the event that are still in memory
+            to_save = [(frame_id, old_image) for frame_id, old_image in self.ring if first <= frame_id <= self.record_until]
+
+        if self.frame_id <= self.record_until:
+            to_save.append((self.frame_id, image))
+        else:
+            self.ring.append((self.frame_id, image))
+
+        # Anything older than what's saved now can't be saved later (pages have to stay in frame order)
+        if to_save:
+            last = to_save[-1][0]
+            self.ring = deque(((frame_id, old_image) for frame_id, old_image in self.ring if frame_id > last),
+                              maxlen=self.ring.maxlen)
+
+        for frame_id, _ in to_save:
+            self.mark_saved(frame_id)
+        return [saved_image for _, saved_image in to_save]
+
+    def mark_saved(self, frame_id):
+        self.frames_saved += 1
+        if self.segments and self.segments[-1][1] == frame_id - 1:
+            self.segments[-1][1] = frame_id
+        else:
+            self.segments.append([frame_id, frame_id])
+
+    def summary(self):
+        return {
+            "pre_frames": self.pre_frames,
+            "post_frames": self.post_frames,
+            "frames_seen": self.frame_id,
+            "frames_saved": self.frames_saved,
+            "events": self.events,
+            "segments": self.segments,
+            }